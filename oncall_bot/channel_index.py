@@ -0,0 +1,256 @@
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+from sqlalchemy import Engine, delete, select
+
+from oncall_bot.config import load_config
+from oncall_bot.local_db import dialect_insert, get_local_engine
+from oncall_bot.slack_client import get_slack_client
+from oncall_bot.pagerduty import get_pagerduty_client
+from oncall_bot.slack_app import get_slack_read_cache
+from oncall_bot.storage import get_storage
+from oncall_bot.tables import ChannelResolution, OncallInfo
+from oncall_bot.utils import get_key, utcnow
+
+
+def find_pagerduty_url_in_topic(topic: str) -> Optional[str]:
+    has_pagerduty_url = re.search(r"(?P<url>https://.*pagerduty.com/.*)", topic)
+    return has_pagerduty_url.group("url") if has_pagerduty_url else None
+
+
+def find_pagerduty_urls_in_bookmarks(bookmarks: List[Dict[str, Any]]) -> List[str]:
+    return [
+       bookmark.get("link", "") for bookmark in bookmarks
+       if "pagerduty_url" in bookmark.get("link", "")
+    ]
+
+
+def find_oncall_ping_in_topic(topic: str) -> Optional[str]:
+    found_oncall_user_from_topic = re.search(r":pagerduty: <@(?P<oncall_user>.*)>", topic)
+    if found_oncall_user_from_topic:
+        return f"<@{found_oncall_user_from_topic.group('oncall_user')}>"
+    return None
+
+
+def needs_bookmarks(configured_url: Optional[str], topic: str) -> bool:
+    return not configured_url and not find_pagerduty_url_in_topic(topic)
+
+
+def resolve_channel(
+    configured_url: Optional[str], topic: str, bookmarks: Optional[List[Dict[str, Any]]] = None
+) -> Dict[str, Any]:
+    # same precedence as the ping command always used: the configured url, the topic, then bookmarks
+    if configured_url:
+        pagerduty_urls, source = [configured_url], "oncall_info"
+    elif find_pagerduty_url_in_topic(topic):
+        pagerduty_urls, source = [find_pagerduty_url_in_topic(topic)], "topic"
+    else:
+        pagerduty_urls = find_pagerduty_urls_in_bookmarks(bookmarks or [])
+        source = "bookmarks" if pagerduty_urls else None
+    return {
+        "pagerduty_urls": pagerduty_urls,
+        "source": source,
+        "oncall_pings": find_oncall_ping_in_topic(topic),
+    }
+
+
+class ChannelIndex(object):
+
+    def __init__(self, engine: Engine, ttl: float, topic_ttl: Optional[float] = None):
+        self.engine = engine
+        self.ttl = ttl
+        # topics change often, so ping targets read from one go stale as fast as the channel info
+        self.topic_ttl = ttl if topic_ttl is None else min(topic_ttl, ttl)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.loaded = False
+        self.stats: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        with self.engine.connect() as conn:
+            entries = {row.channel_id: row._asdict() for row in conn.execute(select(ChannelResolution))}
+        with self._lock:
+            entries.update(self.entries)
+            self.entries = entries
+            self.loaded = True
+
+    def get(self, channel_id: str) -> Optional[Dict[str, Any]]:
+        if not self.loaded:
+            self.load()
+        with self._lock:
+            entry = self.entries.get(channel_id)
+            from_topic = entry is not None and (entry["oncall_pings"] or entry["source"] == "topic")
+            ttl = self.topic_ttl if from_topic else self.ttl
+            # entries that no event refreshed are resolved again now and then
+            if entry is None or entry["resolved_at"] < utcnow() - timedelta(seconds=ttl):
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            return entry
+
+    def update(self, channel_id: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+        return self.update_many({channel_id: entry})[channel_id]
+
+    def update_many(self, entries: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        if not entries:
+            return {}
+        resolved_at = utcnow()
+        rows = {
+            channel_id: {**entry, "channel_id": channel_id, "resolved_at": resolved_at}
+            for channel_id, entry in entries.items()
+        }
+        stmt = dialect_insert(self.engine)(ChannelResolution)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ChannelResolution.c.channel_id],
+            set_={column: stmt.excluded[column] for column in ["pagerduty_urls", "source", "oncall_pings", "resolved_at"]},
+        )
+        with self.engine.begin() as conn:
+            conn.execute(stmt, list(rows.values()))
+        with self._lock:
+            self.entries.update(rows)
+            self.stats["updates"] += len(rows)
+        return rows
+
+    def invalidate(self, channel_ids: Iterable[str]) -> None:
+        channel_ids = list(channel_ids)
+        with self._lock:
+            for channel_id in channel_ids:
+                self.entries.pop(channel_id, None)
+            self.stats["invalidations"] += len(channel_ids)
+        with self.engine.begin() as conn:
+            conn.execute(delete(ChannelResolution).where(ChannelResolution.c.channel_id.in_(channel_ids)))
+
+    def build(self, client: WebClient) -> None:
+        # users.conversations returns each channel's topic, so only channels without a url
+        # configured or in the topic need their bookmarks listed
+        storage = get_storage()
+        entries = {}
+        cursor = None
+        while True:
+            response = client.users_conversations(
+                types="public_channel,private_channel", exclude_archived=True, limit=200, cursor=cursor
+            )
+            for channel in response["channels"]:
+                row = storage.query_table(OncallInfo, channel["id"], [OncallInfo.c.pagerduty_url])
+                configured_url = (row or {}).get(OncallInfo.c.pagerduty_url.name)
+                topic = get_key(channel, "topic.value") or ""
+                bookmarks = None
+                if needs_bookmarks(configured_url, topic):
+                    try:
+                        bookmarks = client.bookmarks_list(channel_id=channel["id"])["bookmarks"]
+                    except SlackApiError as e:
+                        # left out of the index, the channel is resolved when it's first pinged
+                        print(f"Error listing bookmarks of {channel['id']}: {str(e)}")
+                        self.stats["build_failures"] += 1
+                        continue
+                entries[channel["id"]] = resolve_channel(configured_url, topic, bookmarks)
+            cursor = get_key(response, "response_metadata.next_cursor")
+            if not cursor:
+                break
+        self.update_many(entries)
+        print(f"Indexed pagerduty for {len(entries)} channels")
+
+        # one sweep warms the on-call cache for every channel the bot is in
+        pagerduty_urls = sorted({url for entry in entries.values() for url in entry["pagerduty_urls"]})
+        get_pagerduty_client().get_oncall_bulk(pagerduty_urls)
+
+    def start_build(self) -> None:
+        client = get_slack_client()
+
+        def build():
+            try:
+                self.build(client)
+            except Exception as e:
+                print(f"Error building channel index: {str(e)}")
+
+        threading.Thread(target=build, name="channel-index", daemon=True).start()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"channels": len(self.entries), **self.stats}
+
+
+_channel_index: Optional[ChannelIndex] = None
+
+
+def get_channel_index() -> ChannelIndex:
+    global _channel_index
+    if _channel_index is None:
+        _channel_index = ChannelIndex(
+            get_local_engine(), load_config().channel_index_ttl, topic_ttl=load_config().slack_cache_ttl
+        )
+        # a pagerduty url set through the bot or edited in the sheet replaces the resolved one
+        get_storage().watch(OncallInfo, _channel_index.invalidate)
+    return _channel_index
+
+
+class ChannelRefresher(object):
+
+    # channel events re-read the channel in the background instead of every command checking it
+    def __init__(self, client: WebClient, max_workers: int = 2):
+        self.client = client
+        self.pending: Set[str] = set()
+        self.stats: Counter = Counter()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="channel-refresher")
+
+    def submit(self, channel_id: str, reason: str) -> None:
+        with self._lock:
+            self.stats[reason] += 1
+            # a burst of events for one channel needs a single refresh
+            if channel_id in self.pending:
+                self.stats["coalesced"] += 1
+                return
+            self.pending.add(channel_id)
+        self._pool.submit(self._refresh, channel_id)
+
+    def _refresh(self, channel_id: str) -> None:
+        with self._lock:
+            self.pending.discard(channel_id)
+        try:
+            self.refresh(channel_id)
+            self.stats["refreshed"] += 1
+        except Exception as e:
+            self.stats["failures"] += 1
+            print(f"Error refreshing channel {channel_id}: {str(e)}")
+
+    def refresh(self, channel_id: str) -> None:
+        read_cache = get_slack_read_cache()
+        read_cache.invalidate_channel(channel_id)
+        channel = self.client.conversations_info(channel=channel_id)["channel"]
+        read_cache.channel_info.set(channel_id, channel)
+
+        storage = get_storage()
+        row = storage.query_table(OncallInfo, channel_id, [OncallInfo.c.channel_name, OncallInfo.c.pagerduty_url])
+        channel_name = "#" + channel["name"].lstrip("#")
+        if row is not None and row[OncallInfo.c.channel_name.name] != channel_name:
+            storage.upsert_table(OncallInfo, channel_id, {OncallInfo.c.channel_name.name: channel_name})
+
+        configured_url = (row or {}).get(OncallInfo.c.pagerduty_url.name)
+        topic = get_key(channel, "topic.value") or ""
+        bookmarks = None
+        if needs_bookmarks(configured_url, topic):
+            bookmarks = self.client.bookmarks_list(channel_id=channel_id)["bookmarks"]
+            read_cache.bookmarks.set(channel_id, bookmarks)
+        get_channel_index().update(channel_id, resolve_channel(configured_url, topic, bookmarks))
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"pending": len(self.pending), **self.stats}
+
+
+_channel_refresher: Optional[ChannelRefresher] = None
+
+
+def get_channel_refresher() -> ChannelRefresher:
+    global _channel_refresher
+    if _channel_refresher is None:
+        client = get_slack_client()
+        _channel_refresher = ChannelRefresher(client)
+    return _channel_refresher
@@ -2,7 +2,7 @@ import json
 import os
 from dataclasses import dataclass, field
 from functools import lru_cache, partial
-from typing import Callable, Dict, Optional, Type, TypeVar
+from typing import Any, Callable, Dict, List, Optional, Type, TypeVar
 
 import yaml
 from dotenv import load_dotenv
@@ -22,6 +22,41 @@ class Config(object):
     google_sheet_root_db: str = field(default_factory=from_env("GOOGLE_SHEET_ROOT_DB"))
     google_sheet_root_id: str = field(default_factory=from_env("GOOGLE_SHEET_ROOT_ID"))
     jira: Dict[str, str] = field(default_factory=from_env("JIRA"))
+    # e.g. sqlite:///oncall.db or postgresql://..., google sheets are used when unset
+    storage_url: Optional[str] = field(default_factory=from_env("STORAGE_URL"))
+    storage_mirror_to_gsheets: bool = False
+    storage_refresh_interval: int = 60
+    async_mode: bool = False
+    command_workers: int = 8
+    command_queue_size: int = 200
+    pagerduty_oncall_cache_seconds: int = 3600
+    pagerduty_escalation_levels: int = 1
+    pagerduty_max_incident_pages: int = 100
+    local_db_url: str = "sqlite:////tmp/oncall_bot.db"
+    # requests are acknowledged once they are in this file, so it must be on a persistent volume;
+    # unset, each request is written to storage before its workflow step completes
+    journal_path: Optional[str] = field(default_factory=from_env("JOURNAL_PATH"))
+    journal_batch_size: int = 200
+    journal_flush_interval: int = 5
+    # rollups of the last request_rollup_recent_days days are rebuilt after request_rollup_ttl seconds
+    # to pick up hand edits to tracking sheets
+    request_rollup_ttl: int = 3600
+    request_rollup_recent_days: int = 7
+    jira_identity_ttl: int = 7 * 24 * 3600
+    jira_identity_negative_ttl: int = 3600
+    # one per channel, e.g. {"channel": "C0123", "weekday": "monday", "time": "09:00", "time_zone": "US/Pacific"}
+    digests: List[Dict[str, Any]] = field(default_factory=list)
+    digest_stagger_seconds: int = 60
+    slack_cache_ttl: int = 300
+    channel_index_ttl: int = 24 * 3600
+    # serves /metrics for prometheus on every interface so it can be scraped from outside the container,
+    # port 0 disables it
+    metrics_host: str = "0.0.0.0"
+    metrics_port: int = 9090
+    # seconds the bot's imports may take before startup warns, see `make profile-startup`
+    startup_import_budget: float = 2.0
+    # preload the lazily imported clients once the socket is connected
+    warm_up: bool = True
 
 @lru_cache(1)
 def load_config() -> Config:
@@ -0,0 +1,109 @@
+import re
+import threading
+from collections import Counter
+from datetime import datetime, time, timedelta
+from typing import Any, Dict, Optional
+
+from oncall_bot.cache import ExpiringCache
+
+# the results match what dateparser.parse returns for the same phrases
+RELATIVE_DAYS = {"now": 0, "today": 0, "yesterday": -1, "tomorrow": 1, "last week": -7}
+WEEKDAYS = {
+    "mon": 0, "monday": 0,
+    "tue": 1, "tues": 1, "tuesday": 1,
+    "wed": 2, "wednesday": 2,
+    "thu": 3, "thursday": 3,
+    "fri": 4, "friday": 4,
+    "sat": 5, "saturday": 5,
+    "sun": 6, "sunday": 6,
+}
+UNITS = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+}
+
+AGO = re.compile(r"(\d+|an?|one) (minute|hour|day|week)s? ago")
+ISO_DATE = re.compile(r"(\d{4})[-/](\d{1,2})[-/](\d{1,2})")
+ISO_DATETIME = re.compile(r"\d{4}-\d{2}-\d{2}[t ]\S+")
+
+# fallback phrases are parsed against the current time with this microsecond, relative results keep it
+REFERENCE_MICROSECOND = 123457
+
+_stats: Counter = Counter()
+_stats_lock = threading.Lock()
+# fallback results per phrase and day, as an offset from the current time or a fixed datetime
+_fallback = ExpiringCache("dates_fallback", maxsize=1024)
+_UNSET = object()
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.strip().lower().split())
+
+
+def fast_parse(normalized: str, now: datetime) -> Optional[datetime]:
+    if normalized in RELATIVE_DAYS:
+        return now + timedelta(days=RELATIVE_DAYS[normalized])
+    if normalized in WEEKDAYS:
+        # the most recent one, today included
+        days = (now.weekday() - WEEKDAYS[normalized]) % 7
+        return datetime.combine(now.date() - timedelta(days=days), time())
+    match = AGO.fullmatch(normalized)
+    if match:
+        count = int(match.group(1)) if match.group(1).isdigit() else 1
+        return now - count * UNITS[match.group(2)]
+    match = ISO_DATE.fullmatch(normalized)
+    if match:
+        try:
+            return datetime(*map(int, match.groups()))
+        except ValueError:
+            return None
+    if ISO_DATETIME.fullmatch(normalized):
+        try:
+            return datetime.fromisoformat(normalized.upper())
+        except ValueError:
+            return None
+    return None
+
+
+def fallback_parse(normalized: str, now: datetime) -> Optional[datetime]:
+    # within a day, "1 month ago" is always the same offset from now and "10am" the same datetime
+    key = (normalized, now.date())
+    cached = _fallback.get(key, _UNSET)
+    if cached is _UNSET:
+        import dateparser
+
+        reference = now.replace(microsecond=REFERENCE_MICROSECOND)
+        parsed = dateparser.parse(normalized, languages=["en"], settings={"RELATIVE_BASE": reference})
+        if parsed is not None and parsed.tzinfo is None and parsed.microsecond == REFERENCE_MICROSECOND:
+            cached = (True, parsed - reference)
+        else:
+            cached = (False, parsed)
+        _fallback.set(key, cached)
+    relative, value = cached
+    return now + value if relative else value
+
+
+def parse_date(text: str, now: Optional[datetime] = None) -> Optional[datetime]:
+    now = now or datetime.now()
+    normalized = normalize(text)
+    parsed = fast_parse(normalized, now)
+    with _stats_lock:
+        _stats["fast" if parsed is not None else "fallback"] += 1
+    if parsed is None:
+        parsed = fallback_parse(normalized, now)
+    return parsed
+
+
+def load_fallback() -> None:
+    # dateparser loads its language data on the first parse
+    import dateparser
+
+    dateparser.parse("1 month ago", languages=["en"])
+
+
+def parse_metrics() -> Dict[str, Any]:
+    cache = _fallback.metrics()
+    with _stats_lock:
+        return {**_stats, "fallback_cache_hits": cache.get("hits", 0), "fallback_cache_size": cache["size"]}
@@ -0,0 +1,173 @@
+import threading
+import time
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta, timezone
+from datetime import time as time_of_day
+from typing import Any, Callable, Dict, List, Optional
+
+import pytz
+from slack_sdk import WebClient
+from sqlalchemy import Engine, select
+
+from oncall_bot.config import load_config
+from oncall_bot.local_db import dialect_insert, get_local_engine
+from oncall_bot.slack_client import get_slack_client
+from oncall_bot.mention_bot import build_summary
+from oncall_bot.tables import DigestState
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+# a digest without a weekday is posted daily
+Digest = namedtuple("Digest", ["channel", "weekday", "time", "time_zone"])
+
+
+def parse_digest(spec: Dict[str, Any]) -> Digest:
+    weekday = spec.get("weekday")
+    hour, minute = [int(part) for part in spec.get("time", "09:00").split(":")]
+    return Digest(
+        spec["channel"],
+        WEEKDAYS.index(weekday.lower()) if weekday else None,
+        time_of_day(hour, minute),
+        spec.get("time_zone", "UTC"),
+    )
+
+
+def digest_period(digest: Digest) -> timedelta:
+    return timedelta(days=1 if digest.weekday is None else 7)
+
+
+def _occurrence(digest: Digest, day: datetime) -> Optional[datetime]:
+    if digest.weekday is not None and day.weekday() != digest.weekday:
+        return None
+    # localized per day so the posting time stays put across DST changes
+    local = pytz.timezone(digest.time_zone).localize(datetime.combine(day.date(), digest.time))
+    return local.astimezone(timezone.utc)
+
+
+def next_run(digest: Digest, after: datetime) -> datetime:
+    local_day = after.astimezone(pytz.timezone(digest.time_zone))
+    for offset in range(9):
+        run_at = _occurrence(digest, local_day + timedelta(days=offset))
+        if run_at is not None and run_at > after:
+            return run_at
+    raise ValueError(f"No run found for digest {digest}")
+
+
+def previous_run(digest: Digest, before: datetime) -> datetime:
+    local_day = before.astimezone(pytz.timezone(digest.time_zone))
+    for offset in range(9):
+        run_at = _occurrence(digest, local_day - timedelta(days=offset))
+        if run_at is not None and run_at <= before:
+            return run_at
+    raise ValueError(f"No run found for digest {digest}")
+
+
+class DigestScheduler(object):
+
+    def __init__(
+        self,
+        digests: List[Digest],
+        engine: Engine,
+        summarize: Callable[[str, datetime, datetime], List[str]],
+        post: Callable[[str, str], Any],
+        stagger_seconds: float = 60,
+    ):
+        self.digests = digests
+        self.engine = engine
+        self.summarize = summarize
+        self.post = post
+        self.stagger_seconds = stagger_seconds
+        self.due: Dict[str, datetime] = {}
+        self.stats: Counter = Counter()
+        self._thread: Optional[threading.Thread] = None
+
+    def last_run_end(self, channel: str) -> Optional[datetime]:
+        with self.engine.connect() as conn:
+            last_run_end = conn.execute(
+                select(DigestState.c.last_run_end).where(DigestState.c.channel_id == channel)
+            ).scalar()
+        return last_run_end.replace(tzinfo=timezone.utc) if last_run_end else None
+
+    def record_run(self, channel: str, run_end: datetime) -> None:
+        values = {"channel_id": channel, "last_run_end": run_end.astimezone(timezone.utc).replace(tzinfo=None)}
+        stmt = dialect_insert(self.engine)(DigestState).values(values)
+        stmt = stmt.on_conflict_do_update(index_elements=[DigestState.c.channel_id], set_=values)
+        with self.engine.begin() as conn:
+            conn.execute(stmt)
+
+    def run(self, digest: Digest, last_run_end: datetime, run_end: datetime) -> None:
+        # each digest covers what happened since the previous one, so the incident archive and
+        # the daily rollups already hold everything before it and only the new interval is fetched
+        # aware datetimes, the summary would otherwise read them in the on-call person's time zone
+        tz = pytz.timezone(digest.time_zone)
+        summary_text = self.summarize(digest.channel, last_run_end.astimezone(tz), run_end.astimezone(tz))
+        if summary_text:
+            self.post(digest.channel, "\n".join(summary_text))
+        self.record_run(digest.channel, run_end)
+        print(f"Posted digest for {digest.channel} from {last_run_end} to {run_end}")
+
+    def run_pending(self, now: datetime) -> datetime:
+        wake_at = now + timedelta(minutes=5)
+        for digest in self.digests:
+            if digest.channel not in self.due:
+                last_run_end = self.last_run_end(digest.channel)
+                if last_run_end is None:
+                    # the first digest covers one full period rather than everything ever recorded
+                    last_run_end = previous_run(digest, now)
+                    self.record_run(digest.channel, last_run_end)
+                self.due[digest.channel] = next_run(digest, last_run_end)
+
+        sharing_due_time: Counter = Counter()
+        for digest in self.digests:
+            # channels sharing a posting time are spread out so they don't hit PagerDuty at once
+            due = self.due[digest.channel]
+            run_at = due + timedelta(seconds=sharing_due_time[due] * self.stagger_seconds)
+            sharing_due_time[due] += 1
+            if run_at > now:
+                wake_at = min(wake_at, run_at)
+                continue
+
+            # a digest missed while the bot was down is posted once, covering the whole gap
+            run_end = previous_run(digest, now)
+            try:
+                self.run(digest, self.last_run_end(digest.channel), run_end)
+                self.stats["posted"] += 1
+                self.due[digest.channel] = next_run(digest, run_end)
+            except Exception as e:
+                self.stats["failures"] += 1
+                print(f"Error posting digest for {digest.channel}: {str(e)}")
+                self.due[digest.channel] = now + timedelta(seconds=self.stagger_seconds)
+        return wake_at
+
+    def start(self) -> None:
+        if not self.digests or self._thread is not None:
+            return
+
+        def schedule_loop():
+            while True:
+                now = datetime.now(timezone.utc)
+                wake_at = self.run_pending(now)
+                time.sleep(max((wake_at - datetime.now(timezone.utc)).total_seconds(), 1))
+
+        self._thread = threading.Thread(target=schedule_loop, name="digest-scheduler", daemon=True)
+        self._thread.start()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"digests": len(self.digests), **self.stats}
+
+
+_scheduler: Optional[DigestScheduler] = None
+
+
+def get_digest_scheduler() -> DigestScheduler:
+    global _scheduler
+    if _scheduler is None:
+        client = get_slack_client()
+        _scheduler = DigestScheduler(
+            [parse_digest(spec) for spec in load_config().digests],
+            get_local_engine(),
+            build_summary,
+            lambda channel, text: client.chat_postMessage(channel=channel, text=text, mrkdwn=True),
+            stagger_seconds=load_config().digest_stagger_seconds,
+        )
+    return _scheduler
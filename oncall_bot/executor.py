@@ -0,0 +1,124 @@
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from collections import Counter, namedtuple
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from oncall_bot.config import load_config
+
+PRIORITY_URGENT = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_URGENT: "urgent",
+    PRIORITY_NORMAL: "normal",
+    PRIORITY_BULK: "bulk",
+}
+
+Task = namedtuple("Task", ["priority", "func", "args", "submitted_at"])
+
+
+class CommandExecutor(object):
+
+    def __init__(self, max_workers: int, max_queue_size: int):
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self._cond = threading.Condition()
+        # pending tasks per thread, by priority then submission; a thread runs at most one task at a time
+        self._threads: Dict[Hashable, List[Tuple[int, int, Task]]] = {}
+        # threads ready to run, ordered by the priority of their next task
+        self._ready: List[Tuple[int, int, Hashable]] = []
+        self._seq = itertools.count()
+        self._pending = 0
+        self._running = 0
+        self._shutdown = False
+        self.stats: Counter = Counter()
+        self._workers = [
+            threading.Thread(target=self._work, name=f"command-worker-{i}", daemon=True)
+            for i in range(max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, thread: Hashable, priority: int, func: Callable[..., Any], *args: Any) -> bool:
+        with self._cond:
+            if self._shutdown or self._pending >= self.max_queue_size:
+                self.stats[f"rejected.{PRIORITY_NAMES.get(priority, priority)}"] += 1
+                return False
+            queue = self._threads.get(thread)
+            if queue is None:
+                queue = self._threads[thread] = []
+                heapq.heappush(self._ready, (priority, next(self._seq), thread))
+            heapq.heappush(queue, (priority, next(self._seq), Task(priority, func, args, time.monotonic())))
+            self._pending += 1
+            self.stats[f"submitted.{PRIORITY_NAMES.get(priority, priority)}"] += 1
+            self._cond.notify()
+        return True
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while not self._ready and not self._shutdown:
+                    self._cond.wait()
+                if self._shutdown and not self._ready:
+                    return
+                _, _, thread = heapq.heappop(self._ready)
+                _, _, task = heapq.heappop(self._threads[thread])
+                self._pending -= 1
+                self._running += 1
+                wait_time = time.monotonic() - task.submitted_at
+                name = PRIORITY_NAMES.get(task.priority, task.priority)
+                self.stats[f"wait_seconds_total.{name}"] += wait_time
+                self.stats[f"wait_seconds_max.{name}"] = max(self.stats[f"wait_seconds_max.{name}"], wait_time)
+
+            try:
+                task.func(*task.args)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self.stats[f"completed.{name}"] += 1
+                    queue = self._threads[thread]
+                    if queue:
+                        heapq.heappush(self._ready, (queue[0][0], next(self._seq), thread))
+                        self._cond.notify()
+                    else:
+                        del self._threads[thread]
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            depth = Counter(
+                PRIORITY_NAMES.get(task.priority, task.priority)
+                for queue in self._threads.values()
+                for _, _, task in queue
+            )
+            return {
+                "workers": self.max_workers,
+                "running": self._running,
+                "queue_depth": self._pending,
+                "queued_threads": len(self._threads),
+                **{f"queue_depth.{name}": count for name, count in depth.items()},
+                **self.stats,
+            }
+
+
+_executor: Optional[CommandExecutor] = None
+
+
+def get_command_executor() -> Optional[CommandExecutor]:
+    global _executor
+    if _executor is None and load_config().command_workers > 0:
+        _executor = CommandExecutor(load_config().command_workers, load_config().command_queue_size)
+    return _executor
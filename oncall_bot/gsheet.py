@@ -1,70 +1,362 @@
 
-from datetime import datetime
-from typing import Any, Dict, List, Optional
+import asyncio
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
-import gspread
-from google.oauth2.service_account import Credentials
-from sqlalchemy import Column, Engine, Table, create_engine, select
+from sqlalchemy import Column, Connection, Engine, Table, bindparam, create_engine, func, select
 
 from oncall_bot.config import load_config
+from oncall_bot.metrics import STORAGE_SECONDS
+from oncall_bot.rollups import DailyRollups, empty_counts
 from oncall_bot.tables import OncallInfo, get_tracking_table
+from oncall_bot.utils import chunks
+
+
+def _column_name(column: Any) -> str:
+    return getattr(column, "name", column)
+
+
+class ReplicatedTable(object):
+
+    def __init__(self, table: Table, max_staleness: float):
+        self.table = table
+        self.primary_key = [key.name for key in table.primary_key][0]
+        self.max_staleness = max_staleness
+        self.rows: Dict[Any, Dict[str, Any]] = {}
+        self.loaded_at: Optional[float] = None
+        self.stats: Counter = Counter()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._written: Dict[Any, int] = {}
+
+    @property
+    def staleness(self) -> Optional[float]:
+        if self.loaded_at is None:
+            return None
+        return time.monotonic() - self.loaded_at
+
+    @property
+    def is_fresh(self) -> bool:
+        staleness = self.staleness
+        return staleness is not None and staleness <= self.max_staleness
+
+    def begin_refresh(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def refresh(self, rows: Iterable[Dict[str, Any]], generation: int) -> Tuple[Dict[str, int], Set[Any]]:
+        new_rows = {row[self.primary_key]: row for row in rows}
+        with self._lock:
+            initial_load = self.loaded_at is None
+            # keep rows written through while the snapshot was being read
+            for row_id, written_at in self._written.items():
+                if written_at > generation and row_id in self.rows:
+                    new_rows[row_id] = self.rows[row_id]
+            self._written = {
+                row_id: written_at for row_id, written_at in self._written.items() if written_at > generation
+            }
+            changes = {
+                "added": new_rows.keys() - self.rows.keys(),
+                "removed": self.rows.keys() - new_rows.keys(),
+                "changed": {
+                    row_id for row_id, row in new_rows.items()
+                    if row_id in self.rows and self.rows[row_id] != row
+                },
+            }
+            diff = {key: len(row_ids) for key, row_ids in changes.items()}
+            self.rows = new_rows
+            self.loaded_at = time.monotonic()
+            self.stats["refreshes"] += 1
+            self.stats.update({f"rows_{key}": value for key, value in diff.items()})
+        # the first snapshot is a load, not a change
+        if initial_load:
+            return diff, set()
+        return diff, set().union(*changes.values())
+
+    def get(self, row_id: Any, columns: List[Any]) -> Optional[dict]:
+        with self._lock:
+            row = self.rows.get(row_id)
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            return {_column_name(column): row.get(_column_name(column)) for column in columns}
+
+    def has(self, row_id: Any) -> bool:
+        with self._lock:
+            return row_id in self.rows
+
+    def apply(self, row_id: Any, data: Dict[str, Any]) -> None:
+        with self._lock:
+            self._generation += 1
+            self._written[row_id] = self._generation
+            row = dict(self.rows.get(row_id) or {column.name: None for column in self.table.columns})
+            row.update(data)
+            row[self.primary_key] = row_id
+            self.rows[row_id] = row
+            self.stats["writes"] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "table": self.table.name,
+                "rows": len(self.rows),
+                "staleness_seconds": self.staleness,
+                **self.stats,
+            }
+
+
+def metrics_table_name(table: Table) -> str:
+    # one series for all tracking sheets rather than one per sheet
+    return "tracking" if "tracking_url" in table.info else table.name
 
 
 class Storage(object):
 
     def __init__(self, engine: Engine):
         self.engine = engine
+        self.replicas: Dict[str, ReplicatedTable] = {}
+        self._refresher: Optional[threading.Thread] = None
+        self._stop_refresher = threading.Event()
+        # request summaries are served from daily rollups when set
+        self.rollups: Optional[DailyRollups] = None
+        # tracking sheets are also edited by hand, so their rollups are rebuilt after this many seconds
+        self.rollup_max_age: Optional[float] = None
+        self.rollup_recent_days = 0
+        self.watchers: Dict[str, List[Callable[[Set[Any]], None]]] = defaultdict(list)
+
+    def replicate(self, table: Table, refresh_interval: float) -> ReplicatedTable:
+        # allow a couple of failed refreshes before falling back to the backend
+        replica = ReplicatedTable(table, max_staleness=refresh_interval * 3)
+        self.replicas[table.name] = replica
+        return replica
+
+    def refresh_replicas(self) -> None:
+        for replica in self.replicas.values():
+            generation = replica.begin_refresh()
+            with self.engine.connect() as conn:
+                rows = [row._asdict() for row in conn.execute(replica.table.select())]
+            diff, changed_ids = replica.refresh(rows, generation)
+            print(f"Refreshed replica of {replica.table.name}: {diff}")
+            if changed_ids:
+                self.notify(replica.table.name, changed_ids)
+
+    def watch(self, table: Table, callback: Callable[[Set[Any]], None]) -> None:
+        # called with the ids of rows written through this storage or changed in the backend
+        self.watchers[table.name].append(callback)
+
+    def notify(self, table_name: str, row_ids: Set[Any]) -> None:
+        for callback in self.watchers.get(table_name, []):
+            try:
+                callback(row_ids)
+            except Exception as e:
+                print(f"Error notifying watcher of {table_name}: {str(e)}")
+
+    def start_replication(self, refresh_interval: float) -> None:
+        self.refresh_replicas()
+        if self._refresher is not None:
+            return
+
+        def refresh_loop():
+            while not self._stop_refresher.wait(refresh_interval):
+                try:
+                    self.refresh_replicas()
+                except Exception as e:
+                    print(f"Error refreshing replicas: {str(e)}")
+
+        self._refresher = threading.Thread(target=refresh_loop, name="storage-refresher", daemon=True)
+        self._refresher.start()
+
+    def stop_replication(self) -> None:
+        self._stop_refresher.set()
+
+    def replica_metrics(self) -> List[Dict[str, Any]]:
+        return [replica.metrics() for replica in self.replicas.values()]
 
     def create_table(self) -> None:
         with self.engine.connect() as conn:
             conn.execute(OncallInfo.create())
 
+    def tracking_table(self, url: str) -> Table:
+        return get_tracking_table(url)
+
     def query_table(self, table: Table, row_id: Any, columns: List[Column]) -> Optional[dict]:
+        replica = self.replicas.get(table.name)
+        if replica is not None and replica.is_fresh:
+            with STORAGE_SECONDS.time(operation="query_replica", table=metrics_table_name(table)):
+                return replica.get(row_id, columns)
+        if replica is not None:
+            replica.stats["stale_reads"] += 1
+
         primary_key_column = [key.name for key in table.primary_key][0]
 
-        with self.engine.connect() as conn:
+        with STORAGE_SECONDS.time(operation="query_table", table=metrics_table_name(table)), self.engine.connect() as conn:
             print(f"Querying table {table.name} with row_id {row_id} with columns {columns}")
             stmt = select(*columns).where(table.c[primary_key_column] == row_id)
-            result = conn.execute(stmt)
-            if result.rowcount == 0:
-                return None
-            return result.fetchone()._asdict()
+            # rowcount isn't reported for selects by every driver
+            row = conn.execute(stmt).fetchone()
+            return row._asdict() if row is not None else None
+
+    def existing_keys(self, conn: Connection, table: Table, row_ids: Iterable[Any]) -> Set[Any]:
+        # read inside the write transaction rather than from a replica or cache that may be behind:
+        # a sheet has no primary key constraint, so a wrong guess inserts a duplicate row
+        primary_key = table.c[[key.name for key in table.primary_key][0]]
+        existing = set()
+        for chunk in chunks(list(row_ids), 500):
+            existing.update(row[0] for row in conn.execute(select(primary_key).where(primary_key.in_(chunk))))
+        return existing
 
     def upsert_table(self, table: Table, row_id: Any, data: Dict[str, Any]) -> None:
+        self.upsert_many(table, {row_id: data})
+
+    def upsert_many(self, table: Table, rows: Dict[Any, Dict[str, Any]]) -> None:
+        with STORAGE_SECONDS.time(operation="upsert", table=metrics_table_name(table)):
+            self.write_rows(table, rows)
+        self.after_write(table, rows)
+
+    def write_rows(self, table: Table, rows: Dict[Any, Dict[str, Any]]) -> None:
         primary_key_column = [key.name for key in table.primary_key][0]
 
-        with self.engine.connect() as conn:
-            select_stmt = table.select().where(table.c[primary_key_column] == row_id)
-            row_exists = conn.execute(select_stmt).fetchone()
-
-            # Step 2: Update or Insert based on existence
-            if row_exists:
-                update_stmt = table.update().where(table.c[primary_key_column] == row_id).values(data)
-                conn.execute(update_stmt)
-                print("Row updated")
-            else:
-                data[primary_key_column] = row_id
-                insert_stmt = table.insert().values(**data)
-                conn.execute(insert_stmt)
-                print("Row inserted")
+        with self.engine.begin() as conn:
+            existing = self.existing_keys(conn, table, rows.keys())
+            # rows setting the same columns share one executemany UPDATE
+            updates = defaultdict(list)
+            for row_id in existing:
+                updates[tuple(sorted(rows[row_id]))].append({**rows[row_id], "_row_id": row_id})
+            update_stmt = table.update().where(table.c[primary_key_column] == bindparam("_row_id"))
+            for params in updates.values():
+                conn.execute(update_stmt, params)
 
-    def get_summary(self, tracking_url: str, start_time: datetime, end_time: datetime) -> Dict[str, Any]:
-        tracking_table = get_tracking_table(tracking_url)
-        with self.engine.connect() as conn:
-            stmt = select("*").where(
-                tracking_table.c.requested_at >= start_time,
-                tracking_table.c.requested_at <= end_time
-            )
-            result = [row._asdict() for row in conn.execute(stmt).fetchall()]
+            inserts = [{**data, primary_key_column: row_id} for row_id, data in rows.items() if row_id not in existing]
+            columns = {column for data in inserts for column in data}
+            if inserts:
+                conn.execute(table.insert(), [{column: data.get(column) for column in columns} for data in inserts])
+            print(f"Upserted {table.name}: {len(existing)} rows updated, {len(inserts)} rows inserted")
 
+    def after_write(self, table: Table, rows: Dict[Any, Dict[str, Any]]) -> None:
+        replica = self.replicas.get(table.name)
+        if replica is not None:
+            for row_id, data in rows.items():
+                replica.apply(row_id, data)
+        if self.rollups is not None and "tracking_url" in table.info:
+            self.invalidate_rollups(table.info["tracking_url"], rows)
+        self.notify(table.name, set(rows.keys()))
 
+    def invalidate_rollups(self, tracking_url: str, rows: Dict[Any, Dict[str, Any]]) -> None:
+        days = set()
+        for data in rows.values():
+            requested_at = data.get("requested_at")
+            if isinstance(requested_at, datetime):
+                days.add(requested_at.date())
+            elif "subject" in data or "requested_at" in data:
+                # the row's day isn't known from the write alone
+                self.rollups.invalidate("requests", tracking_url)
+                return
+        self.rollups.invalidate("requests", tracking_url, sorted(days))
+
+    def get_summary(self, tracking_url: str, start_time: datetime, end_time: datetime) -> Dict[str, Any]:
+        tracking_table = self.tracking_table(tracking_url)
+        is_code_review = tracking_table.c.subject == "Code Review"
+        is_unresolved = tracking_table.c.completed_at.is_(None)
+        in_range = [tracking_table.c.requested_at >= start_time, tracking_table.c.requested_at <= end_time]
         summary = {}
-        summary["total_requests"] = len(result)
-        summary["total_PR_reuqests"] = len([r for r in result if r["subject"] == "Code Review"])
-        summary["total_support_reuqests"] = len([r for r in result if r["subject"] != "Code Review"])
-        summary["unresolved_requests"] = [r for r in result if r["completed_at"] is None]
+
+        if self.rollups is None:
+            stmt = select(
+                func.count().label("total_requests"),
+                func.count().filter(is_code_review).label("total_PR_reuqests"),
+                func.count().filter(is_unresolved).label("unresolved_count"),
+            ).where(*in_range)
+            with self.engine.connect() as conn:
+                counts = conn.execute(stmt).one()._asdict()
+            summary["total_requests"] = counts["total_requests"]
+            summary["total_PR_reuqests"] = counts["total_PR_reuqests"]
+        else:
+            counts = self.rollups.summarize(
+                "requests",
+                tracking_url,
+                start_time,
+                end_time,
+                lambda since, until: self.daily_request_counts(tracking_table, since, until),
+                max_age=self.rollup_max_age,
+                recent_days=self.rollup_recent_days,
+            )
+            summary["total_requests"] = counts["total"]
+            summary["total_PR_reuqests"] = counts["code_review"]
+            # requests get resolved long after their day is rolled up
+            with self.engine.connect() as conn:
+                counts["unresolved_count"] = conn.execute(
+                    select(func.count()).where(*in_range, is_unresolved)
+                ).scalar_one()
+
+        # a missing subject counts as a support request
+        summary["total_support_reuqests"] = summary["total_requests"] - summary["total_PR_reuqests"]
+        summary["unresolved_count"] = counts["unresolved_count"]
+        summary["unresolved_requests"] = self.iter_unresolved_requests(tracking_url, start_time, end_time)
         return summary
 
+    def daily_request_counts(self, tracking_table: Table, since: datetime, until: datetime) -> Dict[date, Dict[str, Any]]:
+        day = func.date(tracking_table.c.requested_at)
+        stmt = select(day.label("day"), tracking_table.c.subject, func.count().label("count")).where(
+            tracking_table.c.requested_at >= since,
+            tracking_table.c.requested_at < until,
+        ).group_by(day, tracking_table.c.subject)
+        days = defaultdict(empty_counts)
+        with self.engine.connect() as conn:
+            for row in conn.execute(stmt):
+                # SQLite returns the day as text, Postgres as a date
+                counts = days[row.day if isinstance(row.day, date) else date.fromisoformat(row.day)]
+                counts["total"] += row.count
+                counts["code_review" if row.subject == "Code Review" else "support"] += row.count
+        return days
+
+    def iter_unresolved_requests(
+        self, tracking_url: str, start_time: datetime, end_time: datetime
+    ) -> Iterator[Dict[str, Any]]:
+        tracking_table = self.tracking_table(tracking_url)
+        stmt = select(
+            tracking_table.c.slack_url,
+            tracking_table.c.subject,
+            tracking_table.c.requested_team,
+        ).where(
+            tracking_table.c.requested_at >= start_time,
+            tracking_table.c.requested_at <= end_time,
+            tracking_table.c.completed_at.is_(None),
+        )
+        with self.engine.connect() as conn:
+            for row in conn.execution_options(yield_per=500).execute(stmt):
+                yield row._asdict()
+
+
+class AsyncStorage(object):
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+
+    async def query_table(self, table: Table, row_id: Any, columns: List[Column]) -> Optional[dict]:
+        replica = self.storage.replicas.get(table.name)
+        if replica is not None and replica.is_fresh:
+            return self.storage.query_table(table, row_id, columns)
+        return await asyncio.to_thread(self.storage.query_table, table, row_id, columns)
+
+    async def upsert_table(self, table: Table, row_id: Any, data: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self.storage.upsert_table, table, row_id, data)
+
+    async def upsert_many(self, table: Table, rows: Dict[Any, Dict[str, Any]]) -> None:
+        await asyncio.to_thread(self.storage.upsert_many, table, rows)
+
+    async def get_summary(self, tracking_url: str, start_time: datetime, end_time: datetime) -> Dict[str, Any]:
+        def get_summary():
+            # the unresolved rows are read on the worker thread rather than the event loop
+            summary = self.storage.get_summary(tracking_url, start_time, end_time)
+            summary["unresolved_requests"] = list(summary["unresolved_requests"])
+            return summary
+
+        return await asyncio.to_thread(get_summary)
+
 
 class GSheetStorage(Storage):
 
@@ -73,6 +365,9 @@ class GSheetStorage(Storage):
 
     def create_table(self, table: Table):
         # shillelagh doesn't support creating tables, therefore we need to use google sheet api to create it
+        import gspread
+        from google.oauth2.service_account import Credentials
+
         scope = [
             "https://www.googleapis.com/auth/spreadsheets",
             "https://www.googleapis.com/auth/drive.file",
@@ -108,4 +403,5 @@ def get_gsheet_storage() -> GSheetStorage:
             }
         )
         GoogleSheetObject = GSheetStorage(engine)
+        GoogleSheetObject.replicate(OncallInfo, load_config().storage_refresh_interval)
     return GoogleSheetObject
@@ -0,0 +1,153 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pytz
+from sqlalchemy import Engine, case, select
+
+from oncall_bot.local_db import dialect_insert, get_local_engine
+from oncall_bot.rollups import DailyRollups, get_daily_rollups
+from oncall_bot.tables import PagerDutyIncident, PagerDutySyncState
+
+# called with the range to fetch and a callback for when the fetch stops before the end of it
+Truncated = Callable[[int, int], None]
+FetchPages = Callable[[datetime, datetime, Truncated], Iterable[List[Dict[str, Any]]]]
+
+
+def to_utc(value: datetime, time_zone: str) -> datetime:
+    # naive datetimes from the summary command are in the on-call person's time zone
+    if value.tzinfo is None:
+        value = pytz.timezone(time_zone).localize(value)
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def from_utc(value: datetime, time_zone: str) -> datetime:
+    return value.replace(tzinfo=timezone.utc).astimezone(pytz.timezone(time_zone)).replace(tzinfo=None)
+
+
+class IncidentArchive(object):
+
+    def __init__(self, engine: Engine, rollups: DailyRollups):
+        self.engine = engine
+        # the rollups summaries read, so the buckets a sync invalidates are the ones served
+        self.rollups = rollups
+
+    def team_key(self, team_ids: List[str]) -> str:
+        return ",".join(sorted(team_ids))
+
+    def synced_range(self, team_key: str) -> Optional[Tuple[datetime, datetime]]:
+        with self.engine.connect() as conn:
+            state = conn.execute(
+                select(PagerDutySyncState).where(PagerDutySyncState.c.team_key == team_key)
+            ).fetchone()
+        return (state.synced_since, state.synced_until) if state is not None else None
+
+    def missing_ranges(self, team_key: str, start: datetime, end: datetime) -> List[Tuple[datetime, datetime]]:
+        synced = self.synced_range(team_key)
+        if synced is None:
+            return [(start, end)]
+        # the synced range only ever grows from its edges, so it stays contiguous
+        synced_since, synced_until = synced
+        ranges = []
+        if start < synced_since:
+            ranges.append((start, synced_since))
+        if end > synced_until:
+            ranges.append((synced_until, end))
+        return ranges
+
+    def store(self, team_key: str, incidents: List[Dict[str, Any]]) -> int:
+        if not incidents:
+            return 0
+        rows = [
+            {
+                "team_key": team_key,
+                "incident_id": incident["id"],
+                "title": incident["title"],
+                "created_at": to_utc(datetime.fromisoformat(incident["created_at"]), "UTC"),
+            }
+            for incident in incidents
+        ]
+        stmt = dialect_insert(self.engine)(PagerDutyIncident).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[PagerDutyIncident.c.team_key, PagerDutyIncident.c.incident_id],
+            set_={"title": stmt.excluded.title},
+        )
+        with self.engine.begin() as conn:
+            conn.execute(stmt)
+        # rollups are bucketed by local day, which can be a day either side of the UTC one
+        days = {row["created_at"].date() + timedelta(days=offset) for row in rows for offset in (-1, 0, 1)}
+        self.rollups.invalidate("pages", team_key, sorted(days))
+        return len(rows)
+
+    def sync(self, team_ids: List[str], start: datetime, end: datetime, fetch_pages: FetchPages) -> int:
+        team_key = self.team_key(team_ids)
+        end = min(end, datetime.now(timezone.utc).replace(tzinfo=None))
+        synced = 0
+        for since, until in self.missing_ranges(team_key, start, end):
+            truncated = []
+            last_created_at = None
+            for page in fetch_pages(since, until, lambda limit, total: truncated.append(limit)):
+                synced += self.store(team_key, page)
+                for incident in page:
+                    created_at = to_utc(datetime.fromisoformat(incident["created_at"]), "UTC")
+                    last_created_at = max(last_created_at or created_at, created_at)
+            if not truncated:
+                self.mark_synced(team_key, since, until)
+                continue
+            # pages come oldest first, so only up to the last incident stored is known to be complete;
+            # that is only recorded when it extends the synced range without leaving a gap
+            synced_range = self.synced_range(team_key)
+            if last_created_at is not None and (synced_range is None or since == synced_range[1]):
+                self.mark_synced(team_key, since, last_created_at)
+            print(f"Incident sync for teams {team_key} stopped at {last_created_at}, the rest is fetched next time")
+        print(f"Synced {synced} incidents for teams {team_key}")
+        return synced
+
+    def mark_synced(self, team_key: str, since: datetime, until: datetime) -> None:
+        stmt = dialect_insert(self.engine)(PagerDutySyncState).values(
+            team_key=team_key, synced_since=since, synced_until=until
+        )
+        synced_since, synced_until = PagerDutySyncState.c.synced_since, PagerDutySyncState.c.synced_until
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[PagerDutySyncState.c.team_key],
+            set_={
+                "synced_since": case(
+                    (stmt.excluded.synced_since < synced_since, stmt.excluded.synced_since), else_=synced_since
+                ),
+                "synced_until": case(
+                    (stmt.excluded.synced_until > synced_until, stmt.excluded.synced_until), else_=synced_until
+                ),
+            },
+        )
+        with self.engine.begin() as conn:
+            conn.execute(stmt)
+
+    def iter_incident_pages(
+        self, team_ids: List[str], start: datetime, end: datetime, time_zone: str, page_size: int = 500
+    ) -> Iterator[List[Dict[str, Any]]]:
+        tz = pytz.timezone(time_zone)
+        stmt = select(PagerDutyIncident.c.incident_id, PagerDutyIncident.c.title, PagerDutyIncident.c.created_at).where(
+            PagerDutyIncident.c.team_key == self.team_key(team_ids),
+            PagerDutyIncident.c.created_at >= start,
+            PagerDutyIncident.c.created_at < end,
+        )
+        with self.engine.connect() as conn:
+            result = conn.execution_options(yield_per=page_size).execute(stmt)
+            for rows in result.partitions():
+                yield [
+                    {
+                        "id": row.incident_id,
+                        "title": row.title,
+                        "created_at": row.created_at.replace(tzinfo=timezone.utc).astimezone(tz).isoformat(),
+                    }
+                    for row in rows
+                ]
+
+
+_archive: Optional[IncidentArchive] = None
+
+
+def get_incident_archive() -> IncidentArchive:
+    global _archive
+    if _archive is None:
+        _archive = IncidentArchive(get_local_engine(), get_daily_rollups())
+    return _archive
@@ -1,14 +1,21 @@
 import json
-from typing import Any, Dict, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Optional
 
-import jira
+from sqlalchemy import Engine, select
 
 from oncall_bot.config import load_config
+from oncall_bot.local_db import dialect_insert, get_local_engine
+from oncall_bot.metrics import UPSTREAM_SECONDS, timed
+from oncall_bot.tables import JiraIdentity
 
 
 class Jira:
 
     def __init__(self, base_url: str, email: str, token: str) -> None:
+        # loaded with the first client rather than at startup
+        import jira
+
         self.base_url = base_url
         if base_url.strip("/").endswith('.atlassian.net'):
             self.is_cloud = True
@@ -25,6 +32,7 @@ class Jira:
             **kwargs
         )
 
+    @timed(UPSTREAM_SECONDS, upstream="jira", call="search_users")
     def get_mention_name(self, email: str) -> Optional[str]:
         if self.is_cloud:
             users = self.client.search_users(query=email)
@@ -36,6 +44,7 @@ class Jira:
             return users[0].accountId
         return users[0].name
 
+    @timed(UPSTREAM_SECONDS, upstream="jira", call="create_issue")
     def create_ticket(self,
         project: str,
         summary: str,
@@ -75,3 +84,47 @@ def get_jira_client() -> Jira:
             token=jira_config['token']
         )
     return _jira
+
+
+class JiraIdentityCache(object):
+
+    # slack user id -> jira mention, kept in the local database so it survives restarts
+    def __init__(self, engine: Engine, ttl: float, negative_ttl: float) -> None:
+        self.engine = engine
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+    def get_many(self, slack_user_ids: Iterable[str]) -> Dict[str, str]:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        stmt = select(JiraIdentity.c.slack_user_id, JiraIdentity.c.mention).where(
+            JiraIdentity.c.slack_user_id.in_(list(slack_user_ids)),
+            JiraIdentity.c.expires_at > now,
+        )
+        with self.engine.connect() as conn:
+            return {row.slack_user_id: row.mention for row in conn.execute(stmt)}
+
+    def set(self, slack_user_id: str, mention: str, found: bool) -> None:
+        ttl = self.ttl if found else self.negative_ttl
+        expires_at = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=ttl)
+        stmt = dialect_insert(self.engine)(JiraIdentity).values(
+            slack_user_id=slack_user_id, mention=mention, found=found, expires_at=expires_at
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[JiraIdentity.c.slack_user_id],
+            set_={"mention": mention, "found": found, "expires_at": expires_at},
+        )
+        with self.engine.begin() as conn:
+            conn.execute(stmt)
+
+
+_identity_cache = None
+
+def get_jira_identity_cache() -> JiraIdentityCache:
+    global _identity_cache
+    if _identity_cache is None:
+        _identity_cache = JiraIdentityCache(
+            get_local_engine(),
+            ttl=load_config().jira_identity_ttl,
+            negative_ttl=load_config().jira_identity_negative_ttl,
+        )
+    return _identity_cache
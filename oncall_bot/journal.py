@@ -0,0 +1,269 @@
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from oncall_bot.config import load_config
+from oncall_bot.gsheet import Storage
+from oncall_bot.storage import get_storage
+from oncall_bot.tables import OncallInfo, get_tracking_columns
+
+TRACKING_COLUMNS = {column.name for column in get_tracking_columns()}
+DATETIME_COLUMNS = {"requested_at", "completed_at"}
+
+
+def entry_row(entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        key: datetime.fromisoformat(value) if key in DATETIME_COLUMNS and value else value
+        for key, value in entry["data"].items()
+    }
+
+
+def channel_tracking_url(storage: Storage, channel: str) -> Optional[str]:
+    oncall_info = storage.query_table(OncallInfo, channel, [OncallInfo.c.tracking_sheet])
+    return (oncall_info or {}).get(OncallInfo.c.tracking_sheet.name)
+
+
+class RequestJournal(object):
+
+    # append-only JSON lines file; the checkpoint file records how far it has been written to storage
+    def __init__(
+        self,
+        path: str,
+        get_storage: Callable[[], Storage],
+        batch_size: int = 200,
+        flush_interval: float = 5,
+        max_backoff: float = 300,
+        max_channel_attempts: int = 5,
+    ):
+        self.path = path
+        self.checkpoint_path = path + ".checkpoint"
+        self.quarantine_path = path + ".corrupt"
+        # entries a channel's tracking sheet kept rejecting, in journal format so they can be appended back
+        self.dead_letter_path = path + ".failed"
+        self.get_storage = get_storage
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.max_channel_attempts = max_channel_attempts
+        self.channel_failures: Counter = Counter()
+        self.stats: Counter = Counter(dropped=0, quarantined=0, dead_lettered=0, flush_failures=0)
+        self.last_flush_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self.repair()
+        self.backlog = len(self.pending())
+
+    def repair(self) -> None:
+        # drop a torn last line left by a crash mid-append, the request was never acknowledged
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as fp:
+            content = fp.read()
+            if content and not content.endswith(b"\n"):
+                fp.truncate(content.rfind(b"\n") + 1)
+                self.stats["torn_entries"] += 1
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps(entry, default=str) + "\n"
+        with self._lock:
+            with open(self.path, "a") as fp:
+                fp.write(line)
+                fp.flush()
+                os.fsync(fp.fileno())
+            self.backlog += 1
+            self.stats["appended"] += 1
+        self._wake.set()
+
+    def read_checkpoint(self) -> int:
+        try:
+            with open(self.checkpoint_path) as fp:
+                return int(fp.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def write_checkpoint(self, offset: int) -> None:
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as fp:
+            fp.write(str(offset))
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def pending(self, limit: Optional[int] = None) -> List[Tuple[int, bytes]]:
+        entries = []
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, "rb") as fp:
+            fp.seek(self.read_checkpoint())
+            while limit is None or len(entries) < limit:
+                line = fp.readline()
+                # a line still being appended is picked up by the next flush
+                if not line.endswith(b"\n"):
+                    break
+                entries.append((fp.tell(), line))
+        return entries
+
+    def decode(self, batch: List[Tuple[int, bytes]]) -> List[Dict[str, Any]]:
+        entries, corrupt = [], []
+        for _, line in batch:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                corrupt.append(line)
+        if corrupt:
+            # set aside so the entries after them still reach storage
+            with open(self.quarantine_path, "ab") as fp:
+                fp.writelines(corrupt)
+                fp.flush()
+                os.fsync(fp.fileno())
+            self.stats["quarantined"] += len(corrupt)
+            print(f"Moved {len(corrupt)} unreadable request journal entries to {self.quarantine_path}")
+        return entries
+
+    def write_entries(self, entries: List[Dict[str, Any]]) -> None:
+        storage = self.get_storage()
+        by_channel = defaultdict(list)
+        for entry in entries:
+            by_channel[entry["support_channel"]].append(entry)
+
+        errors = []
+        for channel, channel_entries in by_channel.items():
+            try:
+                self.write_channel(storage, channel, channel_entries)
+                self.channel_failures.pop(channel, None)
+            except Exception as e:
+                # upserts are keyed by log id, so the channels that did succeed are rewritten harmlessly on retry
+                self.channel_failures[channel] += 1
+                if self.channel_failures[channel] < self.max_channel_attempts:
+                    errors.append(e)
+                    continue
+                # a sheet that keeps failing, e.g. deleted or unshared, must not hold up every other channel
+                self.dead_letter(channel_entries)
+                del self.channel_failures[channel]
+                print(f"Moved {len(channel_entries)} requests for {channel} to {self.dead_letter_path}: {str(e)}")
+        if errors:
+            raise errors[0]
+
+    def write_channel(self, storage: Storage, channel: str, entries: List[Dict[str, Any]]) -> None:
+        tracking_url = channel_tracking_url(storage, channel)
+        if not tracking_url:
+            print(f"No tracking sheet configured for {channel}, dropping {len(entries)} requests")
+            self.stats["dropped"] += len(entries)
+            return
+        rows = {entry["log_id"]: entry_row(entry) for entry in entries}
+        storage.upsert_many(storage.tracking_table(tracking_url), rows)
+
+    def dead_letter(self, entries: List[Dict[str, Any]]) -> None:
+        with open(self.dead_letter_path, "a") as fp:
+            fp.writelines(json.dumps(entry, default=str) + "\n" for entry in entries)
+            fp.flush()
+            os.fsync(fp.fileno())
+        self.stats["dead_lettered"] += len(entries)
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            flushed = 0
+            while True:
+                batch = self.pending(self.batch_size)
+                if not batch:
+                    break
+                started_at = time.monotonic()
+                self.write_entries(self.decode(batch))
+                self.write_checkpoint(batch[-1][0])
+                self.last_flush_seconds = time.monotonic() - started_at
+                flushed += len(batch)
+                with self._lock:
+                    self.backlog -= len(batch)
+                    self.stats["flushed"] += len(batch)
+            self.compact()
+            return flushed
+
+    def compact(self) -> None:
+        with self._lock:
+            if os.path.exists(self.path) and os.path.getsize(self.path) == self.read_checkpoint():
+                open(self.path, "w").close()
+                self.write_checkpoint(0)
+                self.backlog = 0
+
+    def start(self) -> None:
+        if self._flusher is not None:
+            return
+
+        def flush_loop():
+            backoff = self.flush_interval
+            retry_at = 0.0
+            while True:
+                self._wake.wait(backoff)
+                # appends only wake the flusher early while storage is healthy
+                delay = retry_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                self._wake.clear()
+                try:
+                    self.flush()
+                    backoff = self.flush_interval
+                    retry_at = 0.0
+                except Exception as e:
+                    self.stats["flush_failures"] += 1
+                    backoff = min(backoff * 2, self.max_backoff)
+                    retry_at = time.monotonic() + backoff
+                    print(f"Error flushing request journal, retrying in {backoff}s: {str(e)}")
+
+        # replays whatever a previous process left behind, then keeps up with new entries
+        self._flusher = threading.Thread(target=flush_loop, name="request-journal", daemon=True)
+        self._flusher.start()
+        self._wake.set()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backlog": self.backlog, "last_flush_seconds": self.last_flush_seconds, **self.stats}
+
+
+def parse_request_content(json_content: str) -> Dict[str, Any]:
+    try:
+        data = json.loads(json_content)
+    except (TypeError, ValueError):
+        data = None
+    if not isinstance(data, dict):
+        data = {"request_content": json_content}
+    data = {key: value for key, value in data.items() if key in TRACKING_COLUMNS}
+    data.setdefault("requested_at", datetime.now().isoformat())
+    return data
+
+
+def write_request(entry: Dict[str, Any]) -> None:
+    # without a journal the row is written before the workflow step completes
+    storage = get_storage()
+    tracking_url = channel_tracking_url(storage, entry["support_channel"])
+    if not tracking_url:
+        raise ValueError(f"No tracking sheet configured for {entry['support_channel']}")
+    storage.upsert_table(storage.tracking_table(tracking_url), entry["log_id"], entry_row(entry))
+
+
+def record_request(entry: Dict[str, Any]) -> None:
+    journal = get_request_journal()
+    if journal is None:
+        write_request(entry)
+    else:
+        journal.append(entry)
+
+
+_journal: Optional[RequestJournal] = None
+
+
+def get_request_journal() -> Optional[RequestJournal]:
+    global _journal
+    if _journal is None and load_config().journal_path:
+        _journal = RequestJournal(
+            load_config().journal_path,
+            get_storage,
+            batch_size=load_config().journal_batch_size,
+            flush_interval=load_config().journal_flush_interval,
+        )
+    return _journal
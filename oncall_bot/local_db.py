@@ -0,0 +1,28 @@
+from typing import Any, Callable, Optional
+
+from sqlalchemy import Engine, create_engine
+from sqlalchemy.dialects import postgresql, sqlite
+
+from oncall_bot.config import load_config
+from oncall_bot.tables import local_metadata
+
+# dialects with INSERT ... ON CONFLICT
+DIALECT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+_local_engine: Optional[Engine] = None
+
+
+def get_local_engine() -> Engine:
+    global _local_engine
+    if _local_engine is None:
+        _local_engine = create_engine(load_config().local_db_url)
+        local_metadata.create_all(_local_engine)
+    return _local_engine
+
+
+def dialect_insert(engine: Engine) -> Callable[..., Any]:
+    # local_db_url may point at postgres as well as sqlite
+    return DIALECT_INSERTS[engine.dialect.name]
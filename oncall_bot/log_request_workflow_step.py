@@ -1,20 +1,19 @@
+import asyncio
 import uuid
-from typing import Any
+from typing import Any, Dict, List, Tuple
 
 from slack_bolt import Ack
 from slack_bolt.workflows.step import Complete, Configure, Update, WorkflowStep
+from slack_bolt.workflows.step.async_step import AsyncWorkflowStep
 
-from oncall_bot.gsheet import get_gsheet_storage
-from oncall_bot.tables import OncallInfo, get_tracking_table
+from oncall_bot.journal import parse_request_content, record_request
 from oncall_bot.utils import get_key
 
 oncall_ws_step = WorkflowStep.builder("post_request_and_ping_oncall")
+async_oncall_ws_step = AsyncWorkflowStep.builder("post_request_and_ping_oncall")
 
 
-@oncall_ws_step.edit
-def edit(ack: Ack, step: Any, configure: Configure, logger: Any) -> None:
-    ack()
-    logger.debug(step)
+def build_edit_blocks(step: Any) -> List[Dict[str, Any]]:
     blocks = [
         {
             "type": "section",
@@ -51,15 +50,11 @@ def edit(ack: Ack, step: Any, configure: Configure, logger: Any) -> None:
     support_channel = get_key(step, "inputs.support_channel.value")
     if support_channel:
         blocks[0]["accessory"]["initial_conversation"] = support_channel
-    configure(blocks=blocks)
-
+    return blocks
 
-@oncall_ws_step.save
-def save(ack: Ack, view: Any, update: Update, logger: Any) -> None:
-    ack()
 
+def build_save_inputs(view: Any) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
     values = view["state"]["values"]
-    logger.debug(view)
     inputs = {
         "support_channel": {"value": values["support_channel"]["support_channel"]["selected_conversation"]},
         "json_content": {"value": values["json_content"]["json_content"]["value"]},
@@ -71,23 +66,62 @@ def save(ack: Ack, view: Any, update: Update, logger: Any) -> None:
             "label": "Request UUID",
         },
     ]
+    return inputs, outputs
+
+
+def log_request(step: Any) -> Dict[str, Any]:
+    inputs = step["inputs"]
+    log_id = uuid.uuid4().hex
+    # the row is written to the tracking table by the journal flusher, when a journal is configured
+    record_request({
+        "log_id": log_id,
+        "support_channel": inputs["support_channel"]["value"],
+        "data": parse_request_content(inputs["json_content"]["value"]),
+    })
+    return {
+        "request_uuid": log_id,
+    }
+
+
+@oncall_ws_step.edit
+def edit(ack: Ack, step: Any, configure: Configure, logger: Any) -> None:
+    ack()
+    logger.debug(step)
+    configure(blocks=build_edit_blocks(step))
+
+
+@oncall_ws_step.save
+def save(ack: Ack, view: Any, update: Update, logger: Any) -> None:
+    ack()
+    logger.debug(view)
+    inputs, outputs = build_save_inputs(view)
     update(inputs=inputs, outputs=outputs)
 
 
 @oncall_ws_step.execute
 def execute(step: Any, complete: Complete, logger: Any) -> None:
     logger.debug(step)
-    inputs = step["inputs"]
-    support_channel = inputs["support_channel"]["value"]
-    json_content = inputs["json_content"]["value"]
+    # if everything was successful
+    complete(outputs=log_request(step))
 
-    tracking_url = get_gsheet_storage().query_table(OncallInfo, support_channel, ["tracking_url"])["tracking_url"]
-    tracking_table = get_tracking_table(tracking_url)
-    log_id = uuid.uuid4().hex
-    get_gsheet_storage().upsert_table(tracking_table, log_id, json_content)
 
-    # if everything was successful
-    outputs = {
-        "request_uuid": log_id,
-    }
-    complete(outputs=outputs)
+@async_oncall_ws_step.edit
+async def async_edit(ack: Any, step: Any, configure: Any, logger: Any) -> None:
+    await ack()
+    logger.debug(step)
+    await configure(blocks=build_edit_blocks(step))
+
+
+@async_oncall_ws_step.save
+async def async_save(ack: Any, view: Any, update: Any, logger: Any) -> None:
+    await ack()
+    logger.debug(view)
+    inputs, outputs = build_save_inputs(view)
+    await update(inputs=inputs, outputs=outputs)
+
+
+@async_oncall_ws_step.execute
+async def async_execute(step: Any, complete: Any, logger: Any) -> None:
+    logger.debug(step)
+    # the journal append waits on fsync and the fallback on storage, keep both off the event loop
+    await complete(outputs=await asyncio.to_thread(log_request, step))
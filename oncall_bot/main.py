@@ -1,31 +1,189 @@
+import asyncio
+import threading
+
+# imported first so the startup profile covers loading everything else
+from oncall_bot.startup import LAZY_MODULES, get_startup_profile, import_module
+
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 
+from oncall_bot.channel_index import get_channel_index, get_channel_refresher
 from oncall_bot.config import load_config
-from oncall_bot.log_request_workflow_step import oncall_ws_step
+from oncall_bot.dates import load_fallback, parse_metrics
+from oncall_bot.digests import get_digest_scheduler
+from oncall_bot.executor import get_command_executor
+from oncall_bot.jira import get_jira_client
+from oncall_bot.journal import get_request_journal
+from oncall_bot.metrics import REGISTRY, start_metrics_server
+from oncall_bot.storage import get_storage
+from oncall_bot.log_request_workflow_step import async_oncall_ws_step, oncall_ws_step
 from oncall_bot.mention_bot import MentionedBot
-from oncall_bot.slack_app import get_app
+from oncall_bot.pagerduty import get_pagerduty_client
+from oncall_bot.slack_app import get_app, get_async_app, get_slack_read_cache, get_user_index
+from oncall_bot.slack_client import get_rate_limiter
+
+
+def create_app():
+    slack_app = get_app()
+
+    # Add workflow step
+    slack_app.step(oncall_ws_step)
+
+    # Allow bot interacts with mentioned events
+    @slack_app.event("app_mention")
+    def handle_app_mention_events(body):
+        print("app_mention", )
+        try:
+            self_id = slack_app.client.auth_test()['user_id']
+            MentionedBot.process_command(self_id, slack_app, body)
+        finally:
+            get_startup_profile().event_handled()
+
+    @slack_app.event("user_change")
+    @slack_app.event("team_join")
+    def handle_user_change(event):
+        get_user_index().update(event["user"])
+
+    # channel changes refresh stored names and cached topics and bookmarks in the background
+    @slack_app.event("channel_rename")
+    def handle_channel_rename(event):
+        get_channel_refresher().submit(event["channel"]["id"], "channel_rename")
+
+    # must be registered before the generic message listener, only the first match runs
+    @slack_app.event({"type": "message", "subtype": "channel_topic"})
+    def handle_channel_topic(event):
+        get_channel_refresher().submit(event["channel"], "channel_topic")
+
+    @slack_app.event("pin_added")
+    @slack_app.event("pin_removed")
+    def handle_pin_change(event):
+        get_channel_refresher().submit(event["channel_id"], event["type"])
+
+    @slack_app.event("member_joined_channel")
+    def handle_member_joined_channel(event, context):
+        if event["user"] == context.bot_user_id:
+            get_channel_refresher().submit(event["channel"], "member_joined_channel")
+
+    @slack_app.event("message")
+    def handle_im(body):
+        # self_id = slack_app.client.auth_test()['user_id']
+        # print(body)
+        # MentionedBot.process_command(self_id, slack_app, body)
+        pass
+
+    return slack_app
+
+
+def create_async_app():
+    slack_app = get_async_app()
+
+    slack_app.step(async_oncall_ws_step)
+
+    @slack_app.event("app_mention")
+    async def handle_app_mention_events(body, context):
+        print("app_mention", )
+        try:
+            await MentionedBot.process_command_async(context.bot_user_id, slack_app, body)
+        finally:
+            get_startup_profile().event_handled()
+
+    @slack_app.event("user_change")
+    @slack_app.event("team_join")
+    async def handle_user_change(event):
+        get_user_index().update(event["user"])
+
+    @slack_app.event("channel_rename")
+    async def handle_channel_rename(event):
+        get_channel_refresher().submit(event["channel"]["id"], "channel_rename")
+
+    @slack_app.event({"type": "message", "subtype": "channel_topic"})
+    async def handle_channel_topic(event):
+        get_channel_refresher().submit(event["channel"], "channel_topic")
+
+    @slack_app.event("pin_added")
+    @slack_app.event("pin_removed")
+    async def handle_pin_change(event):
+        get_channel_refresher().submit(event["channel_id"], event["type"])
+
+    @slack_app.event("member_joined_channel")
+    async def handle_member_joined_channel(event, context):
+        if event["user"] == context.bot_user_id:
+            get_channel_refresher().submit(event["channel"], "member_joined_channel")
+
+    @slack_app.event("message")
+    async def handle_im(body):
+        pass
+
+    return slack_app
+
+
+def register_collectors():
+    # the components keep their own counters, they are read whenever /metrics is scraped
+    executor = get_command_executor()
+    if executor is not None:
+        executor_gauges = ("workers", "running", "queue_depth", "queued_threads", "wait_seconds_max")
+        REGISTRY.register_collector("executor", executor.metrics, gauges=executor_gauges)
+    journal = get_request_journal()
+    if journal is not None:
+        REGISTRY.register_collector("journal", journal.metrics, gauges=("backlog", "last_flush_seconds"))
+    REGISTRY.register_collector("replica", get_storage().replica_metrics, gauges=("rows", "staleness_seconds"))
+    REGISTRY.register_collector("rollups", get_storage().rollups.metrics, gauges=())
+    # the long-lived caches are listed one by one, so each name is a single series
+    REGISTRY.register_collector(
+        "cache",
+        lambda: get_pagerduty_client().cache_metrics() + get_slack_read_cache().metrics(),
+        gauges=("size", "hit_rate"),
+    )
+    REGISTRY.register_collector("slack_rate_limit", get_rate_limiter().metrics, gauges=("buckets",))
+    REGISTRY.register_collector("user_index", get_user_index().metrics, gauges=("users", "loaded"))
+    REGISTRY.register_collector("channel_index", get_channel_index().metrics, gauges=("channels",))
+    REGISTRY.register_collector("channel_refresher", get_channel_refresher().metrics, gauges=("pending",))
+    REGISTRY.register_collector("digests", get_digest_scheduler().metrics, gauges=("digests",))
+    REGISTRY.register_collector("dates", parse_metrics, gauges=("fallback_cache_size",))
+    REGISTRY.register_collector("startup", get_startup_profile().metrics)
+
+
+def warm_up():
+    get_startup_profile().mark("socket_connected")
+    if not load_config().warm_up:
+        return
+    warmers = {module: import_module(module) for module in LAZY_MODULES}
+    # the first summary with an unusual date would otherwise pay for loading dateparser's language data
+    warmers["dates"] = load_fallback
+    warmers["pagerduty_session"] = lambda: get_pagerduty_client().session
+    if load_config().jira:
+        warmers["jira_client"] = get_jira_client
+    get_startup_profile().start_warm_up(warmers)
 
-slack_app = get_app()
 
-# Add workflow step
-slack_app.step(oncall_ws_step)
+def start():
+    handler = SocketModeHandler(create_app(), load_config().slack_socket_app_token)
+    handler.connect()
+    warm_up()
+    threading.Event().wait()
 
-# Allow bot interacts with mentioned events
-@slack_app.event("app_mention")
-def handle_app_mention_events(body):
-    print("app_mention", )
-    self_id = slack_app.client.auth_test()['user_id']
-    MentionedBot.process_command(self_id, slack_app, body)
 
-@slack_app.event("message")
-def handle_im(body):
-    # self_id = slack_app.client.auth_test()['user_id']
-    # print(body)
-    # MentionedBot.process_command(self_id, slack_app, body)
-    pass
+async def start_async():
+    # aiohttp is only needed in async mode
+    from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
 
+    handler = AsyncSocketModeHandler(create_async_app(), load_config().slack_socket_app_token)
+    await handler.connect_async()
+    warm_up()
+    await asyncio.sleep(float("inf"))
 
 
 if __name__ == "__main__":
-    handler = SocketModeHandler(slack_app, load_config().slack_socket_app_token)
-    handler.start()
+    get_startup_profile().import_budget = load_config().startup_import_budget
+    get_startup_profile().imports_done()
+    get_storage().start_replication(load_config().storage_refresh_interval)
+    get_user_index().start_build()
+    get_channel_index().start_build()
+    if get_request_journal() is not None:
+        get_request_journal().start()
+    get_digest_scheduler().start()
+    register_collectors()
+    start_metrics_server(load_config().metrics_host, load_config().metrics_port)
+    if load_config().async_mode:
+        asyncio.run(start_async())
+    else:
+        start()
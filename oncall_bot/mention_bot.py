@@ -1,20 +1,40 @@
+import asyncio
+import inspect
 import re
 import shlex
+import time
 import traceback
 from collections import namedtuple
-from typing import Any, Callable, Dict, List, Optional
-
-import dateparser
-
-from oncall_bot.config import load_config
-from oncall_bot.gsheet import get_gsheet_storage
-from oncall_bot.jira import get_jira_client
-from oncall_bot.pagerduty import PagerDuty
-from oncall_bot.slack_app import Context, SlackTool
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from slack_sdk.errors import SlackApiError
+
+from oncall_bot.channel_index import get_channel_index, needs_bookmarks, resolve_channel
+from oncall_bot.dates import parse_date
+from oncall_bot.executor import PRIORITY_BULK, PRIORITY_NORMAL, PRIORITY_URGENT, get_command_executor
+from oncall_bot.gsheet import AsyncStorage
+from oncall_bot.jira import Jira, get_jira_client, get_jira_identity_cache
+from oncall_bot.metrics import COMMAND_SECONDS, COMMANDS, COMMANDS_IN_FLIGHT, MENTION_TO_REPLY_SECONDS
+from oncall_bot.pagerduty import AsyncPagerDuty, get_pagerduty_client
+from oncall_bot.slack_app import AsyncSlackTool, Context, SlackTool
+from oncall_bot.slack_client import get_async_slack_client, get_slack_client
+from oncall_bot.storage import get_storage
 from oncall_bot.tables import OncallInfo, get_tracking_table
 from oncall_bot.utils import MinMaxValidator, get_key
 
-Command = namedtuple("Command", ["func", "format", "help_text", "validator", "release"])
+Command = namedtuple(
+    "Command", ["func", "format", "help_text", "validator", "release", "async_func", "priority", "name", "placeholder"]
+)
+
+
+def observe_command(cmd: Command, context: Context, status: str, started_at: float) -> None:
+    COMMANDS.inc(command=cmd.name, status=status)
+    COMMAND_SECONDS.observe(time.perf_counter() - started_at, command=cmd.name, status=status)
+    if context.message_ts:
+        # measured from the mention's own timestamp, so time spent queued is included
+        MENTION_TO_REPLY_SECONDS.observe(time.time() - float(context.message_ts), command=cmd.name)
 
 
 class _MentionedBot():
@@ -28,20 +48,38 @@ class _MentionedBot():
             format: str = "",
             help_text: str = "",
             validator: Optional[Callable[[List[str]], Optional[str]]] = None,
-            release: bool = True
+            release: bool = True,
+            priority: int = PRIORITY_NORMAL,
+            placeholder: Optional[str] = None,
     ):
+        # a command may be registered twice: once sync and once async
         def decorator(func):
-            self.commands[command_name] = Command(func, format, help_text, validator, release)
+            is_async = inspect.iscoroutinefunction(func)
+            existing = self.commands.get(command_name)
+            if existing is not None:
+                self.commands[command_name] = existing._replace(**{"async_func" if is_async else "func": func})
+            else:
+                self.commands[command_name] = Command(
+                    None if is_async else func,
+                    format,
+                    help_text,
+                    validator,
+                    release,
+                    func if is_async else None,
+                    priority,
+                    command_name,
+                    placeholder,
+                )
             return func
         return decorator
 
     @classmethod
-    def process_command(self, id, app, body: Dict[Any, Any]):
+    def parse_command(self, id, body: Dict[Any, Any]) -> Optional[Tuple[Command, Context]]:
         if (
             get_key(body, "event.type") != "app_mention" and  f"<@{id}>" not in get_key(body, "event.text")
         ):
             print("not a mention_event")
-            return
+            return None
 
         command_str = get_key(body, "event.text").replace(f"<@{id}>", "").strip()
         command_str = command_str.replace('“', '"').replace('”', '"').replace('‘', "'").replace('’', "'")
@@ -59,18 +97,93 @@ class _MentionedBot():
             thread_ts=get_key(body, "event.thread_ts"),
             user=get_key(body, "event.user"),
         )
-        slack_tool = SlackTool(app, context)
+        return self.commands.get(main_command, self.commands["__DEFAULT__"]), context
 
-        cmd = self.commands.get(main_command, self.commands["__DEFAULT__"])
-        if cmd.validator is not None and cmd.validator(command_args) is not None:
-            slack_tool.responser(cmd.validator(command_args))
+    @classmethod
+    def process_command(self, id, app, body: Dict[Any, Any]):
+        parsed = self.parse_command(id, body)
+        if parsed is None:
+            return
+        cmd, context = parsed
+        slack_tool = SlackTool(app.client, context)
+        # carries the placeholder, so tools the command is bridged through share it
+        context = slack_tool.context
+
+        if cmd.validator is not None and cmd.validator(context.command_args) is not None:
+            COMMANDS.inc(command=cmd.name, status="rejected")
+            slack_tool.responser(cmd.validator(context.command_args))
             return
+
+        # slow commands answer right away, the result replaces the placeholder when it's ready
+        if cmd.placeholder:
+            try:
+                slack_tool.post_placeholder(cmd.placeholder)
+            except SlackApiError as e:
+                print(f"Error posting placeholder: {str(e)}")
+
+        executor = get_command_executor()
+        # replies within a thread stay in order, other threads in the channel don't wait on them
+        thread = (context.channel, context.thread_ts or context.message_ts)
+        if executor is None:
+            self.run_command(cmd, context, slack_tool)
+        elif not executor.submit(thread, cmd.priority, self.run_command, cmd, context, slack_tool):
+            COMMANDS.inc(command=cmd.name, status="busy")
+            slack_tool.responser("Sorry, I'm too busy right now. Please try again in a few minutes.")
+
+    @classmethod
+    def run_command(self, cmd: Command, context: Context, slack_tool: SlackTool):
+        started_at, status = time.perf_counter(), "success"
+        COMMANDS_IN_FLIGHT.inc(command=cmd.name)
         try:
-            cmd.func(context, slack_tool)
+            if cmd.func is not None:
+                cmd.func(context, slack_tool)
+            else:
+                asyncio.run(cmd.async_func(context, AsyncSlackTool(get_async_slack_client(), context)))
         except Exception as e:
+            status = "error"
             # print traceback
             traceback.print_exc()
             slack_tool.responser(f"Error: {str(e)}")
+        finally:
+            COMMANDS_IN_FLIGHT.dec(command=cmd.name)
+            observe_command(cmd, context, status, started_at)
+
+    @classmethod
+    async def process_command_async(self, id, app, body: Dict[Any, Any]):
+        parsed = self.parse_command(id, body)
+        if parsed is None:
+            return
+        cmd, context = parsed
+        slack_tool = AsyncSlackTool(app.client, context)
+        context = slack_tool.context
+
+        if cmd.validator is not None and cmd.validator(context.command_args) is not None:
+            COMMANDS.inc(command=cmd.name, status="rejected")
+            await slack_tool.responser(cmd.validator(context.command_args))
+            return
+
+        if cmd.placeholder:
+            try:
+                await slack_tool.post_placeholder(cmd.placeholder)
+            except SlackApiError as e:
+                print(f"Error posting placeholder: {str(e)}")
+
+        started_at, status = time.perf_counter(), "success"
+        COMMANDS_IN_FLIGHT.inc(command=cmd.name)
+        try:
+            if cmd.async_func is not None:
+                await cmd.async_func(context, slack_tool)
+            else:
+                # commands without an async implementation run on the default executor
+                await asyncio.to_thread(cmd.func, context, SlackTool(get_slack_client(), context))
+        except Exception as e:
+            status = "error"
+            # print traceback
+            traceback.print_exc()
+            await slack_tool.responser(f"Error: {str(e)}")
+        finally:
+            COMMANDS_IN_FLIGHT.dec(command=cmd.name)
+            observe_command(cmd, context, status, started_at)
 
     def __repr__(self) -> str:
         return (
@@ -82,25 +195,19 @@ class _MentionedBot():
             if cmd.release
         ])
 
-    @classmethod
-    def update_channel_name(self, slack_tool: SlackTool, channel_id: str) -> None:
-        try:
-            channel_name = get_gsheet_storage().query_table(
-                OncallInfo, channel_id,
-                [OncallInfo.c.channel_name]
-            )[OncallInfo.c.channel_name.name]
-            new_channel_name = slack_tool.get_channel_name_from_channel_id(channel_id)
-            if new_channel_name != channel_name:
-                get_gsheet_storage().upsert_table(
-                    OncallInfo, channel_id, {OncallInfo.c.channel_name.name: new_channel_name}
-                )
-        except Exception as e:
-            print(f"Error: {str(e)}")
-
 
 MentionedBot = _MentionedBot()
 
 
+def with_channel_name(slack_tool: SlackTool, channel_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    # read from the cached channel info; renames afterwards arrive as channel_rename events
+    try:
+        data[OncallInfo.c.channel_name.name] = slack_tool.get_channel_name_from_channel_id(channel_id)
+    except SlackApiError as e:
+        print(f"Error reading channel name of {channel_id}: {str(e)}")
+    return data
+
+
 @MentionedBot.add_command(
     "help",
     format="help",
@@ -118,16 +225,15 @@ def help(context: Context, slack_tool: SlackTool):
 )
 def set_pagerduty(context: Context, slack_tool: SlackTool):
     pagerduty_url = context.command_args[0].strip('<> ')
-    if not PagerDuty(load_config().pagerduty_token).parse_url(pagerduty_url):
+    if not get_pagerduty_client().parse_url(pagerduty_url):
         slack_tool.responser(
             "Please provide with pagerduty url, either `schedules`, `escalation_policies` or `service-directory`"
         )
         return
-    get_gsheet_storage().upsert_table(OncallInfo, context.channel, {
+    get_storage().upsert_table(OncallInfo, context.channel, with_channel_name(slack_tool, context.channel, {
         OncallInfo.c.pagerduty_url.name: pagerduty_url
-    })
-    MentionedBot.update_channel_name(slack_tool, context.channel)
-    url = get_gsheet_storage().query_table(
+    }))
+    url = get_storage().query_table(
         OncallInfo, context.channel, [OncallInfo.c.pagerduty_url]
     )[OncallInfo.c.pagerduty_url.name]
 
@@ -154,7 +260,7 @@ def get_pagerduty(context: Context, slack_tool: SlackTool):
         else slack_tool.parse_channel_str(context.command_args[0])["id"]
     )
     oncall_info = (
-        get_gsheet_storage()
+        get_storage()
         .query_table(OncallInfo, query_channel, [OncallInfo.c.pagerduty_url])
     )
     pagerduty_url = oncall_info[OncallInfo.c.pagerduty_url.name] if oncall_info else None
@@ -176,12 +282,11 @@ def get_pagerduty(context: Context, slack_tool: SlackTool):
 def set_sheet_url(context: Context, slack_tool: SlackTool):
     logging_url = context.command_args[0].strip("<> ")
     print(f"logging url: {logging_url}")
-    get_gsheet_storage().upsert_table(
+    get_storage().upsert_table(
         OncallInfo,
         context.channel,
-        {OncallInfo.c.tracking_sheet.name: logging_url}
+        with_channel_name(slack_tool, context.channel, {OncallInfo.c.tracking_sheet.name: logging_url})
     )
-    MentionedBot.update_channel_name(slack_tool, context.channel)
     slack_tool.responser(
         text=(
             "Configure done, you can use `set-sheet-url` to update or "
@@ -203,7 +308,7 @@ def get_sheet_url(context: Context, slack_tool: SlackTool):
         if len(context.command_args) == 0
         else slack_tool.parse_channel_str(context.command_args[0])["id"]
     )
-    logging_url = get_gsheet_storage().query_table(
+    logging_url = get_storage().query_table(
         OncallInfo,
         query_channel,
         [OncallInfo.c.tracking_sheet]
@@ -239,35 +344,63 @@ def unmark_complete(context: Context, slack_tool: SlackTool):
     slack_tool.reaction_remover(conversation["ts"], "white_check_mark")
 
 
+def oncall_ping_text(oncall_pings: Optional[str], pagerduty_urls: List[str]) -> str:
+    if oncall_pings:
+        return f"{oncall_pings} please take a look on the request."
+    elif len(pagerduty_urls) == 0:
+        return "Sorry, the channel doesn't have pagerduty id configured."
+    return "There are no oncall right now. Please ping on the time there's oncall. Thanks"
+
+
+def resolve_channel_for_ping(channel: str, slack_tool: SlackTool) -> Dict[str, Any]:
+    entry = get_channel_index().get(channel)
+    if entry is None:
+        row = get_storage().query_table(OncallInfo, channel, [OncallInfo.c.pagerduty_url])
+        configured_url = (row or {}).get(OncallInfo.c.pagerduty_url.name)
+        try:
+            topic = slack_tool.get_channel_topic(channel)
+        except SlackApiError as e:
+            if not configured_url:
+                raise
+            # a configured url still works in channels whose info the bot can't read, but without
+            # the topic's ping the entry isn't kept
+            print(f"Error reading topic of {channel}: {str(e)}")
+            return resolve_channel(configured_url, "", None)
+        bookmarks = slack_tool.get_bookmarks(channel) if needs_bookmarks(configured_url, topic) else None
+        entry = get_channel_index().update(channel, resolve_channel(configured_url, topic, bookmarks))
+    return entry
+
+
+async def resolve_channel_for_ping_async(channel: str, slack_tool: AsyncSlackTool) -> Dict[str, Any]:
+    entry = get_channel_index().get(channel)
+    if entry is None:
+        row = await AsyncStorage(get_storage()).query_table(OncallInfo, channel, [OncallInfo.c.pagerduty_url])
+        configured_url = (row or {}).get(OncallInfo.c.pagerduty_url.name)
+        try:
+            topic = await slack_tool.get_channel_topic(channel)
+        except SlackApiError as e:
+            if not configured_url:
+                raise
+            print(f"Error reading topic of {channel}: {str(e)}")
+            return resolve_channel(configured_url, "", None)
+        bookmarks = await slack_tool.get_bookmarks(channel) if needs_bookmarks(configured_url, topic) else None
+        entry = await asyncio.to_thread(
+            get_channel_index().update, channel, resolve_channel(configured_url, topic, bookmarks)
+        )
+    return entry
+
+
 def ping_oncall_person_for_channel(channel, slack_tool: SlackTool):
-    pagerduty_urls = []
-
-    # see if we have configured that
-    row = get_gsheet_storage().query_table(OncallInfo, channel, [OncallInfo.c.pagerduty_url])
-    if row:
-        pagerduty_urls = [row[OncallInfo.c.pagerduty_url.name]]
-
-    # # find pagerduty url from topic
-    if len(pagerduty_urls) == 0:
-        print("no schedule set in google sheet, try to find from topic")
-        topic = slack_tool.get_channel_topic(channel)
-        has_pagerduty_url = re.search(r"(?P<url>https://.*pagerduty.com/.*)", topic)
-        if has_pagerduty_url:
-            pagerduty_urls = [has_pagerduty_url.group("url")]
-
-    # find from bookmarks
-    if len(pagerduty_urls) == 0:
-        pagerduty_urls = [
-           bookmark.get("link", "") for bookmark in slack_tool.get_bookmarks(channel)
-           if "pagerduty_url" in bookmark.get("link", "")
-        ]
+    # the configured url, topic and bookmarks are resolved ahead of time by the channel index
+    channel_entry = resolve_channel_for_ping(channel, slack_tool)
+    pagerduty_urls = channel_entry["pagerduty_urls"]
 
     print(f"pagerduty urls: {pagerduty_urls}")
-    pd = PagerDuty(load_config().pagerduty_token)
+    pd = get_pagerduty_client()
     oncall_users = [
         oncall
-        for pagerduty_url in pagerduty_urls
-        for oncall in pd.get_oncall(pagerduty_url)
+        for oncalls in pd.get_oncall_bulk(pagerduty_urls).values()
+        for oncall in oncalls
     ]
 
     print(f"pagerduty oncall users: {oncall_users}")
@@ -283,31 +416,54 @@ def ping_oncall_person_for_channel(channel, slack_tool: SlackTool):
 
     if oncall_pings is None:
         # find oncall user from topic
-        topic = slack_tool.get_channel_topic(channel)
-        found_oncall_user_from_topic = re.search(r":pagerduty: <@(?P<oncall_user>.*)>", topic)
-        if found_oncall_user_from_topic:
-            oncall_pings = f"<@{found_oncall_user_from_topic.group('oncall_user')}>"
+        oncall_pings = channel_entry["oncall_pings"]
+
+    slack_tool.responser(oncall_ping_text(oncall_pings, pagerduty_urls))
 
-    if oncall_pings:
-        text = f"{oncall_pings} please take a look on the request."
-    elif len(pagerduty_urls) == 0:
-        text = "Sorry, the channel doesn't have pagerduty id configured."
-    else:
-        text = "There are no oncall right now. Please ping on the time there's oncall. Thanks"
-    slack_tool.responser(text)
+
+async def ping_oncall_person_for_channel_async(channel, slack_tool: AsyncSlackTool):
+    channel_entry = await resolve_channel_for_ping_async(channel, slack_tool)
+    pagerduty_urls = channel_entry["pagerduty_urls"]
+
+    print(f"pagerduty urls: {pagerduty_urls}")
+    pd = AsyncPagerDuty(get_pagerduty_client())
+    oncall_users = [
+        oncall
+        for oncalls in (await pd.get_oncall_bulk(pagerduty_urls)).values()
+        for oncall in oncalls
+    ]
+
+    print(f"pagerduty oncall users: {oncall_users}")
+    oncall_pings = None
+    if len(oncall_users) > 0:
+        slack_users = await asyncio.gather(*[slack_tool.lookup_user(user["email"]) for user in oncall_users])
+        oncall_user_ids = [get_key(slack_user, "user.id") for slack_user in slack_users]
+        oncall_pings = " ".join(f"<@{user_id}>" for user_id in oncall_user_ids if user_id is not None)
+
+    if oncall_pings is None:
+        oncall_pings = channel_entry["oncall_pings"]
+
+    await slack_tool.responser(oncall_ping_text(oncall_pings, pagerduty_urls))
 
 
 @MentionedBot.add_command(
     "ping",
     format="ping <channel_name>",
     help_text="ping oncall person for the specified channel",
-    validator=MinMaxValidator(1, 1)
+    validator=MinMaxValidator(1, 1),
+    priority=PRIORITY_URGENT,
 )
 def ping_oncall(context: Context, slack_tool: SlackTool):
     channel = slack_tool.parse_channel_str(context.command_args[0].strip())["id"]
     ping_oncall_person_for_channel(channel, slack_tool)
 
 
+@MentionedBot.add_command("ping")
+async def ping_oncall_async(context: Context, slack_tool: AsyncSlackTool):
+    channel = slack_tool.parse_channel_str(context.command_args[0].strip())["id"]
+    await ping_oncall_person_for_channel_async(channel, slack_tool)
+
+
 @MentionedBot.add_command(
     "join",
     format="join <channel_name>",
@@ -322,7 +478,9 @@ def join_channel(context: Context, slack_tool: SlackTool):
     "summary",
     format="summary <channel_name> <start_time> <end_time>",
     help_text="get the summary of the oncall for the specified channel",
-    validator=MinMaxValidator(2, 3)
+    validator=MinMaxValidator(2, 3),
+    priority=PRIORITY_BULK,
+    placeholder=":hourglass_flowing_sand: Working on the summary...",
 )
 def summary(context: Context, slack_tool: SlackTool):
     print(f"command args: {context.command_args}")
@@ -330,47 +488,73 @@ def summary(context: Context, slack_tool: SlackTool):
         slack_tool.parse_channel_str(context.command_args[0].strip())["id"]
         if len(context.command_args) == 3 else context.channel
     )
-    start_time = dateparser.parse(context.command_args[1] if len(context.command_args) == 3 else context.command_args[0])
-    end_time = dateparser.parse(context.command_args[2] if len(context.command_args) == 3 else context.command_args[1])
+    start_arg, end_arg = context.command_args[-2:]
+    start_time, end_time = parse_date(start_arg), parse_date(end_arg)
+    if start_time is None or end_time is None:
+        raise ValueError(f"Could not understand the date {start_arg if start_time is None else end_arg!r}")
     print(f"channel: {channel}, start_time: {start_time}, end_time: {end_time}")
-    oncall_info = get_gsheet_storage().query_table(
+    summary_text = build_summary(channel, start_time, end_time, progress=slack_tool.progress)
+    print(f"summary text: {summary_text}")
+    if summary_text:
+        slack_tool.responser('\n'.join(summary_text), markdown=True, reply_broadcast=True)
+    else:
+        slack_tool.responser("Nothing to summarize, the channel has no pagerduty or google sheet configured.")
+
+
+def build_summary(
+    channel: str, start_time: datetime, end_time: datetime, progress: Optional[Callable[[str], None]] = None
+) -> List[str]:
+    oncall_info = get_storage().query_table(
         OncallInfo,
         channel,
         [OncallInfo.c.pagerduty_url, OncallInfo.c.tracking_sheet]
     )
     print(f"oncall info: {oncall_info}")
-    summary_text = []
-    if oncall_info:
+    pagerduty_summary, request_summary = None, None
+    if (oncall_info or {}).get("pagerduty_url"):
         pagerduty_url = oncall_info[OncallInfo.c.pagerduty_url.name]
-        summary = PagerDuty(load_config().pagerduty_token).get_summary_from_schedule(pagerduty_url, start_time, end_time)
-        if summary:
-            summary_text.append(f"*### Pagerduty Summary ###*")
-            summary_text.append(f"Total Pages: {summary['total_pages']}")
-            summary_text.append(f"Weekend Pages: {summary['weekend_pages']}")
-            summary_text.append(f"Out of Business Hour Pages: {summary['out_of_hours_pages']}")
-            summary_text.append("")
-            summary_text.append("*#### Pages Count ####*:")
-            for title, count in summary["group_by_titles"]:
-                summary_text.append(f"{title}: {count}")
-            summary_text.append("")
-
+        pagerduty_summary = get_pagerduty_client().get_summary_from_schedule(
+            pagerduty_url, start_time, end_time, progress=progress
+        )
     if (oncall_info or {}).get("tracking_sheet"):
         tracking_url = oncall_info["tracking_sheet"]
-        summary = get_gsheet_storage().get_summary(tracking_url, start_time, end_time)
-        if summary:
-            summary_text.append(f"*### Request Summary ###*")
-            summary_text.append(f"Total Requests: {summary['total_requests']}")
-            summary_text.append(f"Total PR Requests: {summary['total_PR_reuqests']}")
-            summary_text.append(f"Total Support Requests: {summary['total_support_reuqests']}")
-            summary_text.append(f"Unresolved Requests: {len(summary['unresolved_requests'])}")
-            summary_text.append("")
-            summary_text.append("*#### Unresolved Requests ####*:")
-            for request in summary["unresolved_requests"]:
-                summary_text.append(f"<{request['slack_url']}|{request['subject']}> (from {request['requested_team']})")
+        if progress is not None:
+            progress(":hourglass_flowing_sand: Counting requests...")
+        # tracking sheet times are naive, compared as wall-clock times
+        request_summary = get_storage().get_summary(
+            tracking_url, start_time.replace(tzinfo=None), end_time.replace(tzinfo=None)
+        )
+    return format_summary(pagerduty_summary, request_summary)
 
-    print(f"summary text: {summary_text}")
-    if summary_text:
-        slack_tool.responser('\n'.join(summary_text), markdown=True, reply_broadcast=True)
+
+def format_summary(pagerduty_summary: Optional[Dict[str, Any]], request_summary: Optional[Dict[str, Any]]) -> List[str]:
+    summary_text = []
+    if pagerduty_summary:
+        summary_text.append(f"*### Pagerduty Summary ###*")
+        truncated = (
+            f" (truncated at {pagerduty_summary['truncated_at']} incidents)"
+            if pagerduty_summary.get("truncated_at") else ""
+        )
+        summary_text.append(f"Total Pages: {pagerduty_summary['total_pages']}{truncated}")
+        summary_text.append(f"Weekend Pages: {pagerduty_summary['weekend_pages']}")
+        summary_text.append(f"Out of Business Hour Pages: {pagerduty_summary['out_of_hours_pages']}")
+        summary_text.append("")
+        summary_text.append("*#### Pages Count ####*:")
+        for title, count in pagerduty_summary["group_by_titles"]:
+            summary_text.append(f"{title}: {count}")
+        summary_text.append("")
+
+    if request_summary:
+        summary_text.append(f"*### Request Summary ###*")
+        summary_text.append(f"Total Requests: {request_summary['total_requests']}")
+        summary_text.append(f"Total PR Requests: {request_summary['total_PR_reuqests']}")
+        summary_text.append(f"Total Support Requests: {request_summary['total_support_reuqests']}")
+        summary_text.append(f"Unresolved Requests: {request_summary['unresolved_count']}")
+        summary_text.append("")
+        summary_text.append("*#### Unresolved Requests ####*:")
+        for request in request_summary["unresolved_requests"]:
+            summary_text.append(f"<{request['slack_url']}|{request['subject']}> (from {request['requested_team']})")
+    return summary_text
 
 
 @MentionedBot.add_command(
@@ -387,16 +571,15 @@ def set_jira_project(context: Context, slack_tool: SlackTool):
     )
 
     project, issue_type, metadata = context.command_args
-    get_gsheet_storage().upsert_table(
+    get_storage().upsert_table(
         OncallInfo,
         channel,
-        {
+        with_channel_name(slack_tool, channel, {
             OncallInfo.c.jira_project.name: project,
             OncallInfo.c.jira_issue_type.name: issue_type,
             OncallInfo.c.jira_metadata.name: metadata
-        }
+        })
     )
-    MentionedBot.update_channel_name(slack_tool, channel)
     slack_tool.responser(
         text=(
             "Configure done, you can use `set-jira-project` to update or "
@@ -418,7 +601,7 @@ def get_jira_project(context: Context, slack_tool: SlackTool):
         if len(context.command_args) == 0
         else slack_tool.parse_channel_str(context.command_args[0])["id"]
     )
-    jira_project = get_gsheet_storage().query_table(
+    jira_project = get_storage().query_table(
         OncallInfo,
         query_channel,
         [
@@ -442,14 +625,53 @@ def get_jira_project(context: Context, slack_tool: SlackTool):
     )
 
 
+SLACK_MENTION_PATTERN = r"<@(?P<user_id>.*?)>"
+
+
+# slack errors meaning the user really doesn't exist, anything else may be gone on the next try
+SLACK_USER_MISSING_ERRORS = {"user_not_found", "users_not_found"}
+
+
+def slack_user_to_jira_mention(slack_tool: SlackTool, jira: Jira, user_id: str) -> Tuple[str, Optional[bool]]:
+    # found is None when the lookup failed for a reason that shouldn't be cached
+    try:
+        slack_user = slack_tool.get_user_info(user_id)
+    except SlackApiError as e:
+        print(f"Error: {str(e)}")
+        return user_id, False if get_key(e.response, "error") in SLACK_USER_MISSING_ERRORS else None
+    if not slack_user:
+        return user_id, False
+    jira_user = jira.get_mention_name(get_key(slack_user, "profile.email"))
+    if not jira_user:
+        return get_key(slack_user, "name"), False
+    return f"[~{jira_user}]", True
+
+
+def resolve_jira_mentions(slack_tool: SlackTool, jira: Jira, user_ids: List[str]) -> Dict[str, str]:
+    identity_cache = get_jira_identity_cache()
+    mentions = identity_cache.get_many(set(user_ids))
+    missing = sorted(set(user_ids) - mentions.keys())
+    if missing:
+        # each miss costs a slack and a jira call, so resolve them side by side
+        with ThreadPoolExecutor(max_workers=min(len(missing), 8)) as pool:
+            resolved = pool.map(lambda user_id: slack_user_to_jira_mention(slack_tool, jira, user_id), missing)
+            for user_id, (mention, found) in zip(missing, resolved):
+                if found is not None:
+                    identity_cache.set(user_id, mention, found)
+                mentions[user_id] = mention
+    return mentions
+
+
 @MentionedBot.add_command(
     "create-ticket",
     format="create-ticket <summary> <description>",
     help_text="create a ticket in jira using the first message in thread as description",
+    priority=PRIORITY_BULK,
+    placeholder=":hourglass_flowing_sand: Creating the ticket...",
 )
 def create_ticket(context: Context, slack_tool: SlackTool):
     jira = get_jira_client()
-    project = get_gsheet_storage().query_table(
+    project = get_storage().query_table(
         OncallInfo,
         context.channel,
         [
@@ -460,30 +682,21 @@ def create_ticket(context: Context, slack_tool: SlackTool):
     if not project:
         raise ValueError("No Jira Project Configured")
 
-    def slack_user_to_jira_mention(user_id: str) -> str:
-        slack_user = slack_tool.get_user_info(user_id)
-        if not slack_user:
-            return user_id
-        jira_user = jira.get_mention_name(get_key(slack_user, "profile.email"))
-        if not jira_user:
-            return get_key(slack_user, "name")
-        return f"[~{jira_user}]"
-
     project_key = project[OncallInfo.c.jira_project.name]
     issue_type = project[OncallInfo.c.jira_issue_type.name]
     ticket_metadata = project[OncallInfo.c.jira_metadata.name]
     summary = context.command_args[0]
-    first_message = slack_tool.get_thread_first_message(context.thread_ts)["text"]
+    # the description uses the root's current text, which may have been edited
+    first_message = slack_tool.get_thread_first_message(context.thread_ts, fresh=True)["text"]
     first_message_url = slack_tool.get_permalink(context.thread_ts)
-    replaced_text = re.sub(
-        r"<@(?P<user_id>.*?)>",
-        lambda x: slack_user_to_jira_mention(x.group("user_id")),
-        first_message
+    mentions = resolve_jira_mentions(
+        slack_tool, jira, re.findall(SLACK_MENTION_PATTERN, first_message) + [context.user]
     )
+    replaced_text = re.sub(SLACK_MENTION_PATTERN, lambda x: mentions[x.group("user_id")], first_message)
 
     description = context.command_args[1] +  "\n\n\n\n"
     description += "=== Ticket Details ===\n\n"
-    description += "ticket created by " + slack_user_to_jira_mention(context.user) + "\n\n"
+    description += "ticket created by " + mentions[context.user] + "\n\n"
     description += "Original Message:\n"
     description += f"[slack|{first_message_url}]\n"
     description += "{noformat}" + replaced_text + "{noformat}"
@@ -495,13 +708,20 @@ def create_ticket(context: Context, slack_tool: SlackTool):
 @MentionedBot.add_command(
     "__DEFAULT__",
     format="",
-    help_text="if none of the command matched, we will ping the oncall person for the current channel"
+    help_text="if none of the command matched, we will ping the oncall person for the current channel",
+    priority=PRIORITY_URGENT,
 )
 def default_ping(context: Context, slack_tool: SlackTool):
     print(f"ping channel: {context.channel}")
     ping_oncall_person_for_channel(context.channel, slack_tool)
 
 
+@MentionedBot.add_command("__DEFAULT__")
+async def default_ping_async(context: Context, slack_tool: AsyncSlackTool):
+    print(f"ping channel: {context.channel}")
+    await ping_oncall_person_for_channel_async(context.channel, slack_tool)
+
+
 
 @MentionedBot.add_command("test", format="test", help_text="test command")
 def test(context: Context, slack_tool: SlackTool):
@@ -0,0 +1,304 @@
+import abc
+import asyncio
+import bisect
+import functools
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from flask import Flask, Response
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+PREFIX = "oncall_bot"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _metric_name(*parts: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", "_".join(part for part in parts if part))
+
+
+class Metric(abc.ABC):
+
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = f"{PREFIX}_{name}"
+        self.help_text = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def _labels(self, key: Tuple[str, ...], **extra: Any) -> str:
+        return _format_labels({**dict(zip(self.labels, key)), **extra})
+
+    @abc.abstractmethod
+    def samples(self) -> List[str]:
+        pass
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+
+class Counter(Metric):
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{self._labels(key)} {value}" for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: Any) -> None:
+        with self._lock:
+            self.values[self._key(labels)] = value
+
+    @contextmanager
+    def track_inprogress(self, **labels: Any) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+        # per label set: count per bucket (the last one is +Inf), sum
+        self.values: Dict[Tuple[str, ...], Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self.values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total) in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{self._labels(key, le=le)} {cumulative}")
+                lines.append(f"{self.name}_sum{self._labels(key)} {total}")
+                lines.append(f"{self.name}_count{self._labels(key)} {cumulative}")
+        return lines
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: Dict[str, Tuple[Callable[[], Any], Optional[Tuple[str, ...]]]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            self.metrics.append(metric)
+        return metric
+
+    def register_collector(
+        self, name: str, collect: Callable[[], Any], gauges: Optional[Tuple[str, ...]] = None
+    ) -> None:
+        # collect returns a metrics() dict, or a list of them; strings become labels and numbers samples.
+        # gauges names the point-in-time values, matched before any ".", the other numbers are
+        # cumulative and exported as counters; None when every value is point-in-time
+        with self._lock:
+            self.collectors[name] = (collect, gauges)
+
+    def collect(self, name: str, collect: Callable[[], Any], gauges: Optional[Tuple[str, ...]] = None) -> List[str]:
+        snapshots = collect()
+        if snapshots is None:
+            return []
+        if isinstance(snapshots, dict):
+            snapshots = [snapshots]
+        samples: Dict[Tuple[str, str], List[str]] = {}
+        for snapshot in snapshots:
+            labels = {key: value for key, value in snapshot.items() if isinstance(value, str)}
+            for key, value in snapshot.items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if isinstance(value, (int, float)):
+                    if gauges is None or key.split(".")[0] in gauges:
+                        kind, metric_name = "gauge", _metric_name(PREFIX, name, key)
+                    else:
+                        kind, metric_name = "counter", _metric_name(PREFIX, name, key.replace("_total", ""), "total")
+                    sample = f"{metric_name}{_format_labels(labels)} {value}"
+                    samples.setdefault((kind, metric_name), []).append(sample)
+        lines = []
+        for (kind, metric_name), metric_samples in samples.items():
+            lines.append(f"# TYPE {metric_name} {kind}")
+            lines.extend(metric_samples)
+        return lines
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self.metrics)
+            collectors = dict(self.collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for name, (collect, gauges) in collectors.items():
+            try:
+                lines.extend(self.collect(name, collect, gauges))
+            except Exception as e:
+                print(f"Error collecting {name} metrics: {str(e)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+COMMANDS = REGISTRY.register(Counter(
+    "commands_total", "Mention commands by outcome", ("command", "status"),
+))
+COMMAND_SECONDS = REGISTRY.register(Histogram(
+    "command_seconds", "Time spent running a mention command", ("command", "status"),
+))
+COMMANDS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "commands_in_flight", "Mention commands currently running", ("command",),
+))
+MENTION_TO_REPLY_SECONDS = REGISTRY.register(Histogram(
+    "mention_to_reply_seconds", "Time from the mention being posted to the command finishing", ("command",),
+))
+SLACK_TOOL_SECONDS = REGISTRY.register(Histogram(
+    "slack_tool_seconds", "Time spent in SlackTool methods", ("method", "status"),
+))
+UPSTREAM_SECONDS = REGISTRY.register(Histogram(
+    "upstream_seconds", "Latency of PagerDuty and Jira calls", ("upstream", "call", "status"),
+))
+STORAGE_SECONDS = REGISTRY.register(Histogram(
+    "storage_seconds", "Time spent in storage reads and writes", ("operation", "table"),
+))
+
+
+def timed(histogram: Histogram, **labels: Any) -> Callable:
+    # adds a status label of ok or error, works for coroutine functions too
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started_at, status = time.perf_counter(), "ok"
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    status = "error"
+                    raise
+                finally:
+                    histogram.observe(time.perf_counter() - started_at, status=status, **labels)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started_at, status = time.perf_counter(), "ok"
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                status = "error"
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started_at, status=status, **labels)
+        return wrapper
+    return decorator
+
+
+def instrument_properties(histogram: Histogram, label: str) -> Callable[[type], type]:
+    # the slack tools expose their methods as properties returning closures; time every closure
+    def decorator(cls):
+        for name, attribute in list(vars(cls).items()):
+            if isinstance(attribute, property):
+                def getter(self, fget=attribute.fget, name=name):
+                    value = fget(self)
+                    return timed(histogram, **{label: name})(value) if callable(value) else value
+                setattr(cls, name, property(getter))
+        return cls
+    return decorator
+
+
+def instrument_session(session: Any, upstream: str) -> None:
+    # requests sessions report each response with its elapsed time; ids are dropped from the path
+    def observe(response, *args, **kwargs):
+        path = re.sub(r"/[A-Z0-9]{5,}(?=/|$)", "/{id}", response.request.path_url.split("?")[0])
+        UPSTREAM_SECONDS.observe(
+            response.elapsed.total_seconds(),
+            upstream=upstream,
+            call=f"{response.request.method} {path}",
+            status=f"{response.status_code // 100}xx",
+        )
+
+    session.hooks.setdefault("response", []).append(observe)
+
+
+def create_metrics_app(registry: Registry = REGISTRY) -> Flask:
+    app = Flask("oncall_bot_metrics")
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+    return app
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    # scrapes every few seconds would otherwise flood the bot's output
+    def log_request(self, *args: Any, **kwargs: Any) -> None:
+        pass
+
+
+_server: Optional[Any] = None
+
+
+def start_metrics_server(host: str, port: int) -> None:
+    global _server
+    if _server is not None or not port:
+        return
+    _server = make_server(host, port, create_metrics_app(), threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
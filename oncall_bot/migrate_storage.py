@@ -0,0 +1,40 @@
+import sys
+
+from sqlalchemy import create_engine
+
+from oncall_bot.config import load_config
+from oncall_bot.gsheet import Storage, get_gsheet_storage
+from oncall_bot.storage import SQLStorage
+from oncall_bot.tables import OncallInfo
+
+
+def copy_table(source: Storage, source_table, target: Storage, target_table) -> int:
+    primary_key_column = [key.name for key in source_table.primary_key][0]
+    with source.engine.connect() as conn:
+        rows = [row._asdict() for row in conn.execute(source_table.select())]
+    batch = {}
+    for row in rows:
+        row_id = row.pop(primary_key_column)
+        if row_id:
+            batch[row_id] = row
+    target.upsert_many(target_table, batch)
+    print(f"Copied {len(rows)} rows from {source_table.name} to {target_table.name}")
+    return len(rows)
+
+
+def migrate(source: Storage, target: SQLStorage) -> None:
+    copy_table(source, OncallInfo, target, OncallInfo)
+    with target.engine.connect() as conn:
+        tracking_urls = sorted({
+            row.tracking_sheet for row in conn.execute(OncallInfo.select()) if row.tracking_sheet
+        })
+    for url in tracking_urls:
+        copy_table(source, source.tracking_table(url), target, target.tracking_table(url))
+
+
+if __name__ == "__main__":
+    if not load_config().storage_url:
+        print("storage_url is not configured, nothing to migrate to")
+        sys.exit(1)
+    # no mirror here, the rows come from the sheets in the first place
+    migrate(get_gsheet_storage(), SQLStorage(create_engine(load_config().storage_url)))
@@ -1,22 +1,118 @@
+import asyncio
 import re
-from collections import Counter, OrderedDict
-from datetime import datetime, timedelta, timezone
-from itertools import groupby
-from typing import Any, Dict, List
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import date, datetime, timedelta, timezone
+from itertools import groupby, islice
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional
 
-from pdpyras import APISession
+from requests.adapters import HTTPAdapter
 
-from oncall_bot.utils import get_key
+from oncall_bot.cache import ExpiringCache
+from oncall_bot.config import load_config
+from oncall_bot.incident_archive import from_utc, get_incident_archive, to_utc
+from oncall_bot.metrics import instrument_session
+from oncall_bot.rollups import empty_counts, get_daily_rollups
+from oncall_bot.utils import chunks, get_key
+
+if TYPE_CHECKING:
+    from pdpyras import APISession
+
+_sessions: Dict[str, "APISession"] = {}
+_sessions_lock = threading.Lock()
+
+# PagerDuty's maximum page size, and how many pages are fetched at once
+INCIDENT_PAGE_LIMIT = 100
+INCIDENT_PAGE_WINDOW = 4
+
+
+
+class FanoutPool(object):
+
+    # work submitted from one of the pool's own threads runs inline, so nested fan-out can't deadlock
+    def __init__(self, max_workers: int, name: str):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._local = threading.local()
+
+    def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        self._local.inside = True
+        try:
+            return func(*args)
+        finally:
+            self._local.inside = False
+
+    def submit(self, func: Callable[..., Any], *args: Any) -> Future:
+        if getattr(self._local, "inside", False):
+            future: Future = Future()
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self.pool.submit(self._run, func, *args)
+
+    def map(self, func: Callable[[Any], Any], items: Iterable[Any]) -> List[Any]:
+        return [future.result() for future in [self.submit(func, item) for item in items]]
+
+
+# escalation targets and services are resolved on one pool, incident pages are fetched on another
+_resolve_pool = FanoutPool(16, "pagerduty-resolve")
+_page_pool = FanoutPool(16, "pagerduty-pages")
+
+
+def get_session(token: str) -> "APISession":
+    with _sessions_lock:
+        if token not in _sessions:
+            # pdpyras is only loaded with the first session
+            from pdpyras import APISession
+
+            session = APISession(token)
+            # one pooled connection per worker so concurrent commands reuse TLS connections
+            pool_size = max(load_config().command_workers, 10)
+            session.mount("https://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+            instrument_session(session, "pagerduty")
+            _sessions[token] = session
+        return _sessions[token]
+
+
+def summarize_incidents_by_day(pages: Iterable[List[Dict[str, Any]]]) -> Dict[date, Dict[str, Any]]:
+    days = defaultdict(empty_counts)
+    for incidents in pages:
+        for incident in incidents:
+            created_at = datetime.fromisoformat(incident["created_at"])
+            counts = days[created_at.date()]
+            counts["total"] += 1
+            counts["titles"][incident["title"]] += 1
+            if created_at.weekday() in [5, 6]:
+                counts["weekend_pages"] += 1
+            elif created_at.hour < 9 or created_at.hour > 18:
+                counts["out_of_hours_pages"] += 1
+    return days
+
+
+def _oncall_user(oncall: Dict[str, Any]) -> Dict[str, str]:
+    return {
+        "name": oncall["user"]["name"],
+        "email": oncall["user"]["email"],
+        "time_zone": oncall["user"]["time_zone"],
+    }
 
 
 class PagerDuty(object):
 
     def __init__(self, token: str):
         self.token = token
+        self.oncall_cache = ExpiringCache("pagerduty_oncall", maxsize=1024)
+        self.user_cache = ExpiringCache("pagerduty_users", ttl=24 * 3600, maxsize=1024)
+        self.service_policy_cache = ExpiringCache("pagerduty_service_policies", ttl=3600, maxsize=1024)
 
     @property
-    def session(self) -> APISession:
-        return APISession(self.token)
+    def session(self) -> "APISession":
+        return get_session(self.token)
+
+    def cache_metrics(self) -> List[Dict[str, Any]]:
+        return [cache.metrics() for cache in [self.oncall_cache, self.user_cache, self.service_policy_cache]]
 
     def parse_url(self, url: str) -> Dict[str, str]:
         match = re.match(
@@ -38,32 +134,216 @@ class PagerDuty(object):
             return self.get_oncall_from_service(match["pagerduty_id"])
         return []
 
-    def get_oncall_from_schedule(self, schedule: str) -> List[Dict[str, str]]:
-        since = datetime.now(timezone.utc).isoformat()
-        until = (datetime.now(timezone.utc) + timedelta(seconds=1)).isoformat()
+    def list_oncalls(self, now: datetime, **filters: Any) -> List[Dict[str, Any]]:
+        return self.session.list_all(
+            "oncalls",
+            params={
+                "since": now.isoformat(),
+                "until": (now + timedelta(seconds=1)).isoformat(),
+                "include[]": ["users"],
+                **filters,
+            }
+        )
+
+    def cache_schedule_oncalls(self, schedule: str, oncalls: List[Dict[str, Any]], now: datetime) -> List[Dict[str, str]]:
+        users = []
+        for oncall in oncalls:
+            user = _oncall_user(oncall)
+            if user not in users:
+                users.append(user)
+
+        # the result holds until the current shift ends, re-check now and then to pick up overrides
+        shift_ends = [datetime.fromisoformat(oncall["end"]) for oncall in oncalls if oncall.get("end")]
+        expires_at = now + timedelta(seconds=load_config().pagerduty_oncall_cache_seconds)
+        if not users:
+            # /oncalls only reports schedules used by an escalation policy
+            users = self.get_schedule_users(schedule, now)
+            expires_at = now + timedelta(seconds=60)
+        elif shift_ends:
+            expires_at = min(expires_at, min(shift_ends))
+        self.oncall_cache.set(schedule, users, expires_at=expires_at.timestamp())
+        return users
+
+    def get_schedule_users(self, schedule: str, now: datetime) -> List[Dict[str, str]]:
+        since = now.isoformat()
+        until = (now + timedelta(seconds=1)).isoformat()
         response = self.session.get(f"/schedules/{schedule}/users", params={"since": since, "until": until})
         users = [{"name": u["name"], "email": u["email"], "time_zone": u["time_zone"]} for u in response.json()["users"]]
         return users
 
-    def get_oncall_from_escalation_policy(self, policy: str) -> List[Dict[str, str]]:
-        response = self.session.get(f"/escalation_policies/{policy}")
-        first = get_key(response.json(),"escalation_policy.escalation_rules", [None])[0]
-        if first is None:
-            return []
+    def get_oncall_from_schedule(self, schedule: str) -> List[Dict[str, str]]:
+        users = self.oncall_cache.get(schedule)
+        if users is not None:
+            return users
+
+        now = datetime.now(timezone.utc)
+        return self.cache_schedule_oncalls(schedule, self.list_oncalls(now, **{"schedule_ids[]": [schedule]}), now)
+
+    def get_oncall_bulk(self, pagerduty_urls: List[str], chunk_size: int = 50) -> Dict[str, List[Dict[str, str]]]:
+        now = datetime.now(timezone.utc)
+        matches = {url: self.parse_url(url) for url in pagerduty_urls}
+        ids_by_type = defaultdict(set)
+        for match in matches.values():
+            if match:
+                ids_by_type[match["type"]].add(match["pagerduty_id"])
+
+        service_ids = sorted(ids_by_type["service-directory"])
+        service_policies = dict(zip(service_ids, _resolve_pool.map(self.get_service_escalation_policy_id, service_ids)))
+        policy_ids = sorted(ids_by_type["escalation_policies"] | {p for p in service_policies.values() if p})
+
+        # one lookup per schedule, so the cache's hit rate isn't skewed
+        schedule_users = {}
+        for schedule in ids_by_type["schedules"]:
+            users = self.oncall_cache.get(schedule)
+            if users is not None:
+                schedule_users[schedule] = users
+        schedule_ids = sorted(ids_by_type["schedules"] - set(schedule_users))
+        schedule_oncalls = defaultdict(list)
+        for chunk in chunks(schedule_ids, chunk_size):
+            for oncall in self.list_oncalls(now, **{"schedule_ids[]": chunk}):
+                schedule_oncalls[get_key(oncall, "schedule.id")].append(oncall)
+        for schedule in schedule_ids:
+            schedule_users[schedule] = self.cache_schedule_oncalls(schedule, schedule_oncalls[schedule], now)
+
+        levels = load_config().pagerduty_escalation_levels
+        policy_users = defaultdict(list)
+        for chunk in chunks(policy_ids, chunk_size):
+            for oncall in self.list_oncalls(now, **{"escalation_policy_ids[]": chunk}):
+                users = policy_users[oncall["escalation_policy"]["id"]]
+                user = _oncall_user(oncall)
+                if oncall["escalation_level"] <= levels and user not in users:
+                    users.append(user)
+
+        result = {}
+        for url, match in matches.items():
+            if not match:
+                result[url] = []
+            elif match["type"] == "schedules":
+                result[url] = schedule_users[match["pagerduty_id"]]
+            elif match["type"] == "escalation_policies":
+                result[url] = policy_users[match["pagerduty_id"]]
+            else:
+                result[url] = policy_users[service_policies[match["pagerduty_id"]]]
+        return result
+
+    def get_user(self, user_id: str) -> Dict[str, str]:
+        user = self.user_cache.get(user_id)
+        if user is None:
+            u = self.session.rget(f"/users/{user_id}")
+            user = {"name": u["name"], "email": u["email"], "time_zone": u["time_zone"]}
+            self.user_cache.set(user_id, user)
+        return user
+
+    def get_oncall_from_target(self, target: Dict[str, Any]) -> List[Dict[str, str]]:
+        if target["type"] in ("schedule_reference", "schedule"):
+            return self.get_oncall_from_schedule(target["id"])
+        elif target["type"] in ("user_reference", "user"):
+            return [self.get_user(target["id"])]
+        return []
+
+    def get_oncall_from_escalation_rules(
+        self, rules: List[Dict[str, Any]], levels: Optional[int] = None
+    ) -> List[Dict[str, str]]:
+        levels = load_config().pagerduty_escalation_levels if levels is None else levels
+        targets = [target for rule in rules[:levels] for target in rule["targets"]]
         users = []
-        for target in first["targets"]:
-            if target["type"] == "schedule_reference":
-                users.extend(self.get_oncall(target["id"]))
+        for oncalls in _resolve_pool.map(self.get_oncall_from_target, targets):
+            users.extend(user for user in oncalls if user not in users)
         return users
 
+    def get_oncall_from_escalation_policy(self, policy: str, levels: Optional[int] = None) -> List[Dict[str, str]]:
+        response = self.session.get(f"/escalation_policies/{policy}")
+        rules = get_key(response.json(), "escalation_policy.escalation_rules", [])
+        return self.get_oncall_from_escalation_rules(rules, levels)
+
+    def get_service_escalation_policy_id(self, service_id: str) -> Optional[str]:
+        policy_id = self.service_policy_cache.get(service_id)
+        if policy_id is None:
+            policy_id = get_key(self.session.rget(f"/services/{service_id}"), "escalation_policy.id", None)
+            self.service_policy_cache.set(service_id, policy_id)
+        return policy_id
+
     def get_oncall_from_service(self, service_id: str) -> List[Dict[str, str]]:
-        response = self.session.get(f"/services/{service_id}")
+        # include the escalation policy so its rules come back with the service
+        response = self.session.get(f"/services/{service_id}", params={"include[]": ["escalation_policies"]})
+        rules = get_key(response.json(), "service.escalation_policy.escalation_rules", None)
+        if rules is not None:
+            return self.get_oncall_from_escalation_rules(rules)
         escalion_policy_id = get_key(response.json(), "service.escalation_policy.id", None)
         if escalion_policy_id:
             return self.get_oncall_from_escalation_policy(escalion_policy_id)
         return []
 
-    def get_summary_from_schedule(self, schedule_url: str, start_time: datetime, end_time: datetime) -> Dict[str, Any]:
+    def iter_incident_pages(
+        self,
+        params: Dict[str, Any],
+        max_pages: Optional[int] = None,
+        progress: Optional[Callable[[int, Optional[int]], None]] = None,
+        truncated: Optional[Callable[[int, Optional[int]], None]] = None,
+    ) -> Iterator[List[Dict[str, Any]]]:
+        max_pages = load_config().pagerduty_max_incident_pages if max_pages is None else max_pages
+
+        def fetch_page(offset: int) -> Dict[str, Any]:
+            r = self.session.get(
+                "/incidents", params={**params, "offset": offset, "limit": INCIDENT_PAGE_LIMIT}
+            )
+            return r.json()
+
+        def fetch(offset: int) -> List[Dict[str, Any]]:
+            return fetch_page(offset)["incidents"]
+
+        first = self.session.get(
+            "/incidents", params={**params, "offset": 0, "limit": INCIDENT_PAGE_LIMIT, "total": 1}
+        ).json()
+        if first["more"] and first.get("total") is None:
+            # without a total the offsets aren't known up front, so pages are followed one at a time
+            page, fetched = first, 0
+            while True:
+                fetched += len(page["incidents"])
+                if progress is not None:
+                    progress(fetched, None)
+                yield page["incidents"]
+                if not page["more"]:
+                    return
+                if fetched >= max_pages * INCIDENT_PAGE_LIMIT:
+                    print(f"Stopped paging incidents at {fetched} for {params}")
+                    if truncated is not None:
+                        truncated(fetched, None)
+                    return
+                page = fetch_page(fetched)
+
+        # once the total is known the remaining pages are fetched in parallel, a few at a time
+        total = min(first["total"] or 0, max_pages * INCIDENT_PAGE_LIMIT) if first["more"] else len(first["incidents"])
+        if first["more"] and (first["total"] or 0) > total:
+            print(f"Stopped paging incidents at {total} of {first['total']} for {params}")
+            if truncated is not None:
+                truncated(total, first["total"])
+        fetched = len(first["incidents"])
+        if progress is not None:
+            progress(fetched, total)
+        yield first["incidents"]
+        if not first["more"]:
+            return
+
+        offsets = iter(range(INCIDENT_PAGE_LIMIT, total, INCIDENT_PAGE_LIMIT))
+        in_flight = {_page_pool.submit(fetch, offset) for offset in islice(offsets, INCIDENT_PAGE_WINDOW)}
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight.update(_page_pool.submit(fetch, offset) for offset in islice(offsets, 1))
+                incidents = future.result()
+                fetched += len(incidents)
+                if progress is not None:
+                    progress(fetched, total)
+                yield incidents
+
+    def get_summary_from_schedule(
+        self,
+        schedule_url: str,
+        start_time: datetime,
+        end_time: datetime,
+        progress: Optional[Callable[[str], None]] = None,
+    ) -> Dict[str, Any]:
         match = self.parse_url(schedule_url)
         if match["type"] != "schedules":
             return {}
@@ -72,55 +352,96 @@ class PagerDuty(object):
         print(schedule)
         team_ids = [team["id"] for team in schedule["schedule"]["teams"]]
         oncall_user = self.get_oncall_from_schedule(schedule_id)[0]
-        incidents = []
-        offset = 0
+        time_zone = oncall_user["time_zone"]
+        start_time, end_time = to_utc(start_time, time_zone), to_utc(end_time, time_zone)
 
-        while True:
-            r = self.session.get(
-                f"/incidents",
-                params={
-                    "team_ids": team_ids,
-                    "since": start_time.isoformat(),
-                    "until": end_time.isoformat(),
-                    "offset": offset,
-                    "time_zone": oncall_user["time_zone"],
-                }
-            )
-            incidents.extend(r.json()["incidents"])
-            offset = len(incidents)
-            if not r.json()["more"]:
-                break
+        # only the part of the window the local archive hasn't seen is fetched from PagerDuty
+        archive = get_incident_archive()
 
-        for incident in incidents:
-            incident["created_at"] = datetime.fromisoformat(incident["created_at"])
+        def report(fetched: int, total: Optional[int]) -> None:
+            if progress is not None:
+                of_total = "" if total is None else f"/{total}"
+                progress(f":hourglass_flowing_sand: Fetched {fetched}{of_total} incidents from PagerDuty")
+
+        truncated_at = []
+
+        def fetch_pages(since: datetime, until: datetime, truncated: Callable[[int, Optional[int]], None]):
+            def on_truncated(limit: int, total: Optional[int]) -> None:
+                truncated_at.append(limit)
+                truncated(limit, total)
+
+            # oldest first, so a truncated sync knows how far it got
+            return self.iter_incident_pages({
+                "team_ids": team_ids,
+                "since": since.isoformat() + "Z",
+                "until": until.isoformat() + "Z",
+                "sort_by": "created_at:asc",
+            }, progress=report, truncated=on_truncated)
+
+        archive.sync(team_ids, start_time, end_time, fetch_pages)
+
+        def daily_counts(since: datetime, until: datetime) -> Dict[date, Dict[str, Any]]:
+            pages = archive.iter_incident_pages(team_ids, to_utc(since, time_zone), to_utc(until, time_zone), time_zone)
+            return summarize_incidents_by_day(pages)
+
+        # only days the archive has fully synced are rolled up, a truncated sync's days stay raw
+        synced = archive.synced_range(archive.team_key(team_ids)) or (start_time, start_time)
+
+        # days are bucketed in the on-call person's time zone, like the weekend and out of hours counts
+        counts = get_daily_rollups().summarize(
+            "pages",
+            archive.team_key(team_ids),
+            from_utc(start_time, time_zone),
+            from_utc(end_time, time_zone),
+            daily_counts,
+            time_zone=time_zone,
+            complete=(from_utc(synced[0], time_zone), from_utc(synced[1], time_zone)),
+        )
 
         summary = OrderedDict()
-        summary["total_pages"] = len(incidents)
+        summary["total_pages"] = counts["total"]
         summary["oncall"] = oncall_user
         # group by incident title
-        summary["group_by_titles"] = sorted(
-            Counter([incident["title"] for incident in incidents]).items(),
-            key=lambda x: x[1], reverse=True
-        )
+        summary["group_by_titles"] = sorted(counts["titles"].items(), key=lambda x: x[1], reverse=True)
+        summary["weekend_pages"] = counts["weekend_pages"]
+        summary["out_of_hours_pages"] = counts["out_of_hours_pages"]
+        # PagerDuty had more incidents than pagerduty_max_incident_pages allows, the counts are partial
+        summary["truncated_at"] = min(truncated_at) if truncated_at else None
+        return summary
 
-        summary["weekend_pages"] = len([
-            incident
-            for incident in incidents
-            if incident["created_at"].weekday() in [5, 6]
-        ])
-
-        summary["out_of_hours_pages"] = len([
-            incident
-            for incident in incidents
-            if (
-                incident["created_at"].weekday() not in [5, 6]
-                and (
-                   incident["created_at"].hour < 9
-                    or incident["created_at"].hour > 18
-                )
 
-            )
-        ])
+_pagerduty: Optional[PagerDuty] = None
 
 
-        return summary
+def get_pagerduty_client() -> PagerDuty:
+    global _pagerduty
+    if _pagerduty is None:
+        _pagerduty = PagerDuty(load_config().pagerduty_token)
+    return _pagerduty
+
+
+class AsyncPagerDuty(object):
+
+    # pdpyras is built on requests, so calls run on the event loop's executor
+    def __init__(self, pagerduty: PagerDuty):
+        self.pagerduty = pagerduty
+
+    def parse_url(self, url: str) -> Dict[str, str]:
+        return self.pagerduty.parse_url(url)
+
+    async def get_oncall(self, pagerduty_url: str) -> List[Dict[str, str]]:
+        return await asyncio.to_thread(self.pagerduty.get_oncall, pagerduty_url)
+
+    async def get_oncall_bulk(self, pagerduty_urls: List[str]) -> Dict[str, List[Dict[str, str]]]:
+        return await asyncio.to_thread(self.pagerduty.get_oncall_bulk, pagerduty_urls)
+
+    async def get_summary_from_schedule(
+        self,
+        schedule_url: str,
+        start_time: datetime,
+        end_time: datetime,
+        progress: Optional[Callable[[str], None]] = None,
+    ) -> Dict[str, Any]:
+        return await asyncio.to_thread(
+            self.pagerduty.get_summary_from_schedule, schedule_url, start_time, end_time, progress
+        )
@@ -0,0 +1,171 @@
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pytz
+from sqlalchemy import Engine, delete, or_, select
+
+from oncall_bot.local_db import dialect_insert, get_local_engine
+from oncall_bot.tables import DailyRollup
+from oncall_bot.utils import utcnow
+
+COUNT_COLUMNS = ["total", "code_review", "support", "weekend_pages", "out_of_hours_pages"]
+
+# computes per-day counts from raw data for the half-open range [since, until)
+DailyCounts = Callable[[datetime, datetime], Dict[date, Dict[str, Any]]]
+
+
+def empty_counts() -> Dict[str, Any]:
+    counts: Dict[str, Any] = {column: 0 for column in COUNT_COLUMNS}
+    counts["titles"] = Counter()
+    return counts
+
+
+def add_counts(total: Dict[str, Any], counts: Dict[str, Any]) -> Dict[str, Any]:
+    for column in COUNT_COLUMNS:
+        total[column] += counts.get(column) or 0
+    total["titles"].update(counts.get("titles") or {})
+    return total
+
+
+def midnight(day: date) -> datetime:
+    return datetime.combine(day, time())
+
+
+def first_whole_day(value: datetime) -> date:
+    return value.date() if value == midnight(value.date()) else value.date() + timedelta(days=1)
+
+
+def local_today(time_zone: str) -> date:
+    return datetime.now(pytz.timezone(time_zone)).date() if time_zone else date.today()
+
+
+class DailyRollups(object):
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.stats: Counter = Counter()
+
+    def summarize(
+        self,
+        source: str,
+        scope: str,
+        start: datetime,
+        end: datetime,
+        daily_counts: DailyCounts,
+        time_zone: str = "",
+        complete: Optional[Tuple[datetime, datetime]] = None,
+        max_age: Optional[float] = None,
+        recent_days: int = 0,
+    ) -> Dict[str, Any]:
+        # the summary command's end time is inclusive while the buckets are half-open
+        end = end + timedelta(microseconds=1)
+        first_day = first_whole_day(start)
+        last_day = min(end.date(), local_today(time_zone))
+        if complete is not None:
+            # days the raw data may still be missing rows for are counted but not stored
+            first_day = max(first_day, first_whole_day(complete[0]))
+            last_day = min(last_day, complete[1].date())
+
+        totals = empty_counts()
+        if first_day >= last_day:
+            edges = [(start, end)]
+        else:
+            edges = [(start, midnight(first_day)), (midnight(last_day), end)]
+            buckets = self.load(source, scope, time_zone, first_day, last_day, daily_counts, max_age, recent_days)
+            for counts in buckets.values():
+                add_counts(totals, counts)
+
+        # partial days at either end, including today, are always counted from raw data
+        for since, until in edges:
+            if since < until:
+                self.stats["raw_ranges"] += 1
+                for counts in daily_counts(since, until).values():
+                    add_counts(totals, counts)
+        return totals
+
+    def load(
+        self,
+        source: str,
+        scope: str,
+        time_zone: str,
+        first_day: date,
+        last_day: date,
+        daily_counts: DailyCounts,
+        max_age: Optional[float] = None,
+        recent_days: int = 0,
+    ) -> Dict[date, Dict[str, Any]]:
+        stmt = select(DailyRollup).where(
+            DailyRollup.c.source == source,
+            DailyRollup.c.scope == scope,
+            DailyRollup.c.time_zone == time_zone,
+            DailyRollup.c.day >= first_day,
+            DailyRollup.c.day < last_day,
+        )
+        if max_age is not None:
+            # recent days' buckets are rebuilt now and then, for sources that change without going through
+            # the bot; older days rarely change, so theirs are kept until a write invalidates them
+            stmt = stmt.where(or_(
+                DailyRollup.c.day < local_today(time_zone) - timedelta(days=recent_days),
+                DailyRollup.c.materialized_at >= utcnow() - timedelta(seconds=max_age),
+            ))
+        with self.engine.connect() as conn:
+            buckets = {row.day: row._asdict() for row in conn.execute(stmt)}
+        self.stats["days_hit"] += len(buckets)
+
+        days = [first_day + timedelta(days=i) for i in range((last_day - first_day).days)]
+        missing = [day for day in days if day not in buckets]
+        if missing:
+            # completed days are materialized the first time a summary covers them
+            computed = daily_counts(midnight(missing[0]), midnight(missing[-1] + timedelta(days=1)))
+            materialized = {day: computed.get(day) or empty_counts() for day in missing}
+            self.store(source, scope, time_zone, materialized)
+            self.stats["days_materialized"] += len(missing)
+            buckets.update(materialized)
+        return buckets
+
+    def store(self, source: str, scope: str, time_zone: str, buckets: Dict[date, Dict[str, Any]]) -> None:
+        materialized_at = utcnow()
+        rows = [
+            {
+                "source": source,
+                "scope": scope,
+                "time_zone": time_zone,
+                "day": day,
+                **{column: counts.get(column) or 0 for column in COUNT_COLUMNS},
+                "titles": dict(counts.get("titles") or {}),
+                "materialized_at": materialized_at,
+            }
+            for day, counts in buckets.items()
+        ]
+        stmt = dialect_insert(self.engine)(DailyRollup)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[DailyRollup.c.source, DailyRollup.c.scope, DailyRollup.c.time_zone, DailyRollup.c.day],
+            set_={column: stmt.excluded[column] for column in COUNT_COLUMNS + ["titles", "materialized_at"]},
+        )
+        with self.engine.begin() as conn:
+            conn.execute(stmt, rows)
+
+    def invalidate(self, source: str, scope: str, days: Optional[List[date]] = None) -> None:
+        # buckets touched by late writes are dropped and rebuilt on the next summary that covers them
+        stmt = delete(DailyRollup).where(DailyRollup.c.source == source, DailyRollup.c.scope == scope)
+        if days is not None:
+            if not days:
+                return
+            stmt = stmt.where(DailyRollup.c.day.in_(days))
+        with self.engine.begin() as conn:
+            deleted = conn.execute(stmt).rowcount
+        self.stats["days_invalidated"] += deleted
+
+    def metrics(self) -> Dict[str, Any]:
+        return dict(self.stats)
+
+
+_rollups: Optional[DailyRollups] = None
+
+
+def get_daily_rollups() -> DailyRollups:
+    global _rollups
+    if _rollups is None:
+        _rollups = DailyRollups(get_local_engine())
+    return _rollups
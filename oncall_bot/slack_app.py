@@ -1,36 +1,239 @@
+import asyncio
 import re
-from collections import namedtuple
+import threading
+import time
+from collections import Counter, namedtuple
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 
 from slack_bolt import App
-from slack_sdk.errors import SlackApiError
+from slack_bolt.async_app import AsyncApp
+from slack_sdk import WebClient
+from slack_sdk.web.async_client import AsyncWebClient
 
+from oncall_bot.cache import ExpiringCache
 from oncall_bot.config import load_config
+from oncall_bot.metrics import SLACK_TOOL_SECONDS, instrument_properties
+from oncall_bot.slack_client import get_async_slack_client, get_slack_client
+from oncall_bot.utils import get_key
 
 _app = None
+_async_app = None
 
-Context = namedtuple("Context", ["channel", "message_ts", "command_args", "thread_ts", "user"])
+# placeholder is the command's Placeholder, set by the first tool built for it
+Context = namedtuple(
+    "Context", ["channel", "message_ts", "command_args", "thread_ts", "user", "placeholder"], defaults=[None]
+)
+
+# progress edits of a placeholder are at most this often, chat.update is tier 3
+PROGRESS_INTERVAL = 2
+
+
+class Placeholder(object):
+
+    # the bot's "working on it" reply; shared by every tool a command is bridged through,
+    # so only the first response replaces it and progress edits stop once it has
+    def __init__(self):
+        self.ts: Optional[str] = None
+        self.progress_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set(self, ts: str) -> None:
+        with self._lock:
+            self.ts = ts
+            self.progress_at = time.monotonic()
+
+    def take(self) -> Optional[str]:
+        with self._lock:
+            ts, self.ts = self.ts, None
+            return ts
+
+    def progress_ts(self) -> Optional[str]:
+        with self._lock:
+            if self.ts is None or time.monotonic() - self.progress_at < PROGRESS_INTERVAL:
+                return None
+            self.progress_at = time.monotonic()
+            return self.ts
 
 
 def get_app() -> App:
     global _app
     if _app is None:
         _app = App(
-            token=load_config().slack_token,
+            client=get_slack_client(),
             signing_secret=load_config().slack_signing_secret,
         )
     return _app
 
 
+def get_async_app() -> AsyncApp:
+    global _async_app
+    if _async_app is None:
+        _async_app = AsyncApp(
+            client=get_async_slack_client(),
+            signing_secret=load_config().slack_signing_secret,
+        )
+    return _async_app
+
+
+class SlackUserIndex(object):
+
+    def __init__(self) -> None:
+        self.users_by_email: Dict[str, Dict[str, Any]] = {}
+        # the indexed email of each user, so a changed address drops the old key
+        self.emails_by_id: Dict[str, str] = {}
+        self.loaded = False
+        self.stats: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def update(self, user: Dict[str, Any]) -> None:
+        email = (get_key(user, "profile.email") or "").lower()
+        with self._lock:
+            previous = self.emails_by_id.pop(user.get("id"), None)
+            if previous is not None:
+                self.users_by_email.pop(previous, None)
+            if email and user.get("deleted"):
+                self.users_by_email.pop(email, None)
+            elif email:
+                self.users_by_email[email] = user
+                if user.get("id"):
+                    self.emails_by_id[user["id"]] = email
+            self.stats["updates"] += 1
+
+    def get(self, email: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            user = self.users_by_email.get(email.lower())
+            self.stats["hits" if user else "misses"] += 1
+            return user
+
+    def build(self, client: WebClient) -> None:
+        cursor = None
+        while True:
+            response = client.users_list(limit=200, cursor=cursor)
+            for user in response["members"]:
+                if not user.get("is_bot"):
+                    self.update(user)
+            cursor = get_key(response, "response_metadata.next_cursor")
+            if not cursor:
+                break
+        self.loaded = True
+        print(f"Indexed {len(self.users_by_email)} slack users")
+
+    def start_build(self) -> None:
+        # users.list is tier 2, the shared client paces the pages instead of failing half way through
+        threading.Thread(target=self.build, args=(get_slack_client(),), name="slack-user-index", daemon=True).start()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"users": len(self.users_by_email), "loaded": self.loaded, **self.stats}
+
+
+_user_index = SlackUserIndex()
+
+
+def get_user_index() -> SlackUserIndex:
+    return _user_index
+
+
+_UNSET = object()
+
+
+class SlackReadCache(object):
+
+    # shared across commands; channel entries are also dropped when the channel changes
+    def __init__(self, ttl: float, maxsize: int = 2048):
+        self.channel_info = ExpiringCache("slack_channel_info", ttl=ttl, maxsize=maxsize)
+        self.bookmarks = ExpiringCache("slack_bookmarks", ttl=ttl, maxsize=maxsize)
+        self.thread_roots = ExpiringCache("slack_thread_roots", ttl=ttl, maxsize=maxsize)
+        # a message's permalink never changes
+        self.permalinks = ExpiringCache("slack_permalinks", maxsize=maxsize)
+        self.request_stats: Counter = Counter()
+
+    def invalidate_channel(self, channel_id: str) -> None:
+        self.channel_info.invalidate(channel_id)
+        self.bookmarks.invalidate(channel_id)
+
+    def request_metrics(self) -> Dict[str, Any]:
+        lookups = self.request_stats["hits"] + self.request_stats["misses"]
+        return {
+            "cache": "slack_request_memo",
+            "hit_rate": self.request_stats["hits"] / lookups if lookups else None,
+            **self.request_stats,
+        }
+
+    def metrics(self) -> List[Dict[str, Any]]:
+        caches = [self.channel_info, self.bookmarks, self.thread_roots, self.permalinks]
+        return [cache.metrics() for cache in caches] + [self.request_metrics()]
+
+
+_read_cache: Optional[SlackReadCache] = None
+
+
+def get_slack_read_cache() -> SlackReadCache:
+    global _read_cache
+    if _read_cache is None:
+        _read_cache = SlackReadCache(load_config().slack_cache_ttl)
+    return _read_cache
+
+
+def parse_channel_str(channel_str):
+    match = re.match(r"<#(?P<channel_id>.*)\|(?P<channel_name>.*)>", channel_str)
+    if match:
+        return {"id": match.group("channel_id"), "name": match.group("channel_name")}
+    else:
+        return {"id": channel_str, "name": ""}
+
+
+@instrument_properties(SLACK_TOOL_SECONDS, "method")
 class SlackTool():
 
-    def __init__(self, app: App, context: Context) -> None:
+    # takes the client rather than the bolt app, so a command can be bridged without building another app
+    def __init__(self, client: WebClient, context: Context) -> None:
+        if context.placeholder is None:
+            context = context._replace(placeholder=Placeholder())
         self.context = context
-        self.app = app
+        self.client = client
+        # reads repeated within one command never leave the process
+        self.memo: Dict[Any, Any] = {}
+        # commands may share the tool between worker threads
+        self._memo_lock = threading.Lock()
+        self.placeholder = context.placeholder
+
+    def cached_read(self, cache: ExpiringCache, key: Any, fetch: Callable[[], Any]) -> Any:
+        read_cache = get_slack_read_cache()
+        with self._memo_lock:
+            value = self.memo.get((cache.name, key), _UNSET)
+            read_cache.request_stats["hits" if value is not _UNSET else "misses"] += 1
+        if value is not _UNSET:
+            return value
+        value = cache.get(key, _UNSET)
+        if value is _UNSET:
+            value = fetch()
+            cache.set(key, value)
+        with self._memo_lock:
+            self.memo[(cache.name, key)] = value
+        return value
+
+    def get_channel_info(self, channel_id: str) -> Dict[str, Any]:
+        return self.cached_read(
+            get_slack_read_cache().channel_info,
+            channel_id,
+            lambda: self.client.conversations_info(channel=channel_id)["channel"],
+        )
 
     @property
     def responser(self):
         def responser(text, markdown=False, **kwargs):
-            self.app.client.chat_postMessage(
+            placeholder_ts = self.placeholder.take()
+            if placeholder_ts is not None:
+                self.client.chat_update(
+                    channel=self.context.channel,
+                    ts=placeholder_ts,
+                    text=text,
+                    markdown=markdown,
+                    **kwargs
+                )
+                return
+            self.client.chat_postMessage(
                 channel=self.context.channel,
                 thread_ts=self.context.message_ts,
                 text=text,
@@ -39,10 +242,30 @@ class SlackTool():
             )
         return responser
 
+    @property
+    def post_placeholder(self):
+        def post_placeholder(text):
+            response = self.client.chat_postMessage(
+                channel=self.context.channel,
+                thread_ts=self.context.message_ts,
+                text=text,
+            )
+            self.placeholder.set(response["ts"])
+            return response["ts"]
+        return post_placeholder
+
+    @property
+    def progress(self):
+        def progress(text):
+            placeholder_ts = self.placeholder.progress_ts()
+            if placeholder_ts is not None:
+                self.client.chat_update(channel=self.context.channel, ts=placeholder_ts, text=text)
+        return progress
+
     @property
     def reaction_adder(self):
         def reaction_adder(ts, reaction_name):
-            self.app.client.reactions_add(
+            self.client.reactions_add(
                 channel=self.context.channel,
                 timestamp=ts,
                 name=reaction_name,
@@ -52,91 +275,281 @@ class SlackTool():
     @property
     def reaction_remover(self):
         def reaction_remover(ts, reaction_name):
-            self.app.client.reactions_remove(
+            self.client.reactions_remove(
                 channel=self.context.channel,
                 timestamp=ts,
                 name=reaction_name,
             )
         return reaction_remover
 
+    @property
+    def join_channel(self):
+        def join_channel(channel_id):
+            self.client.conversations_join(channel=channel_id)
+        return join_channel
+
     @property
     def get_thread_first_message(self):
-        def get_thread_first_message(ts):
-            return self.app.client.conversations_history(
-                channel=self.context.channel,
-                latest=ts,
-                limit=1,
-                inclusive=True
-            )["messages"].pop()
+        def get_thread_first_message(ts, fresh=False):
+            def fetch():
+                return self.client.conversations_history(
+                    channel=self.context.channel,
+                    latest=ts,
+                    limit=1,
+                    inclusive=True
+                )["messages"][-1]
+
+            # without a ts this is the channel's latest message, and a root's text can be edited since
+            if ts is None or fresh:
+                return fetch()
+            return self.cached_read(get_slack_read_cache().thread_roots, (self.context.channel, ts), fetch)
         return get_thread_first_message
 
     @property
     def get_permalink(self):
         def get_permalink(ts):
-            return self.app.client.chat_getPermalink(
-                channel=self.context.channel,
-                message_ts=ts,
-            )["permalink"]
+            return self.cached_read(
+                get_slack_read_cache().permalinks,
+                (self.context.channel, ts),
+                lambda: self.client.chat_getPermalink(
+                    channel=self.context.channel,
+                    message_ts=ts,
+                )["permalink"],
+            )
         return get_permalink
 
     @property
     def lookup_user(self):
         def lookup_user(email):
-            return self.app.client.users_lookupByEmail(email=email)
+            user = get_user_index().get(email)
+            if user is None:
+                user = self.client.users_lookupByEmail(email=email)["user"]
+                get_user_index().update(user)
+            return {"user": user}
         return lookup_user
 
     @property
     def parse_channel_str(self):
-        def parse_channel_str(channel_str):
-            match = re.match(r"<#(?P<channel_id>.*)\|(?P<channel_name>.*)>", channel_str)
-            if match:
-                return {"id": match.group("channel_id"), "name": match.group("channel_name")}
-            else:
-                return {"id": channel_str, "name": ""}
         return parse_channel_str
 
     @property
     def get_channel_topic(self):
         def get_channel_topic(channel_id):
-            return self.app.client.conversations_info(
-                channel=channel_id
-            )["channel"]["topic"]["value"]
+            return self.get_channel_info(channel_id)["topic"]["value"]
         return get_channel_topic
 
     @property
     def get_channel_name_from_channel_id(self):
         def get_channel_name_from_channel_id(channel_id):
-            return "#" + self.app.client.conversations_info(
-                channel=channel_id
-            )["channel"]["name"].lstrip("#")
+            return "#" + self.get_channel_info(channel_id)["name"].lstrip("#")
         return get_channel_name_from_channel_id
 
     @property
     def get_channel_bookmark(self):
         def get_channel_bookmark(channel_id):
-            return self.app.client.conversations_info(
-                channel=channel_id
-            )["channel"]["topic"]["value"]
+            return self.get_channel_info(channel_id)["topic"]["value"]
         return get_channel_bookmark
 
     @property
     def get_bookmarks(self):
         def get_bookmarks(channel):
-            try:
-                response = self.app.client.bookmarks_list(
-                    channel_id=channel
-                )
-                return response["bookmarks"]
-            except SlackApiError as e:
-                print(e)
-                return []
+            # a failed read raises rather than passing for a channel without bookmarks
+            return self.cached_read(
+                get_slack_read_cache().bookmarks,
+                channel,
+                lambda: self.client.bookmarks_list(channel_id=channel)["bookmarks"],
+            )
         return get_bookmarks
 
     @property
     def get_user_info(self):
         def get_user_info(user_id):
             print("get_user_info", user_id)
-            return self.app.client.users_info(
+            return self.client.users_info(
                 user=user_id
             ).data["user"]
         return get_user_info
+
+
+@instrument_properties(SLACK_TOOL_SECONDS, "method")
+class AsyncSlackTool():
+
+    def __init__(self, client: AsyncWebClient, context: Context) -> None:
+        if context.placeholder is None:
+            context = context._replace(placeholder=Placeholder())
+        self.context = context
+        self.client = client
+        self.memo: Dict[Any, Any] = {}
+        self.placeholder = context.placeholder
+        self.progress_updates: List[Any] = []
+
+    async def cached_read(self, cache: ExpiringCache, key: Any, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        read_cache = get_slack_read_cache()
+        value = self.memo.get((cache.name, key), _UNSET)
+        if value is not _UNSET:
+            read_cache.request_stats["hits"] += 1
+            return value
+        read_cache.request_stats["misses"] += 1
+        value = cache.get(key, _UNSET)
+        if value is _UNSET:
+            value = await fetch()
+            cache.set(key, value)
+        self.memo[(cache.name, key)] = value
+        return value
+
+    async def get_channel_info(self, channel_id: str) -> Dict[str, Any]:
+        async def fetch():
+            return (await self.client.conversations_info(channel=channel_id))["channel"]
+
+        return await self.cached_read(get_slack_read_cache().channel_info, channel_id, fetch)
+
+    @property
+    def responser(self):
+        async def responser(text, markdown=False, **kwargs):
+            placeholder_ts = self.placeholder.take()
+            # a progress edit still in flight would otherwise land on top of the response
+            for update in self.progress_updates:
+                try:
+                    await asyncio.wrap_future(update)
+                except Exception as e:
+                    print(f"Error updating progress: {str(e)}")
+            self.progress_updates.clear()
+            if placeholder_ts is not None:
+                await self.client.chat_update(
+                    channel=self.context.channel,
+                    ts=placeholder_ts,
+                    text=text,
+                    markdown=markdown,
+                    **kwargs
+                )
+                return
+            await self.client.chat_postMessage(
+                channel=self.context.channel,
+                thread_ts=self.context.message_ts,
+                text=text,
+                markdown=markdown,
+                **kwargs
+            )
+        return responser
+
+    @property
+    def post_placeholder(self):
+        async def post_placeholder(text):
+            response = await self.client.chat_postMessage(
+                channel=self.context.channel,
+                thread_ts=self.context.message_ts,
+                text=text,
+            )
+            self.placeholder.set(response["ts"])
+            return response["ts"]
+        return post_placeholder
+
+    @property
+    def progress(self):
+        # a plain callable like SlackTool's, the summary reports progress from a worker thread
+        loop = asyncio.get_running_loop()
+
+        def progress(text):
+            placeholder_ts = self.placeholder.progress_ts()
+            if placeholder_ts is not None:
+                update = self.client.chat_update(channel=self.context.channel, ts=placeholder_ts, text=text)
+                self.progress_updates.append(asyncio.run_coroutine_threadsafe(update, loop))
+        return progress
+
+    @property
+    def reaction_adder(self):
+        async def reaction_adder(ts, reaction_name):
+            await self.client.reactions_add(
+                channel=self.context.channel,
+                timestamp=ts,
+                name=reaction_name,
+            )
+        return reaction_adder
+
+    @property
+    def reaction_remover(self):
+        async def reaction_remover(ts, reaction_name):
+            await self.client.reactions_remove(
+                channel=self.context.channel,
+                timestamp=ts,
+                name=reaction_name,
+            )
+        return reaction_remover
+
+    @property
+    def join_channel(self):
+        async def join_channel(channel_id):
+            await self.client.conversations_join(channel=channel_id)
+        return join_channel
+
+    @property
+    def get_thread_first_message(self):
+        async def get_thread_first_message(ts, fresh=False):
+            async def fetch():
+                return (await self.client.conversations_history(
+                    channel=self.context.channel,
+                    latest=ts,
+                    limit=1,
+                    inclusive=True
+                ))["messages"][-1]
+
+            if ts is None or fresh:
+                return await fetch()
+            return await self.cached_read(get_slack_read_cache().thread_roots, (self.context.channel, ts), fetch)
+        return get_thread_first_message
+
+    @property
+    def get_permalink(self):
+        async def get_permalink(ts):
+            async def fetch():
+                return (await self.client.chat_getPermalink(
+                    channel=self.context.channel,
+                    message_ts=ts,
+                ))["permalink"]
+
+            return await self.cached_read(get_slack_read_cache().permalinks, (self.context.channel, ts), fetch)
+        return get_permalink
+
+    @property
+    def lookup_user(self):
+        async def lookup_user(email):
+            user = get_user_index().get(email)
+            if user is None:
+                user = (await self.client.users_lookupByEmail(email=email))["user"]
+                get_user_index().update(user)
+            return {"user": user}
+        return lookup_user
+
+    @property
+    def parse_channel_str(self):
+        return parse_channel_str
+
+    @property
+    def get_channel_topic(self):
+        async def get_channel_topic(channel_id):
+            return (await self.get_channel_info(channel_id))["topic"]["value"]
+        return get_channel_topic
+
+    @property
+    def get_channel_name_from_channel_id(self):
+        async def get_channel_name_from_channel_id(channel_id):
+            return "#" + (await self.get_channel_info(channel_id))["name"].lstrip("#")
+        return get_channel_name_from_channel_id
+
+    @property
+    def get_bookmarks(self):
+        async def get_bookmarks(channel):
+            async def fetch():
+                return (await self.client.bookmarks_list(channel_id=channel))["bookmarks"]
+
+            return await self.cached_read(get_slack_read_cache().bookmarks, channel, fetch)
+        return get_bookmarks
+
+    @property
+    def get_user_info(self):
+        async def get_user_info(user_id):
+            print("get_user_info", user_id)
+            return (await self.client.users_info(
+                user=user_id
+            )).data["user"]
+        return get_user_info
@@ -0,0 +1,258 @@
+import asyncio
+import json
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web.async_client import AsyncWebClient
+
+from oncall_bot.config import load_config
+
+# calls per minute and burst size of each Slack rate limit tier
+TIERS = {
+    1: (1, 1),
+    2: (20, 5),
+    3: (50, 10),
+    4: (100, 20),
+    # chat.postMessage allows about one message per second in each channel
+    "post": (60, 3),
+}
+
+METHOD_TIERS = {
+    "auth.test": 4,
+    "bookmarks.list": 3,
+    "chat.getPermalink": 4,
+    "chat.postMessage": "post",
+    "chat.update": 3,
+    "conversations.history": 3,
+    "conversations.info": 3,
+    "conversations.join": 3,
+    "reactions.add": 3,
+    "reactions.remove": 2,
+    "users.conversations": 3,
+    "users.info": 4,
+    "users.list": 2,
+    "users.lookupByEmail": 3,
+}
+DEFAULT_TIER = 3
+
+# identical calls to these that are already in flight share one response
+READ_METHODS = {
+    "bookmarks.list",
+    "chat.getPermalink",
+    "conversations.history",
+    "conversations.info",
+    "users.info",
+    "users.lookupByEmail",
+}
+
+
+class TokenBucket(object):
+
+    def __init__(self, per_minute: float, burst: int, clock: Callable[[], float] = time.monotonic):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated_at = clock()
+        self.paused_until = 0.0
+
+    def reserve(self) -> float:
+        # takes a token, borrowing from the future when there are none, and returns how long to wait
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.paused_until - now)
+
+    def pause(self, seconds: float) -> None:
+        # after a 429 nothing else goes out until Slack's Retry-After has passed
+        now = self.clock()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = min(self.tokens, 0.0)
+
+
+class SlackRateLimiter(object):
+
+    # shared by every client in the process, since Slack counts calls per app and workspace
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.buckets: Dict[Tuple[str, Optional[str]], TokenBucket] = {}
+        self.stats: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def bucket_key(self, api_method: str, args: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+        tier = METHOD_TIERS.get(api_method, DEFAULT_TIER)
+        return api_method, args.get("channel") if tier == "post" else None
+
+    def reserve(self, api_method: str, args: Dict[str, Any]) -> float:
+        key = self.bucket_key(api_method, args)
+        with self._lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                per_minute, burst = TIERS[METHOD_TIERS.get(api_method, DEFAULT_TIER)]
+                bucket = self.buckets[key] = TokenBucket(per_minute, burst, self.clock)
+            wait = bucket.reserve()
+            self.stats["calls"] += 1
+            if wait > 0:
+                self.stats["queued"] += 1
+                self.stats[f"queued.{api_method}"] += 1
+                self.stats["queued_seconds"] += wait
+            return wait
+
+    def throttled(self, api_method: str, args: Dict[str, Any], retry_after: float) -> None:
+        with self._lock:
+            self.buckets[self.bucket_key(api_method, args)].pause(retry_after)
+            self.stats["throttled"] += 1
+            self.stats[f"throttled.{api_method}"] += 1
+
+    def coalesced(self, api_method: str) -> None:
+        with self._lock:
+            self.stats["coalesced"] += 1
+            self.stats[f"coalesced.{api_method}"] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"buckets": len(self.buckets), **self.stats}
+
+
+_rate_limiter = SlackRateLimiter()
+
+
+def get_rate_limiter() -> SlackRateLimiter:
+    return _rate_limiter
+
+
+def call_args(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    # the generated client methods pass their arguments as one of these
+    return kwargs.get("json") or kwargs.get("params") or kwargs.get("data") or {}
+
+
+def retry_after(error: SlackApiError) -> Optional[float]:
+    if error.response.status_code != 429:
+        return None
+    headers = {key.lower(): value for key, value in (error.response.headers or {}).items()}
+    value = headers.get("retry-after")
+    return float(value[0] if isinstance(value, list) else value) if value else 1.0
+
+
+def coalesce_key(api_method: str, kwargs: Dict[str, Any]) -> Optional[str]:
+    if api_method not in READ_METHODS or kwargs.get("files"):
+        return None
+    return api_method + json.dumps(call_args(kwargs), sort_keys=True, default=str)
+
+
+class RateLimitedWebClient(WebClient):
+
+    # calls wait for their tier's budget instead of failing with 429s
+    def __init__(self, *args: Any, limiter: Optional[SlackRateLimiter] = None, max_retries: int = 5, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter or get_rate_limiter()
+        self.max_retries = max_retries
+        self.in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def api_call(self, api_method: str, **kwargs: Any):
+        key = coalesce_key(api_method, kwargs)
+        if key is None:
+            return self._call(api_method, kwargs)
+
+        with self._lock:
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self.in_flight[key] = Future()
+        if not owner:
+            self.limiter.coalesced(api_method)
+            return future.result()
+
+        try:
+            future.set_result(self._call(api_method, kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self.in_flight.pop(key, None)
+        return future.result()
+
+    def _call(self, api_method: str, kwargs: Dict[str, Any]):
+        args = call_args(kwargs)
+        for attempt in range(self.max_retries + 1):
+            wait = self.limiter.reserve(api_method, args)
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                return super().api_call(api_method, **kwargs)
+            except SlackApiError as e:
+                seconds = retry_after(e)
+                if seconds is None or attempt == self.max_retries:
+                    raise
+                self.limiter.throttled(api_method, args, seconds)
+
+
+class AsyncRateLimitedWebClient(AsyncWebClient):
+
+    def __init__(self, *args: Any, limiter: Optional[SlackRateLimiter] = None, max_retries: int = 5, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter or get_rate_limiter()
+        self.max_retries = max_retries
+        self.in_flight: Dict[Tuple[Any, str], "asyncio.Future[Any]"] = {}
+
+    async def api_call(self, api_method: str, **kwargs: Any):
+        key = coalesce_key(api_method, kwargs)
+        if key is None:
+            return await self._call(api_method, kwargs)
+
+        # sync mode runs async-only commands with asyncio.run on worker threads, one loop each
+        loop = asyncio.get_running_loop()
+        key = (loop, key)
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.limiter.coalesced(api_method)
+            return await asyncio.shield(future)
+
+        future = self.in_flight[key] = loop.create_future()
+        try:
+            future.set_result(await self._call(api_method, kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            self.in_flight.pop(key, None)
+        return future.result()
+
+    async def _call(self, api_method: str, kwargs: Dict[str, Any]):
+        args = call_args(kwargs)
+        for attempt in range(self.max_retries + 1):
+            wait = self.limiter.reserve(api_method, args)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                return await super().api_call(api_method, **kwargs)
+            except SlackApiError as e:
+                seconds = retry_after(e)
+                if seconds is None or attempt == self.max_retries:
+                    raise
+                self.limiter.throttled(api_method, args, seconds)
+
+
+_client: Optional[RateLimitedWebClient] = None
+_async_client: Optional[AsyncRateLimitedWebClient] = None
+
+
+def get_slack_client() -> RateLimitedWebClient:
+    global _client
+    if _client is None:
+        _client = RateLimitedWebClient(token=load_config().slack_token)
+    return _client
+
+
+def get_async_slack_client() -> AsyncRateLimitedWebClient:
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncRateLimitedWebClient(token=load_config().slack_token)
+    return _async_client
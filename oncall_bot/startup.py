@@ -0,0 +1,88 @@
+import importlib
+import threading
+import time
+from typing import Any, Callable, Dict
+
+# only the commands that use these load them, main must not import them at startup
+LAZY_MODULES = [
+    "dateparser",
+    "jira",
+    "pdpyras",
+    "gspread",
+    "google.oauth2.service_account",
+]
+
+
+class StartupProfile(object):
+
+    # the clock starts when main imports this module, before any of the bot's other modules load
+    def __init__(self, import_budget: float = 2.0):
+        self.started_at = time.perf_counter()
+        self.import_budget = import_budget
+        self.marks: Dict[str, float] = {}
+        self.warm_ups: Dict[str, float] = {}
+        self.warm_up_errors: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def mark(self, name: str) -> bool:
+        # only the first occurrence counts, returns whether this was it
+        with self._lock:
+            if name in self.marks:
+                return False
+            self.marks[name] = time.perf_counter() - self.started_at
+            return True
+
+    def imports_done(self) -> None:
+        if self.mark("imports") and self.marks["imports"] > self.import_budget:
+            print(
+                f"Startup imports took {self.marks['imports']:.2f}s, over the {self.import_budget:.2f}s budget; "
+                "profile them with `make profile-startup`"
+            )
+
+    def event_handled(self) -> None:
+        if self.mark("first_event"):
+            print(self.report())
+
+    def warm_up(self, warmers: Dict[str, Callable[[], Any]]) -> None:
+        for name, warmer in warmers.items():
+            started_at = time.perf_counter()
+            try:
+                warmer()
+            except Exception as e:
+                self.warm_up_errors[name] = repr(e)
+                print(f"Failed to warm up {name}: {e!r}")
+            self.warm_ups[name] = time.perf_counter() - started_at
+        self.mark("warm_up")
+        print(self.report())
+
+    def start_warm_up(self, warmers: Dict[str, Callable[[], Any]]) -> threading.Thread:
+        # runs once the socket is up, so a slow import never delays connecting to Slack
+        thread = threading.Thread(target=self.warm_up, args=(warmers,), name="warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def report(self) -> str:
+        lines = ["Startup profile:"]
+        for name, seconds in sorted(self.marks.items(), key=lambda item: item[1]):
+            lines.append(f"  {name:<20} {seconds:8.3f}s")
+        for name, seconds in sorted(self.warm_ups.items(), key=lambda item: -item[1]):
+            error = " (failed)" if name in self.warm_up_errors else ""
+            lines.append(f"  warm up {name:<30} {seconds:8.3f}s{error}")
+        return "\n".join(lines)
+
+    def metrics(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {f"{name}_seconds": seconds for name, seconds in self.marks.items()}
+        stats.update({f"warm_up_seconds.{name}": seconds for name, seconds in self.warm_ups.items()})
+        stats["warm_up_errors"] = len(self.warm_up_errors)
+        return stats
+
+
+_profile = StartupProfile()
+
+
+def get_startup_profile() -> StartupProfile:
+    return _profile
+
+
+def import_module(name: str) -> Callable[[], Any]:
+    return lambda: importlib.import_module(name)
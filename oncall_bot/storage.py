@@ -0,0 +1,143 @@
+import hashlib
+import queue
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import Engine, Index, MetaData, Table, create_engine
+
+from oncall_bot.config import load_config
+from oncall_bot.gsheet import Storage, get_gsheet_storage
+from oncall_bot.local_db import DIALECT_INSERTS
+from oncall_bot.rollups import get_daily_rollups
+from oncall_bot.tables import OncallInfo, get_tracking_columns
+
+
+class StorageMirror(object):
+
+    # copies writes to another storage in the background, e.g. for people who browse the google sheet
+    def __init__(self, target: Storage, max_retries: int = 3):
+        self.target = target
+        self.max_retries = max_retries
+        self.queue: "queue.Queue[Tuple[Table, Dict[Any, Dict[str, Any]]]]" = queue.Queue()
+        self.failures = 0
+        threading.Thread(target=self._work, name="storage-mirror", daemon=True).start()
+
+    def enqueue(self, table: Table, rows: Dict[Any, Dict[str, Any]]) -> None:
+        self.queue.put((table, {row_id: dict(data) for row_id, data in rows.items()}))
+
+    def _target_table(self, table: Table) -> Table:
+        if "tracking_url" in table.info:
+            return self.target.tracking_table(table.info["tracking_url"])
+        return table
+
+    def _drain(self) -> Tuple[Dict[str, Tuple[Table, Dict[Any, Dict[str, Any]]]], int]:
+        # everything queued so far is merged into one batch per table
+        batches: Dict[str, Tuple[Table, Dict[Any, Dict[str, Any]]]] = {}
+        items = [self.queue.get()]
+        while True:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        for table, rows in items:
+            _, batch = batches.setdefault(table.name, (table, {}))
+            for row_id, data in rows.items():
+                batch.setdefault(row_id, {}).update(data)
+        return batches, len(items)
+
+    def _work(self) -> None:
+        while True:
+            batches, count = self._drain()
+            for table, rows in batches.values():
+                for attempt in range(self.max_retries):
+                    try:
+                        self.target.upsert_many(self._target_table(table), rows)
+                        break
+                    except Exception as e:
+                        print(f"Error mirroring {len(rows)} rows of {table.name}: {str(e)}")
+                        time.sleep(2 ** attempt)
+                else:
+                    self.failures += 1
+            for _ in range(count):
+                self.queue.task_done()
+
+
+class SQLStorage(Storage):
+
+    def __init__(self, engine: Engine, mirror: Optional[StorageMirror] = None):
+        super().__init__(engine)
+        self.mirror = mirror
+        self.metadata = MetaData()
+        self.tracking_tables: Dict[str, Table] = {}
+        self._lock = threading.Lock()
+        OncallInfo.metadata.create_all(engine)
+
+    def create_table(self, table: Table) -> None:
+        table.create(self.engine, checkfirst=True)
+
+    def tracking_table(self, url: str) -> Table:
+        # tracking sheets are named by their url, which is too long for a table name in most databases
+        with self._lock:
+            if url not in self.tracking_tables:
+                name = "tracking_" + hashlib.sha1(url.encode()).hexdigest()[:16]
+                table = Table(
+                    name,
+                    self.metadata,
+                    *get_tracking_columns(),
+                    Index(f"ix_{name}_requested_at", "requested_at"),
+                    info={"tracking_url": url},
+                )
+                self.create_table(table)
+                self.tracking_tables[url] = table
+            return self.tracking_tables[url]
+
+    def write_rows(self, table: Table, rows: Dict[Any, Dict[str, Any]]) -> None:
+        dialect_insert = DIALECT_INSERTS.get(self.engine.dialect.name)
+        if dialect_insert is None:
+            return super().write_rows(table, rows)
+
+        primary_key_column = [key.name for key in table.primary_key][0]
+        # rows setting the same columns share one INSERT ... ON CONFLICT statement
+        groups = defaultdict(list)
+        for row_id, data in rows.items():
+            groups[tuple(sorted(data))].append({**data, primary_key_column: row_id})
+
+        with self.engine.begin() as conn:
+            for columns, values in groups.items():
+                stmt = dialect_insert(table)
+                update_columns = [column for column in columns if column != primary_key_column]
+                if update_columns:
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[primary_key_column],
+                        set_={column: stmt.excluded[column] for column in update_columns},
+                    )
+                else:
+                    stmt = stmt.on_conflict_do_nothing(index_elements=[primary_key_column])
+                conn.execute(stmt, values)
+        print(f"Upserted {len(rows)} rows into {table.name}")
+
+    def after_write(self, table: Table, rows: Dict[Any, Dict[str, Any]]) -> None:
+        super().after_write(table, rows)
+        if self.mirror is not None:
+            self.mirror.enqueue(table, rows)
+
+
+_storage: Optional[Storage] = None
+
+
+def get_storage() -> Storage:
+    global _storage
+    if _storage is None:
+        config = load_config()
+        if not config.storage_url:
+            _storage = get_gsheet_storage()
+        else:
+            mirror = StorageMirror(get_gsheet_storage()) if config.storage_mirror_to_gsheets else None
+            _storage = SQLStorage(create_engine(config.storage_url), mirror)
+            _storage.replicate(OncallInfo, config.storage_refresh_interval)
+        _storage.rollups = get_daily_rollups()
+        _storage.rollup_max_age = config.request_rollup_ttl
+        _storage.rollup_recent_days = config.request_rollup_recent_days
+    return _storage
@@ -1,7 +1,12 @@
-from sqlalchemy import JSON, Column, DateTime, MetaData, String, Table
+from typing import List
+
+from sqlalchemy import JSON, Boolean, Column, Date, DateTime, Index, Integer, MetaData, String, Table
 
 metadata = MetaData()
 
+# tables kept in the bot's local database rather than in google sheets
+local_metadata = MetaData()
+
 OncallInfo = Table(
     "oncall_info",
     MetaData(),
@@ -15,10 +20,8 @@ OncallInfo = Table(
 )
 
 
-def get_tracking_table(url: str) -> Table:
-    return Table(
-        url,
-        MetaData(),
+def get_tracking_columns() -> List[Column]:
+    return [
         Column("slack_url", String(), primary_key=True),
         Column("requested_at", DateTime()),
         Column("completed_at", DateTime()),
@@ -30,4 +33,76 @@ def get_tracking_table(url: str) -> Table:
         Column("classification", String()),
         Column("note", String()),
         Column("feedback_written_by", String()),
+    ]
+
+
+def get_tracking_table(url: str) -> Table:
+    return Table(
+        url,
+        MetaData(),
+        *get_tracking_columns(),
+        info={"tracking_url": url},
     )
+
+
+PagerDutyIncident = Table(
+    "pagerduty_incidents",
+    local_metadata,
+    Column("team_key", String(), primary_key=True),
+    Column("incident_id", String(), primary_key=True),
+    Column("title", String()),
+    Column("created_at", DateTime()),
+    Index("ix_pagerduty_incidents_team_created", "team_key", "created_at"),
+)
+
+PagerDutySyncState = Table(
+    "pagerduty_sync_state",
+    local_metadata,
+    Column("team_key", String(), primary_key=True),
+    Column("synced_since", DateTime()),
+    Column("synced_until", DateTime()),
+)
+
+JiraIdentity = Table(
+    "jira_identities",
+    local_metadata,
+    Column("slack_user_id", String(), primary_key=True),
+    Column("mention", String()),
+    Column("found", Boolean()),
+    Column("expires_at", DateTime()),
+)
+
+# one row per day of requests (scoped by tracking sheet) or pages (scoped by PagerDuty teams)
+DailyRollup = Table(
+    "daily_rollups",
+    local_metadata,
+    Column("source", String(), primary_key=True),
+    Column("scope", String(), primary_key=True),
+    Column("time_zone", String(), primary_key=True),
+    Column("day", Date(), primary_key=True),
+    Column("total", Integer()),
+    Column("code_review", Integer()),
+    Column("support", Integer()),
+    Column("weekend_pages", Integer()),
+    Column("out_of_hours_pages", Integer()),
+    Column("titles", JSON()),
+    Column("materialized_at", DateTime()),
+)
+
+DigestState = Table(
+    "digest_state",
+    local_metadata,
+    Column("channel_id", String(), primary_key=True),
+    Column("last_run_end", DateTime()),
+)
+
+# how the ping command finds the on-call for a channel, resolved ahead of time
+ChannelResolution = Table(
+    "channel_resolutions",
+    local_metadata,
+    Column("channel_id", String(), primary_key=True),
+    Column("pagerduty_urls", JSON()),
+    Column("source", String()),
+    Column("oncall_pings", String()),
+    Column("resolved_at", DateTime()),
+)
@@ -1,4 +1,5 @@
-from typing import Any, Callable, List, Optional
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterator, List, Optional, Sequence
 
 
 def get_key(item: Any, path: str, default_value: Any = None) -> Any:
@@ -16,6 +17,16 @@ def get_key(item: Any, path: str, default_value: Any = None) -> Any:
     return v
 
 
+def utcnow() -> datetime:
+    # naive, like the timestamps kept in the local database
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def chunks(items: Sequence[Any], size: int) -> Iterator[Sequence[Any]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
 def MinMaxValidator(min: Optional[int] = None, max: Optional[int] = None) -> Callable[[List[str]], Optional[str]]:
 
     def validator(values: List[str]) -> Optional[str]:
@@ -0,0 +1,225 @@
+import json
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from requests import Response
+from requests.adapters import BaseAdapter
+
+from oncall_bot.utils import get_key
+
+SCHEDULE_ID = "PSCHED1"
+SCHEDULE_URL = f"https://acme.pagerduty.com/schedules/{SCHEDULE_ID}"
+TRACKING_URL = "https://docs.google.com/spreadsheets/d/tracking"
+
+ONCALL_USER = {"id": "PUSER1", "name": "Ada", "email": "ada@example.com", "time_zone": "UTC"}
+
+SLACK_USERS = {
+    "U1": {"id": "U1", "name": "ada", "profile": {"email": "ada@example.com"}},
+    "U2": {"id": "U2", "name": "bob", "profile": {"email": "bob@example.com"}},
+}
+
+
+class UpstreamCalls(object):
+
+    # every fake records its calls here as "<upstream>.<call>" and sleeps for the injected latency
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, upstream: str, call: str) -> None:
+        with self._lock:
+            self.counts[f"{upstream}.{call}"] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def by_upstream(self) -> Dict[str, int]:
+        with self._lock:
+            totals: Counter = Counter()
+            for name, count in self.counts.items():
+                totals[name.split(".")[0]] += count
+            return dict(totals)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counts.clear()
+
+
+class FakeSlackResponse(dict):
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        return self
+
+
+class FakeSlackClient(object):
+
+    def __init__(self, calls: UpstreamCalls, channels: Dict[str, Dict[str, Any]]):
+        self.calls = calls
+        self.channels = channels
+        self.posted: List[Dict[str, Any]] = []
+        self.updated: List[Dict[str, Any]] = []
+
+    def _call(self, name: str, **data: Any) -> FakeSlackResponse:
+        self.calls.record("slack", name)
+        return FakeSlackResponse(ok=True, **data)
+
+    def chat_postMessage(self, **kwargs: Any) -> FakeSlackResponse:
+        self.posted.append(kwargs)
+        return self._call("chat_postMessage", ts=f"{time.time():.6f}")
+
+    def chat_update(self, **kwargs: Any) -> FakeSlackResponse:
+        self.updated.append(kwargs)
+        return self._call("chat_update", ts=kwargs["ts"])
+
+    def reactions_add(self, **kwargs: Any) -> FakeSlackResponse:
+        return self._call("reactions_add")
+
+    def reactions_remove(self, **kwargs: Any) -> FakeSlackResponse:
+        return self._call("reactions_remove")
+
+    def conversations_history(self, channel: str, latest: str, **kwargs: Any) -> FakeSlackResponse:
+        message = {"ts": latest, "user": "U1", "text": "<@U2> the deploy is stuck, can someone look?"}
+        return self._call("conversations_history", messages=[message])
+
+    def chat_getPermalink(self, channel: str, message_ts: str) -> FakeSlackResponse:
+        return self._call("chat_getPermalink", permalink=f"https://acme.slack.com/archives/{channel}/p{message_ts}")
+
+    def conversations_info(self, channel: str) -> FakeSlackResponse:
+        return self._call("conversations_info", channel=self.channels[channel])
+
+    def conversations_join(self, channel: str) -> FakeSlackResponse:
+        return self._call("conversations_join", channel=self.channels[channel])
+
+    def bookmarks_list(self, channel_id: str) -> FakeSlackResponse:
+        return self._call("bookmarks_list", bookmarks=[])
+
+    def users_info(self, user: str) -> FakeSlackResponse:
+        return self._call("users_info", user=SLACK_USERS[user])
+
+    def users_lookupByEmail(self, email: str) -> FakeSlackResponse:
+        user = next(user for user in SLACK_USERS.values() if user["profile"]["email"] == email)
+        return self._call("users_lookupByEmail", user=user)
+
+
+class FakeAsyncSlackClient(object):
+
+    # the same fake behind coroutine methods, like AsyncWebClient
+    def __init__(self, client: FakeSlackClient):
+        self.client = client
+
+    def __getattr__(self, name: str):
+        method = getattr(self.client, name)
+
+        async def call(**kwargs: Any) -> FakeSlackResponse:
+            return method(**kwargs)
+        return call
+
+
+def fake_slack_app(calls: UpstreamCalls, channels: Dict[str, Dict[str, Any]]) -> SimpleNamespace:
+    return SimpleNamespace(client=FakeSlackClient(calls, channels))
+
+
+def fake_oncall(
+    user: Optional[Dict[str, Any]] = None,
+    schedule_id: Optional[str] = SCHEDULE_ID,
+    policy_id: str = "PPOLICY1",
+    level: int = 1,
+    end: Optional[str] = "2099-01-01T00:00:00+00:00",
+) -> Dict[str, Any]:
+    return {
+        "user": user or ONCALL_USER,
+        "schedule": {"id": schedule_id} if schedule_id else None,
+        "escalation_policy": {"id": policy_id},
+        "escalation_level": level,
+        "end": end,
+    }
+
+
+class FakePagerDutyAdapter(BaseAdapter):
+
+    # mounted on a real pdpyras session, so its paging and unwrapping run as they do in production
+    def __init__(
+        self,
+        calls: UpstreamCalls,
+        incidents: List[Dict[str, Any]],
+        oncalls: Optional[List[Dict[str, Any]]] = None,
+        resources: Optional[Dict[str, Dict[str, Any]]] = None,
+        report_total: bool = True,
+    ):
+        super().__init__()
+        self.calls = calls
+        self.incidents = incidents
+        # PagerDuty only counts the matches when asked to, and may still answer with a null total
+        self.report_total = report_total
+        self.oncalls = [fake_oncall()] if oncalls is None else oncalls
+        # any other path and the body it answers with
+        self.resources = resources or {}
+
+    def route(self, path: str, params: Dict[str, List[str]]) -> Optional[Dict[str, Any]]:
+        if path in self.resources:
+            return self.resources[path]
+        if path == "/oncalls":
+            schedules, policies = params.get("schedule_ids[]"), params.get("escalation_policy_ids[]")
+            oncalls = [
+                oncall for oncall in self.oncalls
+                if (schedules is None or get_key(oncall, "schedule.id") in schedules)
+                and (policies is None or oncall["escalation_policy"]["id"] in policies)
+            ]
+            return {"oncalls": oncalls, "more": False, "offset": 0, "limit": 100}
+        if path == f"/schedules/{SCHEDULE_ID}":
+            return {"schedule": {"id": SCHEDULE_ID, "teams": [{"id": "PTEAM1"}]}}
+        if path == f"/schedules/{SCHEDULE_ID}/users":
+            return {"users": [ONCALL_USER]}
+        if path == "/incidents":
+            offset, limit = int(params["offset"][0]), int(params["limit"][0])
+            return {
+                "incidents": self.incidents[offset:offset + limit],
+                "more": offset + limit < len(self.incidents),
+                "total": len(self.incidents) if self.report_total and params.get("total") == ["1"] else None,
+                "offset": offset,
+                "limit": limit,
+            }
+        return None
+
+    def send(self, request, **kwargs: Any) -> Response:
+        url = urlparse(request.url)
+        self.calls.record("pagerduty", f"{request.method} {url.path}")
+        body = self.route(url.path, parse_qs(url.query))
+
+        response = Response()
+        response.status_code = 200 if body is not None else 404
+        response._content = json.dumps(body or {"error": {"message": "Not Found"}}).encode()
+        response.headers["Content-Type"] = "application/json"
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(seconds=self.calls.latency)
+        return response
+
+    def close(self) -> None:
+        pass
+
+
+class FakeJiraClient(object):
+
+    # stands in for jira.JIRA
+    calls: Optional[UpstreamCalls] = None
+
+    def __init__(self, server: str, **kwargs: Any):
+        self.server = server
+        self.created: List[Dict[str, Any]] = []
+
+    def search_users(self, query: str = "", **kwargs: Any) -> List[SimpleNamespace]:
+        self.calls.record("jira", "search_users")
+        return [SimpleNamespace(accountId=f"acct-{query.split('@')[0]}")]
+
+    def create_issue(self, **fields: Any) -> SimpleNamespace:
+        self.calls.record("jira", "create_issue")
+        self.created.append(fields)
+        return SimpleNamespace(key=f"{fields['project']['key']}-{len(self.created)}")
@@ -0,0 +1,188 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from pdpyras import APISession
+from sqlalchemy import create_engine
+
+from oncall_bot import channel_index, incident_archive, jira, local_db, mention_bot, pagerduty, rollups, slack_app
+from oncall_bot import storage as storage_module
+from oncall_bot.gsheet import Storage
+from oncall_bot.tables import OncallInfo, local_metadata
+from tests.fakes import (
+    SCHEDULE_URL, TRACKING_URL, FakeJiraClient, FakePagerDutyAdapter, UpstreamCalls, fake_slack_app
+)
+
+BOT_ID = "UBOT"
+CHANNELS = {
+    "C1": {"id": "C1", "name": "team-oncall", "topic": {"value": f"{SCHEDULE_URL}\n:pagerduty: <@U1>"}},
+    "C2": {"id": "C2", "name": "team-other", "topic": {"value": ""}},
+}
+
+# every registered command, with the arguments it is benchmarked with
+SCENARIOS = {
+    "help": "help",
+    "set-pagerduty": f"set-pagerduty <{SCHEDULE_URL}>",
+    "get-pagerduty": "get-pagerduty",
+    "set-sheet-url": f"set-sheet-url <{TRACKING_URL}>",
+    "get-sheet-url": "get-sheet-url <#C1|team-oncall>",
+    "mark-complete": "mark-complete",
+    "unmark-complete": "unmark-complete",
+    "ping": "ping <#C1|team-oncall>",
+    "join": "join <#C2|team-other>",
+    "summary": "summary <#C1|team-oncall> 2024-01-01 2024-01-31",
+    "set-jira-project": 'set-jira-project OPS Task "{}"',
+    "get-jira-project": "get-jira-project",
+    "create-ticket": 'create-ticket "Deploy stuck" "Please take a look"',
+    "__DEFAULT__": "",
+    "test": "test",
+}
+
+# upstream calls per command, on a cold start and when repeated with warm caches;
+# change a budget only when the extra round trips are intended
+BUDGETS = {
+    "help": ({"slack": 1}, {"slack": 1}),
+    "set-pagerduty": ({"slack": 2}, {"slack": 1}),
+    "get-pagerduty": ({"slack": 1}, {"slack": 1}),
+    "set-sheet-url": ({"slack": 2}, {"slack": 1}),
+    "get-sheet-url": ({"slack": 1}, {"slack": 1}),
+    "mark-complete": ({"slack": 2}, {"slack": 1}),
+    "unmark-complete": ({"slack": 2}, {"slack": 1}),
+    "ping": ({"slack": 3, "pagerduty": 1}, {"slack": 1}),
+    "join": ({"slack": 2}, {"slack": 2}),
+    "summary": ({"slack": 2, "pagerduty": 5}, {"slack": 2, "pagerduty": 1}),
+    "set-jira-project": ({"slack": 2}, {"slack": 1}),
+    "get-jira-project": ({"slack": 1}, {"slack": 1}),
+    # the thread root is re-read every time since its text may have been edited
+    "create-ticket": ({"slack": 6, "jira": 3}, {"slack": 3, "jira": 1}),
+    "__DEFAULT__": ({"slack": 3, "pagerduty": 1}, {"slack": 1}),
+    "test": ({}, {}),
+}
+
+# time a command may spend in the bot itself, on top of waiting for its upstream calls one after another
+LOCAL_SECONDS_BUDGET = 0.5
+
+
+def incidents():
+    start = datetime(2024, 1, 1, 3)
+    return [
+        {
+            "id": f"PINC{i}",
+            "title": f"Alert {i % 5}",
+            "created_at": (start + timedelta(hours=7 * i)).isoformat() + "+00:00",
+        }
+        for i in range(250)
+    ]
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    calls = UpstreamCalls()
+
+    local_engine = create_engine(f"sqlite:///{tmp_path}/local.db")
+    local_metadata.create_all(local_engine)
+    monkeypatch.setattr(local_db, "_local_engine", local_engine)
+    monkeypatch.setattr(rollups, "_rollups", rollups.DailyRollups(local_engine))
+    monkeypatch.setattr(incident_archive, "_archive", incident_archive.IncidentArchive(local_engine, rollups.get_daily_rollups()))
+    monkeypatch.setattr(jira, "_identity_cache", jira.JiraIdentityCache(local_engine, ttl=3600, negative_ttl=60))
+
+    # a sqlite database stands in for the google sheet, behind the same Storage the sheets use
+    storage = Storage(create_engine(f"sqlite:///{tmp_path}/storage.db"))
+    OncallInfo.metadata.create_all(storage.engine)
+    storage.tracking_table(TRACKING_URL).create(storage.engine)
+    storage.replicate(OncallInfo, 60)
+    storage.rollups = rollups.get_daily_rollups()
+    storage.upsert_many(storage.tracking_table(TRACKING_URL), {
+        f"https://acme.slack.com/archives/C1/p{i}": {
+            "requested_at": datetime(2024, 1, 1) + timedelta(hours=5 * i),
+            "subject": "Code Review" if i % 3 == 0 else "Question",
+            "completed_at": datetime(2024, 2, 1) if i % 4 else None,
+        }
+        for i in range(200)
+    })
+    storage.upsert_table(OncallInfo, "C1", {
+        OncallInfo.c.channel_name.name: "#team-oncall",
+        OncallInfo.c.pagerduty_url.name: SCHEDULE_URL,
+        OncallInfo.c.tracking_sheet.name: TRACKING_URL,
+    })
+    storage.refresh_replicas()
+    monkeypatch.setattr(storage_module, "_storage", storage)
+
+    index = channel_index.ChannelIndex(local_engine, ttl=3600)
+    storage.watch(OncallInfo, index.invalidate)
+    monkeypatch.setattr(channel_index, "_channel_index", index)
+    monkeypatch.setattr(slack_app, "_read_cache", slack_app.SlackReadCache(ttl=300))
+    monkeypatch.setattr(slack_app, "_user_index", slack_app.SlackUserIndex())
+
+    session = APISession("bench-token")
+    session.mount("https://", FakePagerDutyAdapter(calls, incidents()))
+    monkeypatch.setattr(pagerduty, "_sessions", {"bench-token": session})
+    monkeypatch.setattr(pagerduty, "_pagerduty", pagerduty.PagerDuty("bench-token"))
+
+    monkeypatch.setattr(FakeJiraClient, "calls", calls)
+    monkeypatch.setattr("jira.JIRA", FakeJiraClient)
+    monkeypatch.setattr(jira, "_jira", jira.Jira("https://acme.atlassian.net", "bot@example.com", "token"))
+
+    # commands run inline so each one is timed from mention to reply
+    monkeypatch.setattr(mention_bot, "get_command_executor", lambda: None)
+    return calls, fake_slack_app(calls, CHANNELS)
+
+
+def mention(command: str):
+    ts = f"{time.time():.6f}"
+    return {
+        "event": {
+            "type": "app_mention",
+            "text": f"<@{BOT_ID}> {command}",
+            "channel": "C1",
+            "ts": ts,
+            "thread_ts": "1700000000.000100",
+            "user": "U1",
+        }
+    }
+
+
+def run(calls, app, command):
+    calls.reset()
+    started_at = time.perf_counter()
+    mention_bot.MentionedBot.process_command(BOT_ID, app, mention(command))
+    return time.perf_counter() - started_at, calls.by_upstream(), dict(calls.counts)
+
+
+def test_every_command_has_a_benchmark():
+    assert set(SCENARIOS) == set(mention_bot.MentionedBot.commands)
+    assert set(BUDGETS) == set(SCENARIOS)
+
+
+@pytest.mark.parametrize("latency", [0, 0.005])
+@pytest.mark.parametrize("name", list(SCENARIOS))
+def test_command_stays_within_upstream_call_budget(bot, capsys, name, latency):
+    calls, app = bot
+    calls.latency = latency
+    first_seconds, first, first_calls = run(calls, app, SCENARIOS[name])
+    repeat_seconds, repeat, repeat_calls = run(calls, app, SCENARIOS[name])
+
+    with capsys.disabled():
+        print(
+            f"\n{name:<18} latency {latency * 1000:.0f}ms: first {first_seconds * 1000:.1f}ms {first}, "
+            f"repeat {repeat_seconds * 1000:.1f}ms {repeat}"
+        )
+    replies = app.client.posted + app.client.updated
+    assert not any(reply["text"].startswith("Error") for reply in replies), replies
+    assert first == BUDGETS[name][0], f"first run of {name}: {first_calls}"
+    assert repeat == BUDGETS[name][1], f"repeat of {name}: {repeat_calls}"
+    assert first_seconds < LOCAL_SECONDS_BUDGET + sum(first.values()) * latency, f"first run of {name}"
+    assert repeat_seconds < LOCAL_SECONDS_BUDGET + sum(repeat.values()) * latency, f"repeat of {name}"
+
+
+def test_slow_commands_reply_with_a_placeholder_and_stream_progress(bot, monkeypatch):
+    calls, app = bot
+    monkeypatch.setattr(slack_app, "PROGRESS_INTERVAL", 0)
+    run(calls, app, SCENARIOS["summary"])
+
+    placeholder = app.client.posted[0]
+    assert placeholder["text"].endswith("Working on the summary...")
+    updates = [update["text"] for update in app.client.updated]
+    assert ":hourglass_flowing_sand: Fetched 100/250 incidents from PagerDuty" in updates
+    assert updates[-1].startswith("*### Pagerduty Summary ###*")
+    assert len(app.client.posted) == 1
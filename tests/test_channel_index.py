@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from slack_sdk.errors import SlackApiError
+from sqlalchemy import create_engine
+
+from oncall_bot import channel_index, mention_bot
+from oncall_bot.channel_index import ChannelIndex, resolve_channel
+from oncall_bot.gsheet import Storage
+from oncall_bot.tables import OncallInfo, local_metadata
+
+
+def test_resolution_prefers_configured_url_then_topic_then_bookmarks():
+    topic = "https://x.pagerduty.com/schedules/P2\n:pagerduty: <@U1>"
+    bookmarks = [{"link": "https://x.pagerduty.com/pagerduty_url/P3"}]
+
+    assert resolve_channel("https://x.pagerduty.com/schedules/P1", topic, bookmarks) == {
+        "pagerduty_urls": ["https://x.pagerduty.com/schedules/P1"],
+        "source": "oncall_info",
+        "oncall_pings": "<@U1>",
+    }
+    assert resolve_channel(None, topic, bookmarks)["pagerduty_urls"] == ["https://x.pagerduty.com/schedules/P2"]
+    assert resolve_channel(None, "", bookmarks)["source"] == "bookmarks"
+    assert resolve_channel(None, "", [])["source"] is None
+
+
+def test_index_is_persisted_and_invalidated_by_storage_writes(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/local.db")
+    local_metadata.create_all(engine)
+    index = ChannelIndex(engine, ttl=3600)
+    index.update("C1", resolve_channel(None, "https://x.pagerduty.com/schedules/P2", None))
+
+    restarted = ChannelIndex(engine, ttl=3600)
+    assert restarted.get("C1")["pagerduty_urls"] == ["https://x.pagerduty.com/schedules/P2"]
+    assert ChannelIndex(engine, ttl=0).get("C1") is None
+
+    storage = Storage(create_engine(f"sqlite:///{tmp_path}/storage.db"))
+    OncallInfo.metadata.create_all(storage.engine)
+    storage.watch(OncallInfo, restarted.invalidate)
+    storage.upsert_table(OncallInfo, "C1", {"pagerduty_url": "https://x.pagerduty.com/schedules/P1"})
+    assert restarted.get("C1") is None
+    assert ChannelIndex(engine, ttl=3600).get("C1") is None
+
+
+def test_entries_resolved_from_the_topic_expire_sooner(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/local.db")
+    local_metadata.create_all(engine)
+    index = ChannelIndex(engine, ttl=3600, topic_ttl=0)
+    index.update("C1", resolve_channel(None, ":pagerduty: <@U1>", [{"link": "https://x/pagerduty_url/P1"}]))
+    index.update("C2", resolve_channel("https://x.pagerduty.com/schedules/P2", "", None))
+
+    assert index.get("C1") is None
+    assert index.get("C2")["source"] == "oncall_info"
+
+
+def test_entries_are_not_kept_when_slack_reads_fail(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path}/local.db")
+    local_metadata.create_all(engine)
+    index = ChannelIndex(engine, ttl=3600)
+    storage = Storage(create_engine(f"sqlite:///{tmp_path}/storage.db"))
+    OncallInfo.metadata.create_all(storage.engine)
+    storage.upsert_table(OncallInfo, "C2", {"pagerduty_url": "https://x.pagerduty.com/schedules/P2"})
+    monkeypatch.setattr(mention_bot, "get_channel_index", lambda: index)
+    monkeypatch.setattr(mention_bot, "get_storage", lambda: storage)
+    monkeypatch.setattr(channel_index, "get_storage", lambda: storage)
+
+    def fail(*args, **kwargs):
+        raise SlackApiError("ratelimited", {"ok": False, "error": "ratelimited"})
+
+    slack_tool = SimpleNamespace(get_channel_topic=fail, get_bookmarks=fail)
+    with pytest.raises(SlackApiError):
+        mention_bot.resolve_channel_for_ping("C1", slack_tool)
+    assert mention_bot.resolve_channel_for_ping("C2", slack_tool)["source"] == "oncall_info"
+    slack_tool.get_channel_topic = lambda channel: ""
+    with pytest.raises(SlackApiError):
+        mention_bot.resolve_channel_for_ping("C3", slack_tool)
+    assert [index.get(channel) for channel in ["C1", "C2", "C3"]] == [None, None, None]
+
+    client = SimpleNamespace(
+        users_conversations=lambda **kwargs: {"channels": [{"id": "C1", "topic": {"value": ""}}]},
+        bookmarks_list=fail,
+    )
+    monkeypatch.setattr(channel_index, "get_pagerduty_client", lambda: SimpleNamespace(get_oncall_bulk=lambda urls: {}))
+    index.build(client)
+    assert index.get("C1") is None
+    assert index.metrics()["build_failures"] == 1
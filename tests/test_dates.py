@@ -0,0 +1,63 @@
+import json
+import subprocess
+import sys
+from datetime import datetime
+
+import pytest
+
+from oncall_bot.dates import WEEKDAYS, fast_parse, normalize, parse_date, parse_metrics
+
+# a wednesday afternoon
+NOW = datetime(2026, 10, 14, 15, 30, 12)
+
+
+@pytest.mark.parametrize("text", [
+    "today", "now", "Yesterday", "tomorrow", "last week", "7 days ago", "1 day ago", "2 weeks ago",
+    "3 hours ago", "an hour ago", "Wednesday", "Sun", "2024-01-01", "2024/01/05",
+    "2024-01-31T10:00:00", "2024-01-31T10:00:00+00:00", *WEEKDAYS,
+])
+def test_fast_path_matches_dateparser(text):
+    dateparser = pytest.importorskip("dateparser")
+    parsed = fast_parse(normalize(text), NOW)
+    assert parsed is not None
+    assert parsed == dateparser.parse(text, languages=["en"], settings={"RELATIVE_BASE": NOW})
+
+
+LAZY_CHECK = """
+import json, sys
+from datetime import datetime
+from oncall_bot.dates import parse_date
+parsed = [parse_date("2024-01-31T10:00:00Z"), parse_date("  7  Days ago ", now=datetime(2026, 10, 14, 15, 30, 12))]
+print(json.dumps({"parsed": [value.isoformat() for value in parsed], "loaded": "dateparser" in sys.modules}))
+"""
+
+
+def test_fast_path_leaves_dateparser_unloaded():
+    # a fresh interpreter, dropping dateparser from sys.modules here would load a second copy
+    result = subprocess.run([sys.executable, "-c", LAZY_CHECK], capture_output=True, text=True, check=True)
+    check = json.loads(result.stdout.strip().splitlines()[-1])
+    assert check["parsed"] == ["2024-01-31T10:00:00+00:00", "2026-10-07T15:30:12"]
+    assert not check["loaded"]
+
+
+@pytest.mark.parametrize("text", ["1 month ago", "in 3 hours", "2 days 3 hours ago", "10am"])
+def test_relative_fallbacks_keep_the_time_of_day(text):
+    dateparser = pytest.importorskip("dateparser")
+    for now in [NOW, NOW.replace(hour=18, minute=5)]:
+        assert parse_date(text, now=now) == dateparser.parse(text, languages=["en"], settings={"RELATIVE_BASE": now})
+
+
+def test_fallbacks_are_cached_per_day():
+    pytest.importorskip("dateparser")
+    hits = parse_metrics()["fallback_cache_hits"]
+    assert parse_date("March 3 2024", now=NOW) == datetime(2024, 3, 3)
+    assert parse_date("march 3 2024", now=NOW.replace(hour=18)) == datetime(2024, 3, 3)
+    assert parse_date("9am", now=NOW) == datetime(2026, 10, 14, 9)
+    assert parse_date("9am", now=NOW.replace(hour=18)) == datetime(2026, 10, 14, 9)
+    assert parse_date("5 months ago", now=NOW) == datetime(2026, 5, 14, 15, 30, 12)
+    assert parse_date("5 months ago", now=NOW.replace(hour=18, microsecond=5)) == datetime(2026, 5, 14, 18, 30, 12, 5)
+    assert parse_metrics()["fallback_cache_hits"] == hits + 3
+
+    assert parse_date("march 3", now=NOW) == datetime(2026, 3, 3)
+    assert parse_date("march 3", now=datetime(2027, 1, 2)) == datetime(2027, 3, 3)
+    assert parse_metrics()["fallback_cache_hits"] == hits + 3
@@ -0,0 +1,84 @@
+from datetime import datetime, timezone
+
+import pytz
+from sqlalchemy import create_engine
+
+from oncall_bot.digests import DigestScheduler, next_run, parse_digest, previous_run
+from oncall_bot.tables import local_metadata
+
+WEEKLY = parse_digest({"channel": "C1", "weekday": "monday", "time": "09:00", "time_zone": "US/Pacific"})
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def pacific(*args):
+    return pytz.timezone("US/Pacific").localize(datetime(*args))
+
+
+def test_runs_follow_local_time_across_dst():
+    # 2024-03-10 is the start of daylight saving time in the US
+    assert next_run(WEEKLY, utc(2024, 3, 5)) == utc(2024, 3, 11, 16)
+    assert next_run(WEEKLY, utc(2024, 3, 11, 16)) == utc(2024, 3, 18, 16)
+    assert previous_run(WEEKLY, utc(2024, 3, 11, 12)) == utc(2024, 3, 4, 17)
+
+
+def test_scheduler_posts_each_interval_once_and_staggers_channels(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/local.db")
+    local_metadata.create_all(engine)
+    daily = parse_digest({"channel": "C2", "time": "09:00", "time_zone": "US/Pacific"})
+    summarized, posted = [], []
+    scheduler = DigestScheduler(
+        [WEEKLY, daily],
+        engine,
+        lambda channel, start, end: summarized.append((channel, start, end)) or ["summary"],
+        lambda channel, text: posted.append(channel),
+        stagger_seconds=60,
+    )
+
+    scheduler.run_pending(utc(2024, 1, 1, 12))
+    assert posted == []
+
+    wake_at = scheduler.run_pending(utc(2024, 1, 1, 17))
+    assert posted == ["C1"]
+    assert summarized == [("C1", pacific(2023, 12, 25, 9), pacific(2024, 1, 1, 9))]
+    # the window carries the digest's time zone rather than leaving it to the reader
+    assert summarized[0][1].tzinfo is not None
+    assert wake_at == utc(2024, 1, 1, 17, 1)
+
+    scheduler.run_pending(utc(2024, 1, 1, 17, 1))
+    assert posted == ["C1", "C2"]
+    assert summarized[-1] == ("C2", pacific(2023, 12, 31, 9), pacific(2024, 1, 1, 9))
+    scheduler.run_pending(utc(2024, 1, 1, 18))
+    assert len(posted) == 2
+
+    # the daily digest was missed for a week and catches up in one post
+    scheduler.run_pending(utc(2024, 1, 8, 18))
+    assert posted == ["C1", "C2", "C1", "C2"]
+    assert summarized[-1] == ("C2", pacific(2024, 1, 1, 9), pacific(2024, 1, 8, 9))
+    assert scheduler.metrics()["posted"] == 4
+
+
+def test_stagger_only_counts_digests_due_at_the_same_time(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/local.db")
+    local_metadata.create_all(engine)
+    digests = [
+        parse_digest({"channel": "C1", "time": "09:00", "time_zone": "UTC"}),
+        parse_digest({"channel": "C2", "time": "10:00", "time_zone": "UTC"}),
+        parse_digest({"channel": "C3", "time": "11:00", "time_zone": "UTC"}),
+        parse_digest({"channel": "C4", "time": "09:00", "time_zone": "UTC"}),
+    ]
+    posted = []
+    scheduler = DigestScheduler(
+        digests, engine, lambda channel, start, end: ["summary"], lambda channel, text: posted.append(channel),
+        stagger_seconds=60,
+    )
+
+    scheduler.run_pending(utc(2024, 1, 1, 8))
+    wake_at = scheduler.run_pending(utc(2024, 1, 1, 9))
+    assert posted == ["C1"]
+    # C4 is the second digest due at 09:00, not the fourth in the list
+    assert wake_at == utc(2024, 1, 1, 9, 1)
+    scheduler.run_pending(utc(2024, 1, 1, 9, 1))
+    assert posted == ["C1", "C4"]
@@ -0,0 +1,88 @@
+import threading
+
+from oncall_bot.executor import PRIORITY_BULK, PRIORITY_NORMAL, PRIORITY_URGENT, CommandExecutor
+
+
+def test_channel_tasks_run_in_submission_order():
+    executor = CommandExecutor(max_workers=4, max_queue_size=100)
+    results = []
+    for i in range(20):
+        executor.submit("C1", PRIORITY_NORMAL, results.append, i)
+    executor.shutdown()
+
+    assert results == list(range(20))
+    assert executor.metrics()["completed.normal"] == 20
+
+
+def test_urgent_channels_run_before_bulk():
+    executor = CommandExecutor(max_workers=1, max_queue_size=100)
+    started = threading.Event()
+    release = threading.Event()
+    results = []
+
+    def block():
+        started.set()
+        release.wait()
+
+    executor.submit("busy", PRIORITY_NORMAL, block)
+    started.wait()
+    executor.submit("C1", PRIORITY_BULK, results.append, "summary")
+    executor.submit("C2", PRIORITY_URGENT, results.append, "ping")
+    release.set()
+    executor.shutdown()
+
+    assert results == ["ping", "summary"]
+
+
+def test_a_slow_summary_does_not_hold_up_a_ping_in_another_thread():
+    executor = CommandExecutor(max_workers=2, max_queue_size=100)
+    release = threading.Event()
+    pinged = threading.Event()
+
+    executor.submit(("C1", "1.0"), PRIORITY_BULK, release.wait)
+    executor.submit(("C1", "2.0"), PRIORITY_URGENT, pinged.set)
+
+    assert pinged.wait(2)
+    release.set()
+    executor.shutdown()
+
+
+def test_urgent_tasks_run_first_within_a_thread():
+    executor = CommandExecutor(max_workers=1, max_queue_size=100)
+    started = threading.Event()
+    release = threading.Event()
+    results = []
+
+    def block():
+        started.set()
+        release.wait()
+
+    executor.submit(("C1", "1.0"), PRIORITY_BULK, block)
+    started.wait()
+    executor.submit(("C1", "1.0"), PRIORITY_BULK, results.append, "summary")
+    executor.submit(("C1", "1.0"), PRIORITY_NORMAL, results.append, "ticket")
+    executor.submit(("C1", "1.0"), PRIORITY_URGENT, results.append, "ping")
+    assert executor.metrics()["queue_depth.bulk"] == 1
+    release.set()
+    executor.shutdown()
+
+    assert results == ["ping", "ticket", "summary"]
+
+
+def test_submit_rejects_when_queue_is_full():
+    executor = CommandExecutor(max_workers=1, max_queue_size=1)
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+        started.set()
+        release.wait()
+
+    assert executor.submit("C1", PRIORITY_NORMAL, block)
+    started.wait()
+    assert executor.submit("C2", PRIORITY_NORMAL, print)
+    assert not executor.submit("C3", PRIORITY_URGENT, print)
+    assert executor.metrics()["queue_depth"] == 1
+    release.set()
+    executor.shutdown()
+    assert executor.metrics()["rejected.urgent"] == 1
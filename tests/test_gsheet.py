@@ -1,10 +1,15 @@
 import pytest
+from sqlalchemy import text
 
-from oncall_bot.gsheet import get_google_sheet
+from oncall_bot.config import load_config
+from oncall_bot.gsheet import get_gsheet_storage
 
 
+@pytest.mark.skipif(
+    not load_config().google_sheet_service_account, reason="needs google sheet credentials"
+)
 def test_gsheet():
-    storage = get_google_sheet()
-    conn = storage.engine.connect()
-    result = conn.execute("select * from oncall_info")
-    print(result.fetchall())
+    storage = get_gsheet_storage()
+    with storage.engine.connect() as conn:
+        result = conn.execute(text("select * from oncall_info"))
+        print(result.fetchall())
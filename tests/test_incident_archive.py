@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+
+import pytz
+from sqlalchemy import create_engine
+
+from oncall_bot.incident_archive import IncidentArchive, to_utc
+from oncall_bot.rollups import DailyRollups
+from oncall_bot.tables import local_metadata
+
+JAN_1 = datetime(2024, 1, 1)
+
+
+def make_archive(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/local.db")
+    local_metadata.create_all(engine)
+    return IncidentArchive(engine, DailyRollups(engine))
+
+
+def incident(i, created_at):
+    return {"id": f"PINC{i}", "title": "Alert", "created_at": created_at.isoformat() + "+00:00"}
+
+
+def fake_fetch(incidents, limit=None):
+    # serves incidents oldest first, stopping at limit like PagerDuty paging does
+    fetched = []
+
+    def fetch_pages(since, until, truncated):
+        fetched.append((since, until))
+        matching = [i for i in incidents if since <= datetime.fromisoformat(i["created_at"][:-6]) < until]
+        if limit is not None and len(matching) > limit:
+            truncated(limit, len(matching))
+            matching = matching[:limit]
+        return [matching[start:start + 2] for start in range(0, len(matching), 2)]
+    return fetch_pages, fetched
+
+
+def test_missing_ranges_and_mark_synced_grow_one_contiguous_range(tmp_path):
+    archive = make_archive(tmp_path)
+    day = lambda n: JAN_1 + timedelta(days=n)  # noqa: E731
+
+    assert archive.missing_ranges("T", day(0), day(10)) == [(day(0), day(10))]
+    archive.mark_synced("T", day(3), day(5))
+    assert archive.missing_ranges("T", day(4), day(5)) == []
+    # partly overlapping on either side, or both
+    assert archive.missing_ranges("T", day(1), day(4)) == [(day(1), day(3))]
+    assert archive.missing_ranges("T", day(4), day(8)) == [(day(5), day(8))]
+    assert archive.missing_ranges("T", day(0), day(9)) == [(day(0), day(3)), (day(5), day(9))]
+
+    archive.mark_synced("T", day(5), day(8))
+    archive.mark_synced("T", day(4), day(6))
+    assert archive.synced_range("T") == (day(3), day(8))
+    archive.mark_synced("T", day(1), day(3))
+    assert archive.synced_range("T") == (day(1), day(8))
+
+
+def test_sync_fetches_only_missing_ranges(tmp_path):
+    archive = make_archive(tmp_path)
+    incidents = [incident(i, JAN_1 + timedelta(hours=6 * i)) for i in range(40)]
+    fetch_pages, fetched = fake_fetch(incidents)
+
+    assert archive.sync(["PTEAM1"], JAN_1 + timedelta(days=2), JAN_1 + timedelta(days=4), fetch_pages) == 8
+    assert archive.sync(["PTEAM1"], JAN_1, JAN_1 + timedelta(days=3), fetch_pages) == 8
+    assert fetched == [
+        (JAN_1 + timedelta(days=2), JAN_1 + timedelta(days=4)),
+        (JAN_1, JAN_1 + timedelta(days=2)),
+    ]
+    assert archive.synced_range("PTEAM1") == (JAN_1, JAN_1 + timedelta(days=4))
+
+
+def test_truncated_sync_only_marks_what_was_stored(tmp_path):
+    archive = make_archive(tmp_path)
+    incidents = [incident(i, JAN_1 + timedelta(hours=i)) for i in range(48)]
+    end = JAN_1 + timedelta(days=2)
+
+    fetch_pages, _ = fake_fetch(incidents, limit=10)
+    assert archive.sync(["PTEAM1"], JAN_1, end, fetch_pages) == 10
+    assert archive.synced_range("PTEAM1") == (JAN_1, JAN_1 + timedelta(hours=9))
+
+    # the next sync picks up from the last stored incident
+    fetch_pages, fetched = fake_fetch(incidents)
+    archive.sync(["PTEAM1"], JAN_1, end, fetch_pages)
+    assert fetched == [(JAN_1 + timedelta(hours=9), end)]
+    assert archive.synced_range("PTEAM1") == (JAN_1, end)
+    assert sum(len(page) for page in archive.iter_incident_pages(["PTEAM1"], JAN_1, end, "UTC")) == 48
+
+    # a truncated range below the synced one can't be marked without leaving a gap
+    earlier = [incident(100 + i, JAN_1 - timedelta(hours=i + 1)) for i in range(20)]
+    fetch_pages, _ = fake_fetch(sorted(earlier, key=lambda i: i["created_at"]), limit=5)
+    archive.sync(["PTEAM1"], JAN_1 - timedelta(days=1), end, fetch_pages)
+    assert archive.synced_range("PTEAM1") == (JAN_1, end)
+
+
+def test_aware_times_keep_their_own_time_zone():
+    # digests pass times in the channel's zone, which needn't be the on-call person's
+    digest_time = pytz.timezone("Europe/London").localize(datetime(2024, 1, 1, 9))
+    assert to_utc(digest_time, "US/Pacific") == datetime(2024, 1, 1, 9)
+    assert to_utc(datetime(2024, 1, 1, 9), "US/Pacific") == datetime(2024, 1, 1, 17)
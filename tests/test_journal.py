@@ -0,0 +1,147 @@
+import json
+import time
+
+import pytest
+from sqlalchemy import create_engine, select
+
+from oncall_bot import journal as journal_module
+from oncall_bot.journal import RequestJournal, parse_request_content, record_request
+from oncall_bot.storage import SQLStorage
+from oncall_bot.tables import OncallInfo
+
+TRACKING_URL = "https://docs.google.com/spreadsheets/d/tracking"
+
+
+def make_storage(tmp_path):
+    storage = SQLStorage(create_engine(f"sqlite:///{tmp_path}/storage.db"))
+    storage.upsert_table(OncallInfo, "C1", {OncallInfo.c.tracking_sheet.name: TRACKING_URL})
+    return storage
+
+
+def tracked_rows(storage):
+    with storage.engine.connect() as conn:
+        return {row.slack_url: row for row in conn.execute(select(storage.tracking_table(TRACKING_URL)))}
+
+
+def test_flush_writes_journal_entries_in_batches(tmp_path):
+    storage = make_storage(tmp_path)
+    journal = RequestJournal(str(tmp_path / "requests.journal"), lambda: storage, batch_size=2)
+    for i in range(5):
+        content = json.dumps({"subject": "Code Review", "requested_by": f"user{i}", "unknown": "ignored"})
+        journal.append({"log_id": f"log{i}", "support_channel": "C1", "data": parse_request_content(content)})
+
+    assert journal.metrics()["backlog"] == 5
+    assert journal.flush() == 5
+
+    rows = tracked_rows(storage)
+    assert sorted(rows) == [f"log{i}" for i in range(5)]
+    assert rows["log3"].requested_by == "user3"
+    assert rows["log3"].requested_at is not None
+    assert journal.metrics()["backlog"] == 0
+    assert (tmp_path / "requests.journal").read_text() == ""
+
+
+def test_unflushed_entries_are_replayed_after_restart(tmp_path):
+    storage = make_storage(tmp_path)
+    path = str(tmp_path / "requests.journal")
+    journal = RequestJournal(path, lambda: storage)
+    journal.append({"log_id": "log1", "support_channel": "C1", "data": parse_request_content("plain text")})
+    with open(path, "a") as fp:
+        fp.write('{"log_id": "torn"')
+
+    restarted = RequestJournal(path, lambda: storage)
+    assert restarted.backlog == 1
+    assert restarted.flush() == 1
+    assert tracked_rows(storage)["log1"].request_content == "plain text"
+    assert "torn" not in open(path).read()
+
+
+def test_corrupt_entries_are_quarantined_and_later_entries_flushed(tmp_path):
+    storage = make_storage(tmp_path)
+    path = str(tmp_path / "requests.journal")
+    journal = RequestJournal(path, lambda: storage)
+    journal.append({"log_id": "log1", "support_channel": "C1", "data": parse_request_content("first")})
+    with open(path, "a") as fp:
+        fp.write('{"log_id": "garbled\n')
+    journal.append({"log_id": "log2", "support_channel": "C1", "data": parse_request_content("second")})
+
+    assert journal.flush() == 3
+    assert sorted(tracked_rows(storage)) == ["log1", "log2"]
+    assert journal.metrics()["quarantined"] == 1
+    assert open(path + ".corrupt").read() == '{"log_id": "garbled\n'
+    assert journal.metrics()["backlog"] == 0
+
+
+def test_appends_do_not_cut_the_failure_backoff_short(tmp_path):
+    attempts = []
+
+    def failing_storage():
+        attempts.append(time.monotonic())
+        raise ConnectionError("sheets unavailable")
+
+    journal = RequestJournal(str(tmp_path / "requests.journal"), failing_storage, flush_interval=0.2)
+    journal.append({"log_id": "log1", "support_channel": "C1", "data": parse_request_content("first")})
+    journal.start()
+    deadline = time.monotonic() + 2
+    while not attempts and time.monotonic() < deadline:
+        time.sleep(0.01)
+    for i in range(5):
+        journal.append({"log_id": f"retry{i}", "support_channel": "C1", "data": parse_request_content("x")})
+        time.sleep(0.02)
+
+    # the first retry waits out the doubled interval despite the appends
+    assert len(attempts) == 1
+    time.sleep(0.5)
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.4
+
+
+def test_failing_channel_is_dead_lettered_without_blocking_others(tmp_path):
+    storage = make_storage(tmp_path)
+    storage.upsert_table(OncallInfo, "C2", {OncallInfo.c.tracking_sheet.name: "https://docs.google.com/spreadsheets/d/gone"})
+    upsert_many = storage.upsert_many
+
+    def failing_upsert_many(table, rows):
+        if "log_c2" in rows:
+            raise PermissionError("sheet no longer shared")
+        upsert_many(table, rows)
+
+    storage.upsert_many = failing_upsert_many
+    path = str(tmp_path / "requests.journal")
+    journal = RequestJournal(path, lambda: storage, max_channel_attempts=3)
+    journal.append({"log_id": "log_c2", "support_channel": "C2", "data": parse_request_content("stuck")})
+    journal.append({"log_id": "log_c1", "support_channel": "C1", "data": parse_request_content("first")})
+
+    for _ in range(2):
+        with pytest.raises(PermissionError):
+            journal.flush()
+        assert journal.metrics()["backlog"] == 2
+    assert sorted(tracked_rows(storage)) == ["log_c1"]
+
+    assert journal.flush() == 2
+    assert journal.metrics()["dead_lettered"] == 1
+    assert journal.metrics()["backlog"] == 0
+    assert [json.loads(line)["log_id"] for line in open(path + ".failed")] == ["log_c2"]
+
+    journal.append({"log_id": "log_c1_next", "support_channel": "C1", "data": parse_request_content("next")})
+    assert journal.flush() == 1
+    assert sorted(tracked_rows(storage)) == ["log_c1", "log_c1_next"]
+
+
+def test_requests_for_untracked_channels_are_counted(tmp_path):
+    storage = make_storage(tmp_path)
+    journal = RequestJournal(str(tmp_path / "requests.journal"), lambda: storage)
+    assert journal.metrics()["dropped"] == 0
+
+    journal.append({"log_id": "log1", "support_channel": "C9", "data": parse_request_content("nobody")})
+    assert journal.flush() == 1
+    assert journal.metrics()["dropped"] == 1
+
+
+def test_requests_are_written_directly_without_a_journal(tmp_path, monkeypatch):
+    storage = make_storage(tmp_path)
+    monkeypatch.setattr(journal_module, "get_request_journal", lambda: None)
+    monkeypatch.setattr(journal_module, "get_storage", lambda: storage)
+
+    record_request({"log_id": "log1", "support_channel": "C1", "data": parse_request_content("direct")})
+    assert tracked_rows(storage)["log1"].request_content == "direct"
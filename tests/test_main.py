@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+from slack_bolt import App
+from slack_bolt.async_app import AsyncApp
+from slack_bolt.authorization import AuthorizeResult
+from slack_bolt.request import BoltRequest
+from slack_bolt.request.async_request import AsyncBoltRequest
+from sqlalchemy import create_engine
+
+from oncall_bot import channel_index, main, slack_app, startup
+from oncall_bot import storage as storage_module
+from oncall_bot.tables import OncallInfo, local_metadata
+from tests.fakes import SCHEDULE_URL, FakeSlackClient, UpstreamCalls
+
+BOT_ID = "UBOT"
+OLD_TOPIC = ":pagerduty: <@U1>"
+NEW_TOPIC = f"{SCHEDULE_URL}\n:pagerduty: <@U2>"
+
+
+def authorize(**kwargs):
+    return AuthorizeResult(enterprise_id=None, team_id="T1", bot_token="xoxb-test", bot_user_id=BOT_ID, bot_id="B1")
+
+
+async def async_authorize(**kwargs):
+    return authorize()
+
+
+@pytest.fixture
+def channels(tmp_path, monkeypatch):
+    channels = {"C1": {"id": "C1", "name": "team-oncall", "topic": {"value": OLD_TOPIC}}}
+    calls = UpstreamCalls()
+
+    local_engine = create_engine(f"sqlite:///{tmp_path}/local.db")
+    local_metadata.create_all(local_engine)
+    storage = storage_module.SQLStorage(create_engine(f"sqlite:///{tmp_path}/storage.db"))
+    storage.upsert_table(OncallInfo, "C1", {OncallInfo.c.channel_name.name: "#team-oncall"})
+    monkeypatch.setattr(storage_module, "_storage", storage)
+
+    index = channel_index.ChannelIndex(local_engine, ttl=3600)
+    index.update("C1", channel_index.resolve_channel(None, OLD_TOPIC, []))
+    monkeypatch.setattr(channel_index, "_channel_index", index)
+    read_cache = slack_app.SlackReadCache(ttl=300)
+    read_cache.channel_info.set("C1", dict(channels["C1"]))
+    monkeypatch.setattr(slack_app, "_read_cache", read_cache)
+    refresher = channel_index.ChannelRefresher(FakeSlackClient(calls, channels))
+    monkeypatch.setattr(channel_index, "_channel_refresher", refresher)
+
+    monkeypatch.setattr(slack_app, "_app", App(authorize=authorize, process_before_response=True))
+    monkeypatch.setattr(slack_app, "_async_app", AsyncApp(authorize=async_authorize, process_before_response=True))
+    return channels
+
+
+def send(async_mode, *events):
+    app = main.create_async_app() if async_mode else main.create_app()
+    for event in events:
+        body = {"type": "event_callback", "team_id": "T1", "event": event}
+        if async_mode:
+            asyncio.run(app.async_dispatch(AsyncBoltRequest(body=body, mode="socket_mode")))
+        else:
+            app.dispatch(BoltRequest(body=body, mode="socket_mode"))
+    # the refresh itself runs in the background
+    channel_index.get_channel_refresher()._pool.shutdown(wait=True)
+    return channel_index.get_channel_refresher().metrics()
+
+
+@pytest.mark.parametrize("async_mode", [False, True])
+def test_topic_change_refreshes_the_read_cache_and_index(channels, async_mode):
+    assert channel_index.get_channel_index().get("C1")["oncall_pings"] == "<@U1>"
+    channels["C1"]["topic"] = {"value": NEW_TOPIC}
+
+    metrics = send(async_mode, {"type": "message", "subtype": "channel_topic", "channel": "C1", "ts": "1.0"})
+
+    assert metrics["channel_topic"] == 1
+    assert metrics["refreshed"] == 1
+    assert slack_app.get_slack_read_cache().channel_info.get("C1")["topic"]["value"] == NEW_TOPIC
+    entry = channel_index.get_channel_index().get("C1")
+    assert entry["pagerduty_urls"] == [SCHEDULE_URL]
+    assert entry["oncall_pings"] == "<@U2>"
+
+
+@pytest.mark.parametrize("async_mode", [False, True])
+def test_rename_updates_the_stored_channel_name(channels, async_mode):
+    channels["C1"]["name"] = "team-renamed"
+
+    send(async_mode, {"type": "channel_rename", "channel": {"id": "C1", "name": "team-renamed"}})
+
+    row = storage_module.get_storage().query_table(OncallInfo, "C1", [OncallInfo.c.channel_name])
+    assert row[OncallInfo.c.channel_name.name] == "#team-renamed"
+    assert slack_app.get_slack_read_cache().channel_info.get("C1")["name"] == "team-renamed"
+
+
+@pytest.mark.parametrize("async_mode", [False, True])
+def test_only_the_bot_joining_a_channel_refreshes_it(channels, async_mode):
+    channels["C1"]["topic"] = {"value": NEW_TOPIC}
+
+    metrics = send(
+        async_mode,
+        {"type": "member_joined_channel", "user": "U1", "channel": "C1"},
+        {"type": "member_joined_channel", "user": BOT_ID, "channel": "C1"},
+    )
+
+    assert metrics["member_joined_channel"] == 1
+    assert metrics["refreshed"] == 1
+    assert channel_index.get_channel_index().get("C1")["oncall_pings"] == "<@U2>"
+
+
+def test_first_event_is_recorded_when_the_command_fails(channels, monkeypatch):
+    profile = startup.StartupProfile()
+    monkeypatch.setattr(startup, "_profile", profile)
+
+    async def fail(*args):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(main.MentionedBot, "process_command_async", fail)
+    send(True, {"type": "app_mention", "text": f"<@{BOT_ID}> help", "channel": "C1", "ts": "1.0", "user": "U1"})
+
+    assert "first_event" in profile.marks
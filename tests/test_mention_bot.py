@@ -0,0 +1,162 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from slack_sdk.errors import SlackApiError
+from sqlalchemy import create_engine
+
+from oncall_bot import jira, mention_bot, slack_app
+from oncall_bot.executor import PRIORITY_NORMAL
+from oncall_bot.jira import JiraIdentityCache
+from oncall_bot.mention_bot import Command, MentionedBot, resolve_jira_mentions
+from oncall_bot.slack_app import AsyncSlackTool, SlackTool
+from oncall_bot.tables import local_metadata
+from oncall_bot.utils import MinMaxValidator
+from tests.fakes import FakeAsyncSlackClient, FakeSlackClient, UpstreamCalls
+
+BOT_ID = "UBOT"
+
+
+def mention(command):
+    return {"event": {"type": "app_mention", "text": f"<@{BOT_ID}> {command}", "channel": "C1", "ts": "1.0", "user": "U1"}}
+
+
+def command(name, func=None, async_func=None):
+    return Command(func, name, "", MinMaxValidator(0, 1), True, async_func, PRIORITY_NORMAL, name, None)
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    client = FakeSlackClient(UpstreamCalls(), {})
+    async_client = FakeAsyncSlackClient(client)
+    # bridged commands get plain clients, building another bolt app would call auth.test
+    monkeypatch.setattr(mention_bot, "get_slack_client", lambda: client)
+    monkeypatch.setattr(mention_bot, "get_async_slack_client", lambda: async_client)
+    monkeypatch.setattr(slack_app, "get_app", lambda: pytest.fail("built a bolt app"))
+    monkeypatch.setattr(slack_app, "get_async_app", lambda: pytest.fail("built a bolt app"))
+    monkeypatch.setattr(mention_bot, "get_command_executor", lambda: None)
+    return client, async_client
+
+
+def test_async_pipeline_dispatches_bridges_and_rejects(monkeypatch, clients):
+    client, async_client = clients
+    ran = []
+
+    async def async_only(context, slack_tool):
+        assert isinstance(slack_tool, AsyncSlackTool)
+        ran.append(("async", context.command_args))
+        await slack_tool.responser("async done")
+
+    def sync_only(context, slack_tool):
+        assert isinstance(slack_tool, SlackTool) and slack_tool.client is client
+        ran.append(("sync", context.command_args))
+        slack_tool.responser("sync done")
+
+    monkeypatch.setitem(MentionedBot.commands, "t-async", command("t-async", async_func=async_only))
+    monkeypatch.setitem(MentionedBot.commands, "t-sync", command("t-sync", func=sync_only))
+    app = SimpleNamespace(client=async_client)
+
+    asyncio.run(MentionedBot.process_command_async(BOT_ID, app, mention("t-async a")))
+    asyncio.run(MentionedBot.process_command_async(BOT_ID, app, mention("t-sync b")))
+    asyncio.run(MentionedBot.process_command_async(BOT_ID, app, mention("t-sync too many args")))
+
+    assert ran == [("async", ["a"]), ("sync", ["b"])]
+    assert [message["text"] for message in client.posted] == [
+        "async done", "sync done", "The argument is too long, expected at most 1 got 3"
+    ]
+
+
+def test_sync_pipeline_runs_async_only_commands_on_a_plain_client(monkeypatch, clients):
+    client, _ = clients
+
+    async def async_only(context, slack_tool):
+        await slack_tool.responser(f"hello {context.user}")
+
+    monkeypatch.setitem(MentionedBot.commands, "t-async", command("t-async", async_func=async_only))
+    MentionedBot.process_command(BOT_ID, SimpleNamespace(client=client), mention("t-async"))
+    assert [message["text"] for message in client.posted] == ["hello U1"]
+
+
+@pytest.mark.parametrize("async_mode", [False, True])
+def test_bridged_tools_share_the_placeholder(monkeypatch, clients, async_mode):
+    client, async_client = clients
+
+    async def async_only(context, slack_tool):
+        await slack_tool.responser("result")
+        raise RuntimeError("after responding")
+
+    def sync_only(context, slack_tool):
+        slack_tool.responser("result")
+        raise RuntimeError("after responding")
+
+    # the command runs through the other pipeline's tool, the error is reported by the outer one
+    if async_mode:
+        bridged = command("t-bridged", func=sync_only)._replace(placeholder="Working...")
+    else:
+        bridged = command("t-bridged", async_func=async_only)._replace(placeholder="Working...")
+    monkeypatch.setitem(MentionedBot.commands, "t-bridged", bridged)
+    if async_mode:
+        asyncio.run(MentionedBot.process_command_async(BOT_ID, SimpleNamespace(client=async_client), mention("t-bridged")))
+    else:
+        MentionedBot.process_command(BOT_ID, SimpleNamespace(client=client), mention("t-bridged"))
+
+    assert [message["text"] for message in client.posted] == ["Working...", "Error: after responding"]
+    assert [update["text"] for update in client.updated] == ["result"]
+
+
+def test_async_progress_can_be_reported_from_a_worker_thread(monkeypatch, clients):
+    client, async_client = clients
+    monkeypatch.setattr(slack_app, "PROGRESS_INTERVAL", 0)
+
+    async def slow(context, slack_tool):
+        # like AsyncPagerDuty.get_summary_from_schedule, which reports from asyncio.to_thread
+        await asyncio.to_thread(slack_tool.progress, "halfway")
+        await slack_tool.responser("done")
+
+    monkeypatch.setitem(
+        MentionedBot.commands, "t-slow", command("t-slow", async_func=slow)._replace(placeholder="Working...")
+    )
+    asyncio.run(MentionedBot.process_command_async(BOT_ID, SimpleNamespace(client=async_client), mention("t-slow")))
+
+    assert [message["text"] for message in client.posted] == ["Working..."]
+    assert [update["text"] for update in client.updated] == ["halfway", "done"]
+
+
+class FakeUserTool(object):
+
+    def __init__(self, errors):
+        self.errors = errors
+        self.lookups = []
+
+    def get_user_info(self, user_id):
+        self.lookups.append(user_id)
+        if user_id in self.errors:
+            raise SlackApiError(self.errors[user_id], {"ok": False, "error": self.errors[user_id]})
+        return {"id": user_id, "name": user_id.lower(), "profile": {"email": f"{user_id.lower()}@example.com"}}
+
+
+class FakeJira(object):
+
+    def get_mention_name(self, email):
+        return None if email.startswith("nojira") else f"acct-{email.split('@')[0]}"
+
+
+def test_jira_mentions_cache_real_misses_but_not_transient_errors(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path}/local.db")
+    local_metadata.create_all(engine)
+    cache = JiraIdentityCache(engine, ttl=3600, negative_ttl=60)
+    monkeypatch.setattr(jira, "_identity_cache", cache)
+    tool = FakeUserTool({"UGONE": "user_not_found", "UFLAKY": "internal_error"})
+    user_ids = ["U1", "U2", "NOJIRA", "UGONE", "UFLAKY"]
+
+    mentions = resolve_jira_mentions(tool, FakeJira(), user_ids)
+    assert mentions == {
+        "U1": "[~acct-u1]", "U2": "[~acct-u2]", "NOJIRA": "nojira", "UGONE": "UGONE", "UFLAKY": "UFLAKY",
+    }
+    assert sorted(tool.lookups) == sorted(user_ids)
+
+    # everything but the internal_error is served from the cache the second time
+    assert set(cache.get_many(user_ids)) == {"U1", "U2", "NOJIRA", "UGONE"}
+    tool.lookups.clear()
+    assert resolve_jira_mentions(tool, FakeJira(), user_ids) == mentions
+    assert tool.lookups == ["UFLAKY"]
@@ -0,0 +1,43 @@
+import pytest
+
+from oncall_bot.metrics import Counter, Histogram, Registry, create_metrics_app, timed
+
+
+def test_registry_renders_metrics_and_collectors():
+    registry = Registry()
+    commands = registry.register(Counter("test_commands_total", "Commands", ("command", "status")))
+    seconds = registry.register(Histogram("test_seconds", "Latency", ("call",), buckets=(0.1, 1)))
+    commands.inc(command="summary", status="success")
+    commands.inc(command="summary", status="success")
+    seconds.observe(0.5, call="oncalls")
+    registry.register_collector(
+        "queue", lambda: [{"cache": "users", "hits": 3, "hit_rate": None, "loaded": True}], gauges=("loaded",)
+    )
+    registry.register_collector("startup", lambda: {"imports_seconds": 0.5})
+
+    text = create_metrics_app(registry).test_client().get("/metrics").get_data(as_text=True)
+    assert 'oncall_bot_test_commands_total{command="summary",status="success"} 2' in text
+    assert 'oncall_bot_test_seconds_bucket{call="oncalls",le="0.1"} 0' in text
+    assert 'oncall_bot_test_seconds_bucket{call="oncalls",le="+Inf"} 1' in text
+    assert 'oncall_bot_test_seconds_count{call="oncalls"} 1' in text
+    # cumulative stats are counters, the values named as gauges are point-in-time
+    assert "# TYPE oncall_bot_queue_hits_total counter" in text
+    assert 'oncall_bot_queue_hits_total{cache="users"} 3' in text
+    assert "# TYPE oncall_bot_queue_loaded gauge" in text
+    assert 'oncall_bot_queue_loaded{cache="users"} 1' in text
+    assert "# TYPE oncall_bot_startup_imports_seconds gauge" in text
+    assert "hit_rate" not in text
+
+
+def test_timed_records_errors():
+    seconds = Histogram("test_timed_seconds", "Latency", ("call", "status"))
+
+    @timed(seconds, call="create_issue")
+    def create_issue(fail):
+        if fail:
+            raise ValueError("boom")
+
+    create_issue(False)
+    with pytest.raises(ValueError):
+        create_issue(True)
+    assert set(seconds.values) == {("create_issue", "ok"), ("create_issue", "error")}
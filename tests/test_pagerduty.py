@@ -0,0 +1,167 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pdpyras import APISession
+
+from oncall_bot import pagerduty
+from oncall_bot.mention_bot import format_summary
+from tests.fakes import ONCALL_USER, SCHEDULE_ID, FakePagerDutyAdapter, UpstreamCalls, fake_oncall
+
+USER = {"name": ONCALL_USER["name"], "email": ONCALL_USER["email"], "time_zone": ONCALL_USER["time_zone"]}
+
+
+@pytest.fixture
+def fake_pagerduty(monkeypatch):
+    def create(**kwargs):
+        calls = UpstreamCalls()
+        session = APISession("test-token")
+        session.mount("https://", FakePagerDutyAdapter(calls, kwargs.pop("incidents", []), **kwargs))
+        monkeypatch.setattr(pagerduty, "_sessions", {"test-token": session})
+        return pagerduty.PagerDuty("test-token"), calls
+    return create
+
+
+def test_oncall_is_cached_until_the_shift_ends(fake_pagerduty):
+    client, calls = fake_pagerduty()
+    now = datetime.now(timezone.utc)
+
+    # a shift that has already ended expires the entry even though the ttl hasn't passed
+    ended = fake_oncall(end=(now - timedelta(minutes=1)).isoformat())
+    assert client.cache_schedule_oncalls(SCHEDULE_ID, [ended], now - timedelta(minutes=5)) == [USER]
+    assert client.oncall_cache.get(SCHEDULE_ID) is None
+
+    ongoing = fake_oncall(end=(now + timedelta(minutes=10)).isoformat())
+    client.cache_schedule_oncalls(SCHEDULE_ID, [ongoing], now)
+    assert client.oncall_cache.get(SCHEDULE_ID) == [USER]
+
+    # without an end the configured ttl applies
+    client.cache_schedule_oncalls(SCHEDULE_ID, [fake_oncall(end=None)], now - timedelta(seconds=3601))
+    assert client.oncall_cache.get(SCHEDULE_ID) is None
+    client.cache_schedule_oncalls(SCHEDULE_ID, [fake_oncall(end=None)], now - timedelta(seconds=3500))
+    assert client.oncall_cache.get(SCHEDULE_ID) == [USER]
+    assert calls.counts == {}
+
+
+def test_schedules_without_an_escalation_policy_fall_back_to_schedule_users(fake_pagerduty):
+    client, calls = fake_pagerduty(oncalls=[])
+    assert client.get_oncall_from_schedule(SCHEDULE_ID) == [USER]
+    assert client.get_oncall_from_schedule(SCHEDULE_ID) == [USER]
+    assert calls.counts == {"pagerduty.GET /oncalls": 1, f"pagerduty.GET /schedules/{SCHEDULE_ID}/users": 1}
+
+
+def user(user_id, name):
+    return {"id": user_id, "name": name, "email": f"{name.lower()}@example.com", "time_zone": "UTC"}
+
+
+POLICY = {
+    "escalation_policy": {
+        "id": "PPOLICY1",
+        "escalation_rules": [
+            {"targets": [
+                {"type": "schedule_reference", "id": SCHEDULE_ID},
+                {"type": "user_reference", "id": "PUSER2"},
+                {"type": "user_reference", "id": "PUSER1"},
+            ]},
+            {"targets": [{"type": "user_reference", "id": "PUSER3"}]},
+        ],
+    }
+}
+
+
+def test_escalation_targets_resolve_concurrently_per_level(fake_pagerduty):
+    client, calls = fake_pagerduty(resources={
+        "/escalation_policies/PPOLICY1": POLICY,
+        "/users/PUSER1": {"user": ONCALL_USER},
+        "/users/PUSER2": {"user": user("PUSER2", "Bob")},
+        "/users/PUSER3": {"user": user("PUSER3", "Cy")},
+    })
+    names = lambda users: [u["name"] for u in users]  # noqa: E731
+
+    assert names(client.get_oncall_from_escalation_policy("PPOLICY1")) == ["Ada", "Bob"]
+    assert names(client.get_oncall_from_escalation_policy("PPOLICY1", levels=2)) == ["Ada", "Bob", "Cy"]
+    # an explicit 0 is not replaced by the configured default
+    assert client.get_oncall_from_escalation_policy("PPOLICY1", levels=0) == []
+    assert calls.counts["pagerduty.GET /users/PUSER2"] == 1
+
+
+def test_fanout_runs_nested_work_inline():
+    pool = pagerduty.FanoutPool(1, "test-fanout")
+    # with one worker, a nested submit that queued on the pool would wait forever
+    assert pool.map(lambda n: sum(pool.map(lambda m: m * n, [1, 2])), [1, 2]) == [3, 6]
+    with pytest.raises(ZeroDivisionError):
+        pool.map(lambda n: pool.submit(lambda: 1 / n).result(), [0])
+
+
+def test_bulk_oncall_chunks_requests_and_maps_results_back(fake_pagerduty):
+    bob, cy = user("PUSER2", "Bob"), user("PUSER3", "Cy")
+    client, calls = fake_pagerduty(
+        oncalls=[
+            fake_oncall(schedule_id="PS1"),
+            fake_oncall(user=bob, schedule_id="PS2"),
+            fake_oncall(user=cy, schedule_id="PS3", policy_id="PP2"),
+            fake_oncall(user=bob, schedule_id=None, policy_id="PP2", level=2),
+        ],
+        resources={"/services/PSVC1": {"service": {"escalation_policy": {"id": "PP2"}}}},
+    )
+    urls = [
+        "https://acme.pagerduty.com/schedules/PS1",
+        "https://acme.pagerduty.com/schedules/PS2",
+        "https://acme.pagerduty.com/schedules/PS3",
+        "https://acme.pagerduty.com/escalation_policies/PP2",
+        "https://acme.pagerduty.com/service-directory/PSVC1",
+        "https://example.com/not-pagerduty",
+    ]
+
+    result = client.get_oncall_bulk(urls, chunk_size=2)
+    assert [[u["name"] for u in result[url]] for url in urls] == [["Ada"], ["Bob"], ["Cy"], ["Cy"], ["Cy"], []]
+    # three schedules in chunks of two, then one call for the policies
+    assert calls.counts["pagerduty.GET /oncalls"] == 3
+
+    calls.reset()
+    client.oncall_cache.stats.clear()
+    assert client.get_oncall_bulk(urls[:3]) == {url: result[url] for url in urls[:3]}
+    assert calls.counts == {}
+    assert client.oncall_cache.stats == {"hits": 3}
+
+
+def incidents(count):
+    return [{"id": f"PINC{i}", "title": "Alert", "created_at": f"2024-01-01T00:00:{i % 60:02d}+00:00"} for i in range(count)]
+
+
+def test_incident_pages_are_fetched_concurrently_in_windows(fake_pagerduty):
+    client, calls = fake_pagerduty(incidents=incidents(1050))
+    progress = []
+    pages = list(client.iter_incident_pages({"team_ids": ["PTEAM1"]}, progress=lambda *p: progress.append(p)))
+
+    assert sorted(incident["id"] for page in pages for incident in page) == sorted(f"PINC{i}" for i in range(1050))
+    assert calls.counts["pagerduty.GET /incidents"] == 11
+    assert progress[0] == (100, 1050) and progress[-1] == (1050, 1050)
+
+
+def test_truncated_paging_is_reported_and_shown_in_the_summary(fake_pagerduty):
+    client, calls = fake_pagerduty(incidents=incidents(250))
+    truncated = []
+    pages = list(client.iter_incident_pages({}, max_pages=2, truncated=lambda *t: truncated.append(t)))
+
+    assert sum(len(page) for page in pages) == 200
+    assert truncated == [(200, 250)]
+    assert calls.counts["pagerduty.GET /incidents"] == 2
+
+    summary = {"total_pages": 200, "weekend_pages": 0, "out_of_hours_pages": 0, "group_by_titles": [], "truncated_at": 200}
+    assert format_summary(summary, None)[1] == "Total Pages: 200 (truncated at 200 incidents)"
+    assert format_summary({**summary, "truncated_at": None}, None)[1] == "Total Pages: 200"
+
+
+def test_incident_pages_are_followed_sequentially_without_a_total(fake_pagerduty):
+    client, calls = fake_pagerduty(incidents=incidents(250), report_total=False)
+    progress = []
+    pages = list(client.iter_incident_pages({}, progress=lambda *p: progress.append(p)))
+
+    assert [incident["id"] for page in pages for incident in page] == [f"PINC{i}" for i in range(250)]
+    assert calls.counts["pagerduty.GET /incidents"] == 3
+    assert progress == [(100, None), (200, None), (250, None)]
+
+    truncated = []
+    pages = list(client.iter_incident_pages({}, max_pages=2, truncated=lambda *t: truncated.append(t)))
+    assert sum(len(page) for page in pages) == 200
+    assert truncated == [(200, None)]
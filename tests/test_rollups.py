@@ -0,0 +1,111 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import create_engine, update
+
+from oncall_bot import rollups as rollups_module
+from oncall_bot.tables import DailyRollup, local_metadata
+from oncall_bot.rollups import DailyRollups, empty_counts
+from oncall_bot.storage import SQLStorage
+
+TRACKING_URL = "https://docs.google.com/spreadsheets/d/tracking"
+
+
+def make_rollups(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/local.db")
+    local_metadata.create_all(engine)
+    return DailyRollups(engine)
+
+
+def test_request_summary_is_served_from_daily_rollups(tmp_path):
+    storage = SQLStorage(create_engine(f"sqlite:///{tmp_path}/storage.db"))
+    storage.rollups = make_rollups(tmp_path)
+    table = storage.tracking_table(TRACKING_URL)
+    storage.upsert_many(table, {
+        "https://slack/1": {"requested_at": datetime(2024, 1, 1, 10), "subject": "Code Review"},
+        "https://slack/2": {"requested_at": datetime(2024, 1, 2, 11), "subject": "Question"},
+        "https://slack/3": {"requested_at": datetime(2024, 1, 3, 9), "completed_at": datetime(2024, 1, 3, 12)},
+        "https://slack/4": {"requested_at": datetime(2024, 1, 5, 18), "subject": "Code Review"},
+    })
+
+    summary = storage.get_summary(TRACKING_URL, datetime(2024, 1, 1, 12), datetime(2024, 1, 5, 12))
+    assert summary["total_requests"] == 2
+    assert summary["total_PR_reuqests"] == 0
+    assert summary["unresolved_count"] == 1
+    # Jan 2 through Jan 4 are whole days, the edges come from raw rows
+    assert storage.rollups.metrics()["days_materialized"] == 3
+
+    summary = storage.get_summary(TRACKING_URL, datetime(2024, 1, 1), datetime(2024, 1, 6))
+    assert summary["total_requests"] == 4
+    assert summary["total_PR_reuqests"] == 2
+    assert storage.rollups.metrics()["days_materialized"] == 5
+
+    storage.upsert_table(table, "https://slack/5", {"requested_at": datetime(2024, 1, 2, 15), "subject": "Code Review"})
+    summary = storage.get_summary(TRACKING_URL, datetime(2024, 1, 1), datetime(2024, 1, 6))
+    assert summary["total_requests"] == 5
+    assert summary["total_PR_reuqests"] == 3
+    assert storage.rollups.metrics()["days_invalidated"] == 1
+    assert storage.rollups.metrics()["days_materialized"] == 6
+
+
+def counting_calls(calls):
+    def daily_counts(since, until):
+        calls.append((since, until))
+        counts = empty_counts()
+        counts["total"] = 1
+        return {since.date(): counts}
+
+    return daily_counts
+
+
+def test_today_is_never_materialized(tmp_path, monkeypatch):
+    monkeypatch.setattr(rollups_module, "local_today", lambda time_zone: date(2024, 3, 10))
+    rollups = make_rollups(tmp_path)
+    calls = []
+    daily_counts = counting_calls(calls)
+
+    today = datetime(2024, 3, 10)
+    totals = rollups.summarize("pages", "TEAM", today - timedelta(days=2), today + timedelta(hours=5), daily_counts)
+
+    assert calls == [
+        (today - timedelta(days=2), today),
+        (today, today + timedelta(hours=5, microseconds=1)),
+    ]
+    assert totals["total"] == 2
+    assert rollups.metrics()["days_materialized"] == 2
+
+
+def test_days_outside_the_complete_range_are_not_materialized(tmp_path, monkeypatch):
+    monkeypatch.setattr(rollups_module, "local_today", lambda time_zone: date(2024, 3, 10))
+    rollups = make_rollups(tmp_path)
+    calls = []
+
+    # the archive only has Mar 1 through midday Mar 4, e.g. after a truncated sync
+    totals = rollups.summarize(
+        "pages", "TEAM", datetime(2024, 3, 1), datetime(2024, 3, 7), counting_calls(calls),
+        complete=(datetime(2024, 3, 1), datetime(2024, 3, 4, 12)),
+    )
+
+    assert calls == [
+        (datetime(2024, 3, 1), datetime(2024, 3, 4)),
+        (datetime(2024, 3, 4), datetime(2024, 3, 7, 0, 0, 0, 1)),
+    ]
+    assert totals["total"] == 2
+    assert rollups.metrics()["days_materialized"] == 3
+
+
+def test_recent_rollups_older_than_max_age_are_rebuilt(tmp_path, monkeypatch):
+    monkeypatch.setattr(rollups_module, "local_today", lambda time_zone: date(2024, 3, 10))
+    rollups = make_rollups(tmp_path)
+    calls = []
+    args = ("requests", "SHEET", datetime(2024, 3, 1), datetime(2024, 3, 10), counting_calls(calls))
+
+    rollups.summarize(*args, max_age=3600, recent_days=2)
+    rollups.summarize(*args, max_age=3600, recent_days=2)
+    assert rollups.metrics()["days_materialized"] == 9
+
+    with rollups.engine.begin() as conn:
+        conn.execute(update(DailyRollup).values(materialized_at=datetime(2024, 3, 1)))
+    # only March 8th and 9th are recent enough to have changed since
+    rollups.summarize(*args, max_age=3600, recent_days=2)
+    assert rollups.metrics()["days_materialized"] == 11
+    assert (datetime(2024, 3, 8), datetime(2024, 3, 10)) in calls[-2:]
@@ -0,0 +1,87 @@
+from collections import Counter
+
+from oncall_bot.slack_app import Context, SlackTool, SlackUserIndex, get_slack_read_cache
+
+
+class FakeClient(object):
+
+    def __init__(self):
+        self.calls = Counter()
+
+    def conversations_info(self, channel):
+        self.calls["conversations_info"] += 1
+        return {"channel": {"name": "team-oncall", "topic": {"value": "https://x.pagerduty.com/schedules/P1"}}}
+
+    def conversations_history(self, channel, latest, limit, inclusive):
+        self.calls["conversations_history"] += 1
+        return {"messages": [{"ts": latest, "text": "help"}]}
+
+
+def test_channel_info_is_shared_within_and_across_commands():
+    get_slack_read_cache().invalidate_channel("C1")
+    client = FakeClient()
+    context = Context("C1", "1.0", [], "1.0", "U1")
+
+    slack_tool = SlackTool(client, context)
+    assert slack_tool.get_channel_topic("C1") == "https://x.pagerduty.com/schedules/P1"
+    assert slack_tool.get_channel_name_from_channel_id("C1") == "#team-oncall"
+    assert slack_tool.get_thread_first_message("1.0")["text"] == "help"
+    assert slack_tool.get_thread_first_message("1.0")["text"] == "help"
+
+    SlackTool(client, context).get_channel_topic("C1")
+    assert client.calls == {"conversations_info": 1, "conversations_history": 1}
+
+    get_slack_read_cache().invalidate_channel("C1")
+    SlackTool(client, context).get_channel_topic("C1")
+    assert client.calls["conversations_info"] == 2
+    assert get_slack_read_cache().request_stats["hits"] >= 2
+
+
+def test_latest_message_and_fresh_reads_skip_the_thread_root_cache():
+    client = FakeClient()
+    context = Context("C1", "2.0", [], None, "U1")
+
+    slack_tool = SlackTool(client, context)
+    slack_tool.get_thread_first_message(None)
+    slack_tool.get_thread_first_message(None)
+    assert client.calls["conversations_history"] == 2
+
+    slack_tool.get_thread_first_message("2.0")
+    slack_tool.get_thread_first_message("2.0", fresh=True)
+    assert client.calls["conversations_history"] == 4
+
+
+class FakeUsersClient(object):
+
+    def __init__(self, pages):
+        self.pages = pages
+
+    def users_list(self, limit, cursor=None):
+        index = int(cursor or 0)
+        next_cursor = str(index + 1) if index + 1 < len(self.pages) else ""
+        return {"members": self.pages[index], "response_metadata": {"next_cursor": next_cursor}}
+
+
+def slack_user(user_id, email, **extra):
+    return {"id": user_id, "name": user_id.lower(), "profile": {"email": email}, **extra}
+
+
+def test_user_index_builds_from_every_page_and_follows_user_changes():
+    index = SlackUserIndex()
+    index.build(FakeUsersClient([
+        [slack_user("U1", "Ada@example.com"), slack_user("B1", "bot@example.com", is_bot=True)],
+        [slack_user("U2", "bob@example.com")],
+    ]))
+    assert index.loaded
+    assert index.get("ada@example.com")["id"] == "U1"
+    assert index.get("bob@example.com")["id"] == "U2"
+    assert index.get("bot@example.com") is None
+
+    # a changed address no longer finds the user under the old one
+    index.update(slack_user("U1", "ada@new.example.com"))
+    assert index.get("ada@example.com") is None
+    assert index.get("ada@new.example.com")["id"] == "U1"
+
+    index.update(slack_user("U2", "bob@example.com", deleted=True))
+    assert index.get("bob@example.com") is None
+    assert index.metrics()["users"] == 1
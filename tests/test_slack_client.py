@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+
+from oncall_bot.slack_client import RateLimitedWebClient, SlackRateLimiter
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_limiter_queues_past_the_burst_and_pauses_after_429():
+    clock = FakeClock()
+    limiter = SlackRateLimiter(clock)
+    # users.list is tier 2: 20 a minute with bursts of 5
+    waits = [limiter.reserve("users.list", {}) for _ in range(7)]
+    assert waits[:5] == [0, 0, 0, 0, 0]
+    assert waits[5:] == [3.0, 6.0]
+
+    # chat.postMessage is paced per channel
+    assert limiter.reserve("chat.postMessage", {"channel": "C1"}) == 0
+    assert limiter.reserve("chat.postMessage", {"channel": "C2"}) == 0
+
+    limiter.throttled("chat.postMessage", {"channel": "C1"}, 30)
+    assert limiter.reserve("chat.postMessage", {"channel": "C1"}) == 30
+    clock.now = 31
+    assert limiter.reserve("chat.postMessage", {"channel": "C1"}) == 0
+    assert limiter.metrics()["throttled.chat.postMessage"] == 1
+
+
+def test_client_retries_429s_and_coalesces_identical_reads(monkeypatch):
+    calls = Counter()
+
+    def api_call(self, api_method, **kwargs):
+        calls[api_method] += 1
+        if api_method == "users.lookupByEmail" and calls[api_method] == 1:
+            raise SlackApiError("ratelimited", SimpleNamespace(status_code=429, headers={"Retry-After": "0.05"}))
+        time.sleep(0.1)
+        return {"ok": True, "method": api_method}
+
+    monkeypatch.setattr(WebClient, "api_call", api_call)
+    limiter = SlackRateLimiter()
+    client = RateLimitedWebClient(token="xoxb-test", limiter=limiter)
+
+    assert client.users_lookupByEmail(email="ada@example.com")["ok"]
+    assert calls["users.lookupByEmail"] == 2
+    assert limiter.metrics()["throttled"] == 1
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(client.conversations_info(channel="C1")))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 5
+    assert calls["conversations.info"] == 1
+    assert limiter.metrics()["coalesced"] == 4
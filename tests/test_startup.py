@@ -0,0 +1,54 @@
+import json
+import subprocess
+import sys
+from dataclasses import fields
+
+from oncall_bot.config import Config
+from oncall_bot.startup import LAZY_MODULES, StartupProfile
+
+# the same budget the bot warns about at startup
+IMPORT_BUDGET_SECONDS = next(field.default for field in fields(Config) if field.name == "startup_import_budget")
+
+IMPORT_MAIN = """
+import json, sys, time
+started_at = time.perf_counter()
+import oncall_bot.main
+seconds = time.perf_counter() - started_at
+print(json.dumps({"seconds": seconds, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+
+def slowest_imports(limit=15):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import oncall_bot.main"], capture_output=True, text=True
+    )
+    rows = [line.split("|") for line in result.stderr.splitlines() if line.startswith("import time:")][1:]
+    rows.sort(key=lambda row: -int(row[1]))
+    return "\n".join(f"{int(row[1]) / 1e6:.3f}s {row[2].rstrip()}" for row in rows[:limit])
+
+
+def test_main_imports_within_budget_and_leaves_clients_lazy():
+    result = subprocess.run([sys.executable, "-c", IMPORT_MAIN], capture_output=True, text=True, check=True)
+    profile = json.loads(result.stdout.strip().splitlines()[-1])
+
+    assert profile["loaded"] == [], f"loaded at startup: {profile['loaded']}\n{slowest_imports()}"
+    assert profile["seconds"] < IMPORT_BUDGET_SECONDS, (
+        f"importing oncall_bot.main took {profile['seconds']:.2f}s\n{slowest_imports()}"
+    )
+
+
+def test_profile_reports_marks_and_warm_ups():
+    profile = StartupProfile()
+    profile.mark("socket_connected")
+    assert not profile.mark("socket_connected")
+
+    def fail():
+        raise RuntimeError("no network")
+
+    profile.start_warm_up({"json": lambda: json, "broken": fail}).join()
+    profile.event_handled()
+
+    metrics = profile.metrics()
+    assert set(metrics) >= {"socket_connected_seconds", "warm_up_seconds", "first_event_seconds"}
+    assert metrics["warm_up_errors"] == 1
+    assert "warm up broken" in profile.report()
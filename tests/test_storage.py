@@ -0,0 +1,219 @@
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import create_engine, event
+
+from oncall_bot import storage as storage_module
+from oncall_bot.config import Config
+from oncall_bot.gsheet import Storage
+from oncall_bot.migrate_storage import migrate
+from oncall_bot.storage import SQLStorage, StorageMirror
+from oncall_bot.tables import OncallInfo, get_tracking_table
+
+
+@pytest.fixture
+def storage():
+    engine = create_engine("sqlite://")
+    OncallInfo.metadata.create_all(engine)
+    storage = Storage(engine)
+    storage.replicate(OncallInfo, 60)
+    return storage
+
+
+def test_replica_serves_reads_and_writes_through(storage):
+    storage.upsert_table(OncallInfo, "C1", {OncallInfo.c.pagerduty_url.name: "https://x.pagerduty.com/schedules/P1"})
+    storage.refresh_replicas()
+
+    storage.upsert_table(OncallInfo, "C1", {OncallInfo.c.channel_name.name: "#team"})
+    row = storage.query_table(OncallInfo, "C1", [OncallInfo.c.pagerduty_url, OncallInfo.c.channel_name])
+
+    assert row == {"pagerduty_url": "https://x.pagerduty.com/schedules/P1", "channel_name": "#team"}
+    assert storage.query_table(OncallInfo, "C2", [OncallInfo.c.pagerduty_url]) is None
+    metrics = storage.replica_metrics()[0]
+    assert metrics["hits"] == 1
+    assert metrics["misses"] == 1
+
+
+def test_replica_refresh_diffs_backend_changes(storage):
+    storage.refresh_replicas()
+    with storage.engine.begin() as conn:
+        conn.execute(OncallInfo.insert().values(channel_id="C3", channel_name="#other"))
+
+    assert storage.query_table(OncallInfo, "C3", [OncallInfo.c.channel_name]) is None
+    storage.refresh_replicas()
+    assert storage.query_table(OncallInfo, "C3", [OncallInfo.c.channel_name]) == {"channel_name": "#other"}
+    assert storage.replica_metrics()[0]["rows_added"] == 1
+
+
+@pytest.mark.parametrize("storage_class", [Storage, SQLStorage])
+def test_upsert_many_inserts_and_updates_in_one_call(tmp_path, storage_class):
+    storage = storage_class(create_engine(f"sqlite:///{tmp_path}/storage.db"))
+    OncallInfo.metadata.create_all(storage.engine)
+    storage.upsert_table(OncallInfo, "C1", {"channel_name": "#one", "pagerduty_url": "https://x.pagerduty.com/schedules/P1"})
+
+    storage.upsert_many(OncallInfo, {
+        "C1": {"channel_name": "#renamed"},
+        "C2": {"channel_name": "#two"},
+        "C3": {"jira_project": "OPS"},
+    })
+
+    with storage.engine.connect() as conn:
+        rows = {row.channel_id: row for row in conn.execute(OncallInfo.select())}
+    assert rows["C1"].channel_name == "#renamed"
+    assert rows["C1"].pagerduty_url == "https://x.pagerduty.com/schedules/P1"
+    assert rows["C2"].channel_name == "#two"
+    assert rows["C3"].jira_project == "OPS"
+
+
+def test_get_summary_counts_in_the_database(tmp_path):
+    storage = SQLStorage(create_engine(f"sqlite:///{tmp_path}/storage.db"))
+    url = "https://docs.google.com/spreadsheets/d/tracking"
+    storage.upsert_many(storage.tracking_table(url), {
+        "https://slack/1": {"requested_at": datetime(2024, 1, 2), "subject": "Code Review"},
+        "https://slack/2": {"requested_at": datetime(2024, 1, 3), "subject": "Question", "requested_team": "ads"},
+        "https://slack/3": {"requested_at": datetime(2024, 1, 4), "completed_at": datetime(2024, 1, 5)},
+        "https://slack/4": {"requested_at": datetime(2023, 1, 1), "subject": "Code Review"},
+    })
+
+    summary = storage.get_summary(url, datetime(2024, 1, 1), datetime(2024, 2, 1))
+
+    assert summary["total_requests"] == 3
+    assert summary["total_PR_reuqests"] == 1
+    assert summary["total_support_reuqests"] == 2
+    assert summary["unresolved_count"] == 2
+    assert list(summary["unresolved_requests"]) == [
+        {"slack_url": "https://slack/1", "subject": "Code Review", "requested_team": None},
+        {"slack_url": "https://slack/2", "subject": "Question", "requested_team": "ads"},
+    ]
+
+
+def test_daily_request_counts_are_grouped_in_the_database(tmp_path):
+    storage = SQLStorage(create_engine(f"sqlite:///{tmp_path}/storage.db"))
+    table = storage.tracking_table("https://docs.google.com/spreadsheets/d/tracking")
+    storage.upsert_many(table, {
+        "https://slack/1": {"requested_at": datetime(2024, 1, 2, 9), "subject": "Code Review"},
+        "https://slack/2": {"requested_at": datetime(2024, 1, 2, 17), "subject": "Code Review"},
+        "https://slack/3": {"requested_at": datetime(2024, 1, 2, 18), "subject": "Question"},
+        "https://slack/4": {"requested_at": datetime(2024, 1, 3, 23, 59)},
+        "https://slack/5": {"requested_at": datetime(2024, 1, 4)},
+    })
+
+    days = storage.daily_request_counts(table, datetime(2024, 1, 2), datetime(2024, 1, 4))
+
+    assert {day: (counts["total"], counts["code_review"], counts["support"]) for day, counts in days.items()} == {
+        date(2024, 1, 2): (3, 2, 1),
+        date(2024, 1, 3): (1, 0, 1),
+    }
+
+
+@pytest.mark.parametrize("storage_url, mirror", [(None, False), ("sqlite://", False), ("sqlite://", True)])
+def test_get_storage_selects_the_backend_from_config(monkeypatch, storage_url, mirror):
+    sheets = Storage(create_engine("sqlite://"))
+    rollups = object()
+    monkeypatch.setattr(storage_module, "_storage", None)
+    monkeypatch.setattr(storage_module, "get_gsheet_storage", lambda: sheets)
+    monkeypatch.setattr(storage_module, "get_daily_rollups", lambda: rollups)
+    monkeypatch.setattr(
+        storage_module, "load_config", lambda: Config(storage_url=storage_url, storage_mirror_to_gsheets=mirror)
+    )
+
+    storage = storage_module.get_storage()
+    assert storage.rollups is rollups
+    if storage_url is None:
+        assert storage is sheets
+    else:
+        assert isinstance(storage, SQLStorage)
+        assert OncallInfo.name in storage.replicas
+        assert (storage.mirror.target if mirror else storage.mirror) is (sheets if mirror else None)
+
+
+class FlakyTarget(Storage):
+
+    def __init__(self, path, failures):
+        super().__init__(create_engine(f"sqlite:///{path}"))
+        OncallInfo.metadata.create_all(self.engine)
+        self.failures = failures
+        self.attempts = 0
+
+    def upsert_many(self, table, rows):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise RuntimeError("sheets unavailable")
+        super().upsert_many(table, rows)
+
+
+@pytest.mark.parametrize("failures, mirrored", [(2, True), (3, False)])
+def test_mirror_retries_and_counts_batches_it_gives_up_on(tmp_path, monkeypatch, failures, mirrored):
+    monkeypatch.setattr(storage_module.time, "sleep", lambda seconds: None)
+    target = FlakyTarget(tmp_path / "sheets.db", failures)
+    storage = SQLStorage(create_engine("sqlite://"), StorageMirror(target, max_retries=3))
+
+    storage.upsert_table(OncallInfo, "C1", {"channel_name": "#one"})
+    storage.mirror.queue.join()
+
+    assert storage.mirror.failures == (0 if mirrored else 1)
+    assert target.query_table(OncallInfo, "C1", [OncallInfo.c.channel_name]) == (
+        {"channel_name": "#one"} if mirrored else None
+    )
+    # the primary write never depends on the mirror
+    assert storage.query_table(OncallInfo, "C1", [OncallInfo.c.channel_name]) == {"channel_name": "#one"}
+
+
+def test_migrate_copies_oncall_info_and_every_tracking_sheet(tmp_path):
+    source = Storage(create_engine(f"sqlite:///{tmp_path}/sheets.db"))
+    OncallInfo.metadata.create_all(source.engine)
+    url = "https://docs.google.com/spreadsheets/d/tracking"
+    get_tracking_table(url).create(source.engine)
+    source.upsert_many(OncallInfo, {
+        "C1": {"channel_name": "#one", "tracking_sheet": url},
+        "C2": {"channel_name": "#two"},
+    })
+    source.upsert_many(source.tracking_table(url), {
+        f"https://slack/{i}": {"requested_at": datetime(2024, 1, i + 1), "subject": "Question"} for i in range(5)
+    })
+
+    target = SQLStorage(create_engine(f"sqlite:///{tmp_path}/target.db"))
+    migrate(source, target)
+
+    with target.engine.connect() as conn:
+        assert {row.channel_id for row in conn.execute(OncallInfo.select())} == {"C1", "C2"}
+        assert len(conn.execute(target.tracking_table(url).select()).fetchall()) == 5
+    assert target.get_summary(url, datetime(2024, 1, 1), datetime(2024, 2, 1))["total_requests"] == 5
+
+
+def test_writes_check_the_backend_for_rows_added_outside_the_bot(storage):
+    storage.refresh_replicas()
+    # added by hand after the replica was loaded, the replica still thinks C9 doesn't exist
+    with storage.engine.begin() as conn:
+        conn.execute(OncallInfo.insert().values(channel_id="C9", channel_name="#by-hand"))
+
+    storage.upsert_many(OncallInfo, {"C9": {"jira_project": "OPS"}, "C10": {"channel_name": "#new"}})
+
+    with storage.engine.connect() as conn:
+        rows = conn.execute(OncallInfo.select().order_by(OncallInfo.c.channel_id)).fetchall()
+    assert [(row.channel_id, row.channel_name, row.jira_project) for row in rows] == [
+        ("C10", "#new", None), ("C9", "#by-hand", "OPS")
+    ]
+
+
+def test_sheet_updates_setting_the_same_columns_are_batched(tmp_path):
+    storage = Storage(create_engine(f"sqlite:///{tmp_path}/storage.db"))
+    OncallInfo.metadata.create_all(storage.engine)
+    storage.upsert_many(OncallInfo, {f"C{i}": {"channel_name": f"#{i}"} for i in range(4)})
+    updates = []
+
+    @event.listens_for(storage.engine, "before_cursor_execute")
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("UPDATE"):
+            updates.append(len(parameters) if executemany else 1)
+
+    storage.upsert_many(OncallInfo, {
+        "C0": {"channel_name": "#zero"},
+        "C1": {"channel_name": "#one"},
+        "C2": {"channel_name": "#two"},
+        "C3": {"jira_project": "OPS"},
+    })
+
+    assert sorted(updates) == [1, 3]
+    assert storage.query_table(OncallInfo, "C2", [OncallInfo.c.channel_name]) == {"channel_name": "#two"}
+    assert storage.query_table(OncallInfo, "C3", [OncallInfo.c.jira_project]) == {"jira_project": "OPS"}